@@ -0,0 +1,111 @@
+"""
+Benchmark: Konvertierung DataFrame ↔ DataTable
+Vergleicht die bisherige zeilenweise Konvertierung (iterrows bzw. apply pro
+Zelle) mit den vektorisierten Pfaden aus procedures/converter.py je Datentyp
+
+Aufruf: python benchmark_converter.py [anzahl_zeilen]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from procedures.converter import dataframe_to_records, parse_currency, COLUMN_CONVERTERS
+
+
+def legacy_records(df: pd.DataFrame) -> list:
+    """Bisherige Implementierung (copy + apply pro Zelle + iterrows)"""
+    df_clean = df.copy()
+    for col in df_clean.columns:
+        if pd.api.types.is_datetime64_any_dtype(df_clean[col]):
+            df_clean[col] = df_clean[col].apply(
+                lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if pd.notna(x) else None
+            )
+        else:
+            df_clean[col] = df_clean[col].apply(
+                lambda x: None if pd.isna(x) else x
+            )
+    
+    data = []
+    for idx, row in df_clean.iterrows():
+        row_dict = {'id': int(idx) + 1}
+        for i, col in enumerate(df_clean.columns):
+            value = row[col]
+            if pd.isna(value):
+                value = None
+            elif hasattr(value, 'item'):
+                value = value.item()
+            row_dict[f"col_{i + 1}"] = value
+        data.append(row_dict)
+    return data
+
+
+def build_frames(rows: int) -> dict:
+    rng = np.random.default_rng(42)
+    floats = rng.normal(1000, 250, rows)
+    floats[::7] = np.nan
+    dates = pd.Series(pd.date_range("2020-01-01", periods=rows, freq="h"))
+    dates[::11] = pd.NaT
+    strings = pd.Series([f"Artikel {i % 500}" for i in range(rows)], dtype=object)
+    strings[::13] = None
+    nullable = pd.Series(rng.integers(0, 100, rows), dtype="Int64")
+    nullable[::5] = pd.NA
+    
+    return {
+        "integer": pd.DataFrame({"menge": rng.integers(0, 10_000, rows)}),
+        "float (NaN)": pd.DataFrame({"betrag": floats}),
+        "Int64 (NA)": pd.DataFrame({"anzahl": nullable}),
+        "datetime (NaT)": pd.DataFrame({"datum": dates}),
+        "string (None)": pd.DataFrame({"name": strings}),
+        "boolean": pd.DataFrame({"aktiv": rng.integers(0, 2, rows).astype(bool)}),
+        "gemischt": pd.DataFrame({
+            "name": strings, "menge": rng.integers(0, 10_000, rows),
+            "betrag": floats, "datum": dates
+        }),
+    }
+
+
+def build_currency_columns(rows: int) -> dict:
+    texts = ["1.234 €", "12,50 €", "7", "$ 99", "  4,2  ", None, "k.A."]
+    mixed = ["1.234 €", 7, 3.5, None, "12,50 €"]
+    return {
+        "currency Text": pd.Series([texts[i % len(texts)] for i in range(rows)], dtype=object),
+        "currency gemischt": pd.Series([mixed[i % len(mixed)] for i in range(rows)], dtype=object),
+        "currency Zahlen": pd.Series(np.arange(rows) * 0.5),
+    }
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    
+    print(f"Benchmark Serialisierung mit {rows} Zeilen")
+    print(f"{'Datentyp':<16} {'iterrows':>10} {'vektorisiert':>13} {'Faktor':>8}  Ergebnis")
+    print("-" * 62)
+    
+    for label, df in build_frames(rows).items():
+        expected, legacy_time = timed(legacy_records, df)
+        actual, vector_time = timed(dataframe_to_records, df)
+        same = "gleich" if actual == expected else "ABWEICHUNG"
+        print(f"{label:<16} {legacy_time:>9.3f}s {vector_time:>12.3f}s {legacy_time / vector_time:>7.1f}x  {same}")
+    
+    print()
+    print(f"Benchmark Laden (Typ-Konvertierung) mit {rows} Zeilen")
+    print(f"{'Spalte':<18} {'apply':>8} {'vektorisiert':>13} {'Faktor':>8}  Ergebnis")
+    print("-" * 62)
+    
+    for label, series in build_currency_columns(rows).items():
+        expected, legacy_time = timed(lambda s: s.apply(parse_currency).astype(float), series)
+        actual, vector_time = timed(COLUMN_CONVERTERS["currency"], series)
+        same = "gleich" if actual.equals(expected) else "ABWEICHUNG"
+        print(f"{label:<18} {legacy_time:>7.3f}s {vector_time:>12.3f}s {legacy_time / vector_time:>7.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
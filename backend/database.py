@@ -1,11 +1,130 @@
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+import contextvars
 import os
+import threading
+import time
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/webapp")
 
-engine = create_engine(DATABASE_URL)
+
+def _async_url(url: str) -> str:
+    """Sync-URL → URL mit asynchronem Treiber (asyncpg bzw. aiosqlite)"""
+    scheme, _, rest = url.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+
+# Asynchroner Zugriff für I/O-lastige Router (Dateien, Tabellen, Ausführungslisten)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+# Connection-Pool pro Prozess (pro uvicorn-Worker), siehe README "Datenbank-Verbindungen"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Sekunden, -1 = nie
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Eigener Pool für AsyncSessions (zählt zusätzlich zu DB_POOL_SIZE)
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", str(DB_POOL_SIZE)))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", str(DB_MAX_OVERFLOW)))
+
+
+class PoolMetrics:
+    """Zähler für Checkouts und Wartezeiten (überdauert ein Neuanlegen des Pools)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 6)
+            }
+
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+# Pro Task bzw. Thread: der asynchrone Pool checkt alle Verbindungen im Thread der
+# Event-Loop aus, ein threading.local würde parallele Checkouts dort verschlucken
+_metering: contextvars.ContextVar[bool] = contextvars.ContextVar("pool_metering", default=False)
+
+
+class _MeteredPoolMixin:
+    """Misst die Wartezeit jedes Checkouts (inkl. Verbindungsaufbau)"""
+
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        # QueuePool._do_get ruft sich bei Konkurrenz selbst auf, gezählt wird nur der äußere Aufruf
+        if _metering.get():
+            return super()._do_get()
+        token = _metering.set(True)
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        finally:
+            _metering.reset(token)
+        self.metrics.record(time.perf_counter() - started)
+        return connection
+
+
+class MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    metrics = pool_metrics
+
+
+class MeteredAsyncQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
+
+
+def _engine_options(
+    url: str,
+    poolclass=MeteredQueuePool,
+    pool_size: int = DB_POOL_SIZE,
+    max_overflow: int = DB_MAX_OVERFLOW
+) -> dict:
+    # SQLite im Speicher nutzt einen eigenen Pool (eine Verbindung pro Thread)
+    if url.startswith("sqlite") and (":memory:" in url or url.split("://", 1)[-1] in ("", "/")):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -16,3 +135,50 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **_engine_options(ASYNC_DATABASE_URL, MeteredAsyncQueuePool, DB_ASYNC_POOL_SIZE, DB_ASYNC_MAX_OVERFLOW)
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+
+async def get_async_db():
+    """
+    AsyncSession für async-Endpoints
+    Synchrone Storage-Helfer (object_session, query) laufen über db.run_sync(...)
+    auf derselben Verbindung, nicht in einer zusätzlichen SessionLocal().
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _pool_stats(pool, metrics: PoolMetrics, max_overflow: int) -> dict:
+    stats = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "max_overflow": max_overflow,
+            "timeout": DB_POOL_TIMEOUT,
+            "recycle": DB_POOL_RECYCLE,
+            "pre_ping": DB_POOL_PRE_PING,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            # Verbindungen über pool_size hinaus (SQLAlchemy zählt ab -pool_size)
+            "overflow": max(pool.overflow(), 0),
+        })
+    stats.update(metrics.snapshot())
+    return stats
+
+
+def pool_stats() -> dict:
+    """Aktueller Zustand des Connection-Pools und Checkout-Metriken"""
+    return _pool_stats(engine.pool, pool_metrics, DB_MAX_OVERFLOW)
+
+
+def async_pool_stats() -> dict:
+    """Wie pool_stats, für den Pool der AsyncSessions"""
+    return _pool_stats(async_engine.pool, async_pool_metrics, DB_ASYNC_MAX_OVERFLOW)
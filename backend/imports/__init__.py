@@ -0,0 +1,28 @@
+# Import Module
+from .excel import (
+    import_sheet, list_sheets, create_import, run_import, submit_import,
+    recover_interrupted_imports, start_import_maintenance, shutdown_imports,
+    importing_table_ids, ExcelImportError
+)
+from .bulk import (
+    plan_export, export_table, import_table, format_from_name, BULK_FORMATS, BulkFormatError
+)
+
+__all__ = [
+    'import_sheet',
+    'list_sheets',
+    'create_import',
+    'run_import',
+    'submit_import',
+    'recover_interrupted_imports',
+    'start_import_maintenance',
+    'shutdown_imports',
+    'importing_table_ids',
+    'ExcelImportError',
+    'plan_export',
+    'export_table',
+    'import_table',
+    'format_from_name',
+    'BULK_FORMATS',
+    'BulkFormatError'
+]
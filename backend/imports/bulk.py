@@ -0,0 +1,490 @@
+"""
+Bulk-Import und -Export von DataTables als Arrow IPC, Parquet und CSV
+
+Export: die Tabelle wird Chunk für Chunk (COLUMNAR_CHUNK_ROWS Zeilen) aus dem
+spaltenbasierten Speicher gelesen und als Record-Batch bzw. Row-Group bzw.
+CSV-Block gestreamt. Die Arrow-Typen der Spalten werden vorab aus den
+Schema-Köpfen der Chunk-Payloads bestimmt, ohne die Payloads zu laden.
+Spaltentyp (Typ-Vokabular des Converters), Spalten-ID und Spaltenname stehen
+in den Field-Metadaten, ein Re-Import stellt die Spalten dadurch unverändert her.
+
+Import: Datei wird in Batches von EXCEL_IMPORT_BATCH_ROWS Zeilen gelesen und
+über den ChunkWriter geschrieben. Spaltentypen kommen aus den Field-Metadaten,
+sonst aus dem Arrow-Typ (Arrow/Parquet) bzw. der Inferenz je Batch (CSV) über
+infer_column_type. Datumswerte werden wie beim Converter als
+'YYYY-MM-DD HH:MM:SS' gespeichert. Zeilen-IDs werden nur aus der eigenen
+Export-Spalte 'id' (Field-Metadaten row_id) übernommen und nur, wenn sie über
+die ganze Datei vorhanden, ganzzahlig und streng aufsteigend sind; sonst ist
+'id' eine normale Datenspalte und die Zeilen werden fortlaufend nummeriert.
+"""
+import io
+import json
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import DataTable, DataTableChunk
+from procedures.converter import DATETIME_FORMAT, infer_column_type
+from storage.columnar import (
+    ROW_ID_COLUMN, ENCODING_JSON, ChunkWriter, column_key, chunk_layout, load_chunks, is_columnar,
+    decode_array, decode_values
+)
+from .excel import IMPORT_BATCH_ROWS, _column_names, _merge_type
+
+FORMAT_ARROW = "arrow"
+FORMAT_PARQUET = "parquet"
+FORMAT_CSV = "csv"
+
+BULK_FORMATS = {
+    FORMAT_ARROW: ("application/vnd.apache.arrow.stream", "arrow"),
+    FORMAT_PARQUET: ("application/vnd.apache.parquet", "parquet"),
+    FORMAT_CSV: ("text/csv", "csv"),
+}
+
+# Schema-Kopf einer Chunk-Payload (ein Feld "v"), passt bequem in diese Größe
+_SCHEMA_PREFIX_BYTES = 1024
+
+# Spaltentypen, die ohne gespeicherte Werte (nur NULL) als float64 exportiert werden
+_NUMERIC_TYPES = ("number", "integer", "float", "currency", "percent")
+
+META_TYPE = b"type"
+META_COLUMN_ID = b"column_id"
+META_NAME = b"name"  # Originalname, falls der Feldname eindeutig gemacht wurde
+META_ROW_ID = b"row_id"  # Markiert die Zeilen-ID-Spalte eines Exports
+
+
+class BulkFormatError(ValueError):
+    """Unbekanntes Format oder nicht lesbare Datei"""
+    pass
+
+
+def format_from_name(filename: Optional[str]) -> Optional[str]:
+    """Format anhand der Dateiendung (.arrow/.arrows/.ipc, .parquet, .csv)"""
+    if not filename or "." not in filename:
+        return None
+    extension = filename.rsplit(".", 1)[1].lower()
+    if extension in ("arrow", "arrows", "ipc", "feather"):
+        return FORMAT_ARROW
+    if extension in ("parquet", "pq"):
+        return FORMAT_PARQUET
+    if extension in ("csv", "txt"):
+        return FORMAT_CSV
+    return None
+
+
+def _check_format(fmt: str) -> str:
+    if fmt not in BULK_FORMATS:
+        raise BulkFormatError(f"Unbekanntes Format '{fmt}' (erlaubt: {', '.join(BULK_FORMATS)})")
+    return fmt
+
+
+# --- Export -----------------------------------------------------------------
+
+class _StreamSink(io.RawIOBase):
+    """Schreib-Ziel für Arrow-Writer; gesammelte Bytes werden nach jedem Batch abgeholt"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer.extend(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _stored_types(db: Session, table: DataTable) -> Dict[int, List[Optional[pa.DataType]]]:
+    """
+    Arrow-Typen je Spalte und Chunk aus den Schema-Köpfen der Payloads
+    (None = JSON-kodierter Chunk mit gemischten Werten)
+    """
+    prefixes = db.query(
+        DataTableChunk.column_id,
+        DataTableChunk.encoding,
+        func.substr(DataTableChunk.payload, 1, _SCHEMA_PREFIX_BYTES)
+    ).filter(DataTableChunk.table_id == table.id)
+
+    types: Dict[int, List[Optional[pa.DataType]]] = {}
+    for column_id, encoding, prefix in prefixes:
+        if encoding == ENCODING_JSON:
+            stored = None
+        else:
+            stored = pa.ipc.open_stream(pa.py_buffer(bytes(prefix))).schema.field(0).type
+        types.setdefault(column_id, []).append(stored)
+    return types
+
+
+def _export_type(stored: List[Optional[pa.DataType]], col_type: str) -> pa.DataType:
+    """Gemeinsamer Arrow-Typ einer Spalte über alle Chunks"""
+    if any(t is None for t in stored):
+        return pa.string()
+    known = [t for t in stored if not pa.types.is_null(t)]
+    if not known:
+        return pa.float64() if col_type in _NUMERIC_TYPES else pa.string()
+    if all(t == known[0] for t in known):
+        return known[0]
+    if all(pa.types.is_integer(t) for t in known):
+        return pa.int64()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in known):
+        return pa.float64()
+    return pa.string()
+
+
+def _json_text(value) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _text_array(values: list) -> pa.Array:
+    return pa.array([_json_text(value) for value in values], type=pa.string())
+
+
+def _export_array(chunk: Optional[DataTableChunk], row_count: int, target: pa.DataType) -> pa.Array:
+    if chunk is None:
+        return pa.nulls(row_count, type=target)
+    array = decode_array(chunk)
+    if array is not None:
+        try:
+            return array.cast(target)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            if not pa.types.is_string(target):
+                # z.B. sehr große Ganzzahlen in einer float-Spalte
+                return array.cast(target, safe=False)
+    # JSON-kodiert oder nicht umwandelbar → Text (Zieltyp ist dann immer string)
+    return _text_array(decode_values(chunk))
+
+
+def _json_arrays(table: DataTable, column_ids: List[int]) -> List[pa.Array]:
+    """Spalten einer (alten) JSON-Tabelle als Arrow-Arrays"""
+    rows = table.data or []
+    arrays = []
+    for column_id in column_ids:
+        values = [row.get(column_key(column_id)) for row in rows]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            arrays.append(_text_array(values))
+    return arrays
+
+
+@dataclass
+class ExportPlan:
+    table_id: int
+    column_ids: List[int]
+    schema: pa.Schema
+
+
+def plan_export(db: Session, table: DataTable, include_ids: bool = True) -> ExportPlan:
+    """Bestimmt das Arrow-Schema des Exports (Feldnamen = Spaltennamen)"""
+    columns = table.columns or []
+    names = _column_names(tuple(["id"] + [col["name"] for col in columns]))
+    if is_columnar(table):
+        stored = _stored_types(db, table)
+    else:
+        stored = {
+            col["id"]: [array.type]
+            for col, array in zip(columns, _json_arrays(table, [col["id"] for col in columns]))
+        }
+
+    fields = []
+    column_ids = []
+    if include_ids:
+        fields.append(pa.field("id", pa.int64(), metadata={META_ROW_ID: b"true"}))
+        column_ids.append(ROW_ID_COLUMN)
+    for col, name in zip(columns, names[1:]):
+        col_type = col.get("type", "string")
+        fields.append(pa.field(
+            name,
+            _export_type(stored.get(col["id"], []), col_type),
+            metadata={
+                META_TYPE: col_type.encode(),
+                META_COLUMN_ID: str(col["id"]).encode(),
+                META_NAME: col["name"].encode()
+            }
+        ))
+        column_ids.append(col["id"])
+    return ExportPlan(table_id=table.id, column_ids=column_ids, schema=pa.schema(fields))
+
+
+def _export_batches(db: Session, plan: ExportPlan) -> Iterator[pa.RecordBatch]:
+    table = db.get(DataTable, plan.table_id)
+    if table is None:
+        return
+    if not is_columnar(table):
+        arrays = _json_arrays(table, plan.column_ids)
+        yield pa.RecordBatch.from_arrays(
+            [array.cast(field.type) for array, field in zip(arrays, plan.schema)], schema=plan.schema
+        )
+        return
+
+    for chunk_no, row_count in enumerate(chunk_layout(table)):
+        chunks = load_chunks(table, column_ids=plan.column_ids, chunk_nos=[chunk_no])
+        by_column = {chunk.column_id: chunk for chunk in chunks}
+        arrays = [
+            _export_array(by_column.get(column_id), row_count, field.type)
+            for column_id, field in zip(plan.column_ids, plan.schema)
+        ]
+        yield pa.RecordBatch.from_arrays(arrays, schema=plan.schema)
+        # Payloads nicht in der Session ansammeln
+        for chunk in chunks:
+            db.expunge(chunk)
+
+
+def export_table(
+    db: Session,
+    plan: ExportPlan,
+    fmt: str,
+    delimiter: str = ","
+) -> Iterator[bytes]:
+    """
+    Streamt die Tabelle im gewünschten Format (ein Block je Chunk)
+    Im Speicher liegt höchstens ein Chunk aller Spalten.
+    """
+    fmt = _check_format(fmt)
+    sink = _StreamSink()
+
+    if fmt == FORMAT_CSV:
+        header = True
+        for batch in _export_batches(db, plan):
+            pa_csv.write_csv(batch, sink, pa_csv.WriteOptions(include_header=header, delimiter=delimiter))
+            header = False
+            yield sink.take()
+        if header:
+            # Leere Tabelle: nur Kopfzeile
+            pa_csv.write_csv(plan.schema.empty_table(), sink, pa_csv.WriteOptions(delimiter=delimiter))
+            yield sink.take()
+        return
+
+    if fmt == FORMAT_PARQUET:
+        writer = pq.ParquetWriter(sink, plan.schema)
+    else:
+        writer = pa.ipc.new_stream(sink, plan.schema)
+    try:
+        for batch in _export_batches(db, plan):
+            writer.write_batch(batch)
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+# --- Import -----------------------------------------------------------------
+
+def _import_values(array: pa.Array) -> list:
+    """Arrow-Spalte → Werte wie serialize_column (Datum als Text, NaN → None)"""
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    if pa.types.is_timestamp(array.type) or pa.types.is_date(array.type):
+        array = pc.strftime(array.cast(pa.timestamp("s"), safe=False), format=DATETIME_FORMAT)
+    elif pa.types.is_decimal(array.type):
+        array = array.cast(pa.float64())
+    if pa.types.is_floating(array.type):
+        array = pc.if_else(pc.is_nan(array), pa.scalar(None, array.type), array)
+    return array.to_pylist()
+
+
+def _arrow_column_type(field: pa.Field) -> str:
+    """Spaltentyp aus den Field-Metadaten, sonst aus dem Arrow-Typ"""
+    metadata = field.metadata or {}
+    if META_TYPE in metadata:
+        return metadata[META_TYPE].decode()
+    data_type = field.type
+    if pa.types.is_dictionary(data_type):
+        data_type = data_type.value_type
+    if pa.types.is_date(data_type) or pa.types.is_timestamp(data_type):
+        return "date"
+    if pa.types.is_decimal(data_type):
+        data_type = pa.float64()
+    try:
+        dtype = data_type.to_pandas_dtype()
+    except NotImplementedError:
+        return "string"
+    return infer_column_type(pd.Series([], dtype=dtype), field.name)
+
+
+def _open_arrow(
+    fmt: str, source: BinaryIO, columns: Optional[List[str]] = None
+) -> Tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+    """
+    Schema und Batches einer Parquet- bzw. Arrow-Datei (Stream- oder Dateiformat)
+    columns: nur diese Spalten lesen (wirkt nur bei Parquet)
+    """
+    if fmt == FORMAT_PARQUET:
+        parquet = pq.ParquetFile(source)
+        return parquet.schema_arrow, parquet.iter_batches(batch_size=IMPORT_BATCH_ROWS, columns=columns)
+    try:
+        reader = pa.ipc.open_stream(source)
+        return reader.schema, iter(reader)
+    except pa.ArrowInvalid:
+        # Arrow-Dateiformat (Feather v2) statt Stream
+        source.seek(0)
+        reader = pa.ipc.open_file(source)
+        return reader.schema, (reader.get_batch(i) for i in range(reader.num_record_batches))
+
+
+class _BulkImport:
+    """Schreibt Batches über den ChunkWriter und führt die Spaltentypen mit"""
+
+    def __init__(self, table: DataTable, names: List[str], id_index: Optional[int]):
+        self.id_index = id_index
+        self.names = names
+        self.column_ids = list(range(1, len(names) + 1))
+        self.types: Dict[int, Optional[str]] = {cid: None for cid in self.column_ids}
+        self.writer = ChunkWriter(table, self.column_ids)
+        self.rows = 0
+
+    def row_ids(self, batch_rows: int, ids: Optional[list]) -> list:
+        if ids is not None:
+            return ids
+        return list(range(self.rows + 1, self.rows + batch_rows + 1))
+
+    def write(self, row_count: int, ids: Optional[list], values: Dict[int, list]) -> None:
+        self.writer.append(self.row_ids(row_count, ids), values)
+        self.rows += row_count
+
+    def columns(self) -> List[dict]:
+        return [
+            {"id": cid, "name": name, "type": self.types[cid] or "string"}
+            for cid, name in zip(self.column_ids, self.names)
+        ]
+
+
+def _row_id_index(schema: pa.Schema) -> Optional[int]:
+    """Position der als Zeilen-ID markierten Export-Spalte (None: keine)"""
+    for index, field in enumerate(schema):
+        if (field.metadata or {}).get(META_ROW_ID) == b"true" and pa.types.is_integer(field.type):
+            return index
+    return None
+
+
+def _valid_row_ids(batches: Iterator[pa.RecordBatch], name: str) -> bool:
+    """Zeilen-IDs über alle Batches ohne Lücken (NULL) und streng aufsteigend?"""
+    previous = None
+    for batch in batches:
+        ids = batch.column(batch.schema.get_field_index(name))
+        if ids.null_count:
+            return False
+        if len(ids) == 0:
+            continue
+        if len(ids) > 1 and not pc.all(pc.greater(ids.slice(1), ids.slice(0, len(ids) - 1))).as_py():
+            return False
+        if previous is not None and ids[0].as_py() <= previous:
+            return False
+        previous = ids[-1].as_py()
+    return True
+
+
+def _import_arrow(table: DataTable, fmt: str, source: BinaryIO) -> _BulkImport:
+    try:
+        schema, batches = _open_arrow(fmt, source)
+
+        id_index = _row_id_index(schema)
+        if id_index is not None:
+            # Erst nur die IDs prüfen (eigener Lesedurchgang), dann die Daten lesen
+            id_name = schema.field(id_index).name
+            source.seek(0)
+            if not _valid_row_ids(_open_arrow(fmt, source, columns=[id_name])[1], id_name):
+                id_index = None
+            source.seek(0)
+            schema, batches = _open_arrow(fmt, source)
+        data_indexes = [i for i in range(len(schema)) if i != id_index]
+
+        names = _column_names(tuple(schema.names[i] for i in data_indexes))
+        for position, index in enumerate(data_indexes):
+            metadata = schema.field(index).metadata or {}
+            if META_NAME in metadata:
+                names[position] = metadata[META_NAME].decode()
+        importer = _BulkImport(table, names, id_index)
+        for cid, index in zip(importer.column_ids, data_indexes):
+            importer.types[cid] = _arrow_column_type(schema.field(index))
+
+        for batch in batches:
+            _write_arrow_batch(importer, batch, data_indexes)
+    except (pa.ArrowInvalid, OSError) as e:
+        raise BulkFormatError(f"Datei kann nicht gelesen werden: {e}")
+    return importer
+
+
+def _write_arrow_batch(importer: _BulkImport, batch: pa.RecordBatch, data_indexes: List[int]) -> None:
+    ids = batch.column(importer.id_index).to_pylist() if importer.id_index is not None else None
+    values = {
+        cid: _import_values(batch.column(index))
+        for cid, index in zip(importer.column_ids, data_indexes)
+    }
+    importer.write(batch.num_rows, ids, values)
+
+
+def _import_csv(table: DataTable, source: BinaryIO, delimiter: str) -> _BulkImport:
+    try:
+        reader = pd.read_csv(source, sep=delimiter, chunksize=IMPORT_BATCH_ROWS)
+        importer = None
+        for frame in reader:
+            if importer is None:
+                # CSV kennt keine Field-Metadaten: 'id' ist immer eine Datenspalte
+                data_indexes = list(range(len(frame.columns)))
+                names = _column_names(tuple(str(frame.columns[i]) for i in data_indexes))
+                importer = _BulkImport(table, names, None)
+
+            values = {}
+            for cid, index in zip(importer.column_ids, data_indexes):
+                series = frame.iloc[:, index]
+                if series.notna().any():
+                    inferred = infer_column_type(series, importer.names[cid - 1])
+                    importer.types[cid] = _merge_type(importer.types[cid], inferred)
+                try:
+                    values[cid] = _import_values(pa.Array.from_pandas(series))
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    values[cid] = series.astype(object).where(series.notna(), None).tolist()
+            importer.write(len(frame), None, values)
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+        raise BulkFormatError(f"CSV kann nicht gelesen werden: {e}")
+    if importer is None:
+        raise BulkFormatError("Datei enthält keine Daten")
+    return importer
+
+
+def import_table(
+    db: Session,
+    source: BinaryIO,
+    fmt: str,
+    name: str,
+    project_id: Optional[int] = None,
+    delimiter: str = ","
+) -> DataTable:
+    """
+    Importiert eine Arrow-, Parquet- oder CSV-Datei als neue spaltenbasierte DataTable
+    source muss für Parquet (und Arrow-Dateiformat) seekable sein.
+    Die Tabelle wird in der Session angelegt, aber nicht committet.
+    """
+    fmt = _check_format(fmt)
+    table = DataTable(name=name, project_id=project_id, columns=[], data=[], row_count=0, column_count=0)
+    db.add(table)
+    db.flush()
+
+    if fmt == FORMAT_CSV:
+        importer = _import_csv(table, source, delimiter)
+    else:
+        importer = _import_arrow(table, fmt, source)
+    importer.writer.close(importer.columns())
+    return table
@@ -0,0 +1,472 @@
+"""
+Streaming-Import von Excel-Dateien in DataTables
+
+Ein Tabellenblatt wird mit openpyxl im read_only-Modus Zeile für Zeile gelesen
+und in Batches von EXCEL_IMPORT_BATCH_ROWS Zeilen verarbeitet: Typ-Inferenz
+über infer_column_type (gleiche Typ-Namen wie der Converter), Serialisierung
+und Schreiben über den ChunkWriter des spaltenbasierten Speichers. Im Speicher
+liegt dadurch nie mehr als ein Batch plus ein Chunk, unabhängig von der Größe
+des Blatts.
+
+Imports laufen als Job (Tabelle excel_imports), synchron im Request oder im
+Hintergrund in einem lokalen Thread-Pool (EXCEL_IMPORT_WORKERS). Ein
+Wartungs-Thread übernimmt wartende Jobs beendeter Prozesse und markiert
+laufende Jobs ohne Heartbeat als Fehler. Solange ein Job läuft, ist seine
+Tabelle in Tabellenlisten ausgeblendet (importing_table_ids).
+"""
+import logging
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Set
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import DataTable, DataTableChunk, ExcelFile, ExcelImport
+from procedures.converter import DATETIME_FORMAT, infer_column_type
+from storage import BlobNotFoundError, get_blob_store
+from storage.columnar import ChunkWriter
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_ROWS = int(os.getenv("EXCEL_IMPORT_BATCH_ROWS", "10000"))
+IMPORT_WORKERS = int(os.getenv("EXCEL_IMPORT_WORKERS", "2"))
+IMPORT_STALE_SECONDS = float(os.getenv("EXCEL_IMPORT_STALE_SECONDS", "300"))
+IMPORT_CHECK_INTERVAL = float(os.getenv("EXCEL_IMPORT_CHECK_INTERVAL", "60"))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+FINISHED_STATUSES = ("success", "error")
+
+
+class ExcelImportError(ValueError):
+    """Datei oder Tabellenblatt kann nicht importiert werden"""
+    pass
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _open_workbook(excel_file: ExcelFile):
+    if excel_file.display_name.lower().endswith(".xls"):
+        raise ExcelImportError("Import unterstützt nur .xlsx-Dateien")
+    try:
+        # Seekbarer Reader über die Blob-Chunks, die Datei wird nie ganz geladen
+        return load_workbook(get_blob_store().open(excel_file.content_hash), read_only=True, data_only=True)
+    except BlobNotFoundError:
+        raise ExcelImportError("Dateiinhalt nicht im Blob-Speicher")
+    except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+        raise ExcelImportError(f"Datei kann nicht gelesen werden: {e}")
+
+
+def list_sheets(excel_file: ExcelFile) -> List[dict]:
+    """Tabellenblätter mit Größe laut Dimensionsangabe der Datei (kann fehlen)"""
+    workbook = _open_workbook(excel_file)
+    try:
+        return [
+            {"name": sheet.title, "max_row": sheet.max_row, "max_column": sheet.max_column}
+            for sheet in workbook.worksheets
+        ]
+    finally:
+        workbook.close()
+
+
+def _column_names(header: tuple) -> List[str]:
+    """Überschriften der Kopfzeile; leere Zellen → 'Spalte N', doppelte mit Suffix"""
+    cells = list(header)
+    while cells and cells[-1] is None:
+        cells.pop()  # Leere Spalten am Ende ignorieren
+
+    names, seen = [], {}
+    for i, cell in enumerate(cells):
+        name = str(cell).strip() if cell is not None else ""
+        name = name or f"Spalte {i + 1}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name} ({seen[name]})"
+        else:
+            seen[name] = 1
+        names.append(name)
+    return names
+
+
+def _serialize_cell(value):
+    """Zellwert → JSON-kompatibler Wert (Datum wie serialize_column)"""
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, date):
+        return datetime.combine(value, time()).strftime(DATETIME_FORMAT)
+    if isinstance(value, (time, timedelta)):
+        return str(value)
+    return value
+
+
+def _merge_type(current: Optional[str], inferred: str) -> str:
+    """Typ über mehrere Batches: bei Widerspruch bleibt die Spalte string"""
+    if current is None or current == inferred:
+        return inferred
+    return "string"
+
+
+class _SheetImport:
+    """Liest ein Blatt in Batches und schreibt sie über den ChunkWriter"""
+
+    def __init__(self, table: DataTable, names: List[str]):
+        self.names = names
+        self.column_ids = list(range(1, len(names) + 1))
+        self.types: Dict[int, Optional[str]] = {cid: None for cid in self.column_ids}
+        self.writer = ChunkWriter(table, self.column_ids)
+        self.rows = 0
+
+    def write_batch(self, batch: List[tuple]) -> None:
+        values = {}
+        for index, column_id in enumerate(self.column_ids):
+            raw = [row[index] if index < len(row) else None for row in batch]
+            series = pd.Series(raw)
+            if series.notna().any():
+                inferred = infer_column_type(series, self.names[index])
+                self.types[column_id] = _merge_type(self.types[column_id], inferred)
+            values[column_id] = [_serialize_cell(v) for v in raw]
+
+        row_ids = list(range(self.rows + 1, self.rows + len(batch) + 1))
+        self.writer.append(row_ids, values)
+        self.rows += len(batch)
+
+    def columns(self) -> List[dict]:
+        return [
+            {"id": cid, "name": name, "type": self.types[cid] or "string"}
+            for cid, name in zip(self.column_ids, self.names)
+        ]
+
+    def close(self) -> None:
+        self.writer.close(self.columns())
+
+
+def import_sheet(
+    db: Session,
+    excel_file: ExcelFile,
+    sheet_name: Optional[str] = None,
+    table_name: Optional[str] = None,
+    header_row: int = 1,
+    project_id: Optional[int] = None,
+    on_progress: Optional[Callable[[DataTable, int, float], None]] = None
+) -> DataTable:
+    """
+    Importiert ein Tabellenblatt als neue spaltenbasierte DataTable
+    
+    Args:
+        sheet_name: Name des Blatts (None = erstes Blatt)
+        header_row: Zeile mit den Überschriften (1-basiert), Daten ab der Folgezeile
+        on_progress: Callback (Tabelle, importierte Zeilen, Anteil 0-1) nach jedem Batch
+    
+    Die Tabelle wird in der Session angelegt, aber nicht committet.
+    """
+    workbook = _open_workbook(excel_file)
+    try:
+        if sheet_name is None:
+            sheet = workbook.worksheets[0]
+        elif sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+        else:
+            raise ExcelImportError(f"Tabellenblatt '{sheet_name}' nicht gefunden")
+
+        # max_row stammt aus der Dimensionsangabe der Datei und dient nur der Fortschrittsanzeige
+        total_rows = max((sheet.max_row or 0) - header_row, 0)
+        rows = sheet.iter_rows(min_row=header_row, values_only=True)
+        names = _column_names(next(rows, ()))
+        if not names:
+            raise ExcelImportError(f"Keine Überschriften in Zeile {header_row}")
+
+        table = DataTable(
+            name=table_name or f"{excel_file.base_name} - {sheet.title}",
+            project_id=project_id if project_id is not None else excel_file.project_id,
+            columns=[],
+            data=[],
+            row_count=0,
+            column_count=0
+        )
+        db.add(table)
+        db.flush()
+
+        importer = _SheetImport(table, names)
+        batch = []
+        for row in rows:
+            if all(cell is None for cell in row):
+                continue  # Leerzeilen überspringen
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH_ROWS:
+                importer.write_batch(batch)
+                batch = []
+                if on_progress is not None:
+                    fraction = min(importer.rows / total_rows, 0.99) if total_rows else 0.0
+                    on_progress(table, importer.rows, fraction)
+        if batch:
+            importer.write_batch(batch)
+        importer.close()
+    finally:
+        workbook.close()
+
+    if on_progress is not None:
+        on_progress(table, importer.rows, 1.0)
+    return table
+
+
+# --- Jobs -------------------------------------------------------------------
+
+def create_import(
+    db: Session,
+    excel_file: ExcelFile,
+    sheet_name: Optional[str] = None,
+    table_name: Optional[str] = None,
+    header_row: int = 1,
+    project_id: Optional[int] = None
+) -> ExcelImport:
+    """Legt einen Import-Job mit status='queued' an"""
+    job = ExcelImport(
+        file_id=excel_file.id,
+        project_id=project_id if project_id is not None else excel_file.project_id,
+        sheet_name=sheet_name,
+        table_name=table_name,
+        header_row=header_row,
+        status=STATUS_QUEUED,
+        progress=0.0,
+        rows_imported=0
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def importing_table_ids():
+    """Select der Tabellen, deren Import noch nicht abgeschlossen ist"""
+    return select(ExcelImport.table_id).where(
+        ExcelImport.status.in_(ACTIVE_STATUSES),
+        ExcelImport.table_id.isnot(None)
+    )
+
+
+def _discard_table(db: Session, table_id: int) -> None:
+    """Entfernt eine teilweise importierte Tabelle samt Chunks (ohne Payloads zu laden)"""
+    db.query(DataTableChunk).filter(DataTableChunk.table_id == table_id).delete(synchronize_session=False)
+    db.query(DataTable).filter(DataTable.id == table_id).delete(synchronize_session=False)
+
+
+_executor_lock = threading.Lock()
+_active: Set[int] = set()  # Jobs, die in diesem Prozess gerade laufen
+
+
+def run_import(db: Session, job: ExcelImport) -> ExcelImport:
+    """
+    Führt einen wartenden Import-Job aus (läuft er bereits, bleibt er unverändert)
+    Jeder Batch wird zusammen mit dem Fortschritt committet, damit der Status
+    von außen lesbar ist. Die Tabelle ist bis zum Abschluss in Listen
+    ausgeblendet; bei einem Fehler wird sie wieder entfernt.
+    """
+    # Job atomar übernehmen, damit ihn bei mehreren Prozessen nur einer ausführt
+    claimed = db.query(ExcelImport).filter(
+        ExcelImport.id == job.id,
+        ExcelImport.status == STATUS_QUEUED
+    ).update({
+        "status": STATUS_RUNNING,
+        "started_at": _now(),
+        "heartbeat_at": _now(),
+        "progress_message": "Datei wird geöffnet"
+    }, synchronize_session=False)
+    db.commit()
+    db.refresh(job)
+    if not claimed:
+        return job
+
+    with _executor_lock:
+        _active.add(job.id)
+
+    def on_progress(table: DataTable, rows: int, fraction: float) -> None:
+        job.table_id = table.id
+        job.rows_imported = rows
+        job.progress = fraction
+        job.progress_message = f"{rows} Zeilen importiert"
+        job.heartbeat_at = _now()
+        db.commit()
+
+    try:
+        excel_file = db.query(ExcelFile).filter(ExcelFile.id == job.file_id).first()
+        if excel_file is None:
+            raise ExcelImportError("Datei nicht gefunden")
+
+        import_sheet(
+            db,
+            excel_file,
+            sheet_name=job.sheet_name,
+            table_name=job.table_name,
+            header_row=job.header_row or 1,
+            project_id=job.project_id,
+            on_progress=on_progress
+        )
+        job.status = "success"
+        job.finished_at = _now()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        if not isinstance(e, ExcelImportError):
+            logger.exception("Excel-Import %s fehlgeschlagen", job.id)
+        if job.table_id is not None:
+            _discard_table(db, job.table_id)
+            job.table_id = None
+        job.status = "error"
+        job.error_message = str(e)
+        job.finished_at = _now()
+        db.commit()
+    finally:
+        with _executor_lock:
+            _active.discard(job.id)
+
+    db.refresh(job)
+    return job
+
+
+# --- Hintergrund-Ausführung -------------------------------------------------
+
+_executor: Optional[ThreadPoolExecutor] = None
+_submitted: Set[int] = set()  # Jobs im Thread-Pool dieses Prozesses
+_maintenance: Optional[threading.Thread] = None
+_maintenance_stop = threading.Event()
+
+
+def _run_in_background(job_id: int) -> None:
+    db = SessionLocal()
+    try:
+        job = db.query(ExcelImport).filter(ExcelImport.id == job_id).first()
+        if job is not None and job.status == STATUS_QUEUED:
+            run_import(db, job)
+    except Exception:
+        logger.exception("Excel-Import %s konnte nicht ausgeführt werden", job_id)
+    finally:
+        db.close()
+        with _executor_lock:
+            _submitted.discard(job_id)
+
+
+def _submit(job_id: int) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, IMPORT_WORKERS), thread_name_prefix="excel-import")
+        _submitted.add(job_id)
+        _executor.submit(_run_in_background, job_id)
+
+
+def submit_import(job: ExcelImport) -> None:
+    """Führt den Job im lokalen Thread-Pool aus (EXCEL_IMPORT_WORKERS Threads)"""
+    _submit(job.id)
+
+
+def recover_interrupted_imports(requeue_all: bool = False) -> int:
+    """
+    Behandelt Jobs, deren Prozess beendet wurde, bevor der Import fertig war
+    
+    - Laufende Jobs, deren Heartbeat älter als EXCEL_IMPORT_STALE_SECONDS ist,
+      werden als Fehler markiert und ihre Tabelle entfernt
+    - Wartende Jobs werden in den Thread-Pool dieses Prozesses übernommen:
+      beim Serverstart alle (requeue_all), danach nur solche, die seit
+      EXCEL_IMPORT_STALE_SECONDS warten und hier nicht schon eingeplant sind
+    
+    Gibt die Anzahl der behandelten Jobs zurück.
+    """
+    db = SessionLocal()
+    try:
+        cutoff = _now() - timedelta(seconds=IMPORT_STALE_SECONDS)
+        stale = db.query(ExcelImport).filter(
+            ExcelImport.status == STATUS_RUNNING,
+            ExcelImport.heartbeat_at < cutoff
+        ).all()
+        for job in stale:
+            if job.table_id is not None:
+                _discard_table(db, job.table_id)
+                job.table_id = None
+            job.status = "error"
+            job.error_message = "Import abgebrochen (Server beendet)"
+            job.finished_at = _now()
+        db.commit()
+        if stale:
+            logger.warning("%s abgebrochene Excel-Imports als Fehler markiert", len(stale))
+
+        waiting = db.query(ExcelImport.id).filter(ExcelImport.status == STATUS_QUEUED)
+        if not requeue_all:
+            waiting = waiting.filter(ExcelImport.created_at < cutoff)
+        with _executor_lock:
+            orphaned = [job_id for (job_id,) in waiting.all() if job_id not in _submitted]
+        for job_id in orphaned:
+            _submit(job_id)
+        if orphaned:
+            logger.warning("%s wartende Excel-Imports neu eingeplant", len(orphaned))
+        return len(stale) + len(orphaned)
+    except Exception:
+        logger.exception("Fehler beim Bereinigen abgebrochener Excel-Imports")
+        db.rollback()
+        return 0
+    finally:
+        db.close()
+
+
+def _heartbeat() -> None:
+    """Heartbeat der laufenden Jobs, auch wenn ein Batch länger dauert"""
+    with _executor_lock:
+        job_ids = list(_active)
+    if not job_ids:
+        return
+    db = SessionLocal()
+    try:
+        db.query(ExcelImport).filter(
+            ExcelImport.id.in_(job_ids),
+            ExcelImport.status == STATUS_RUNNING
+        ).update({"heartbeat_at": _now()}, synchronize_session=False)
+        db.commit()
+    except Exception:
+        logger.warning("Heartbeat der Excel-Imports fehlgeschlagen", exc_info=True)
+        db.rollback()
+    finally:
+        db.close()
+
+
+def _maintain() -> None:
+    while not _maintenance_stop.wait(IMPORT_CHECK_INTERVAL):
+        _heartbeat()
+        recover_interrupted_imports()
+
+
+def start_import_maintenance() -> None:
+    """
+    Beim Serverstart: abgebrochene Jobs behandeln und die Prüfung danach alle
+    EXCEL_IMPORT_CHECK_INTERVAL Sekunden wiederholen (auch Neustarts innerhalb
+    von EXCEL_IMPORT_STALE_SECONDS werden so erkannt)
+    """
+    global _maintenance
+    recover_interrupted_imports(requeue_all=True)
+    with _executor_lock:
+        if _maintenance is None:
+            _maintenance_stop.clear()
+            _maintenance = threading.Thread(target=_maintain, name="excel-import-maintenance", daemon=True)
+            _maintenance.start()
+
+
+def shutdown_imports() -> None:
+    global _executor, _maintenance
+    _maintenance_stop.set()
+    with _executor_lock:
+        maintenance, _maintenance = _maintenance, None
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+        _submitted.clear()
+    if maintenance is not None:
+        maintenance.join(timeout=5)
@@ -1,7 +1,18 @@
-from fastapi import FastAPI
+import logging
+import os
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from database import engine, Base
-from routers import projects, files, tables, procedures, workflows, global_values
+from database import engine, async_engine, Base
+from metrics import MetricsMiddleware, render_metrics
+from routers import projects, files, tables, procedures, workflows, global_values, system
+from procedures.executor import EXECUTION_BACKEND
+from procedures.pool import get_worker_pool, shutdown_worker_pool
+from procedures.queue import start_execution_queue, stop_execution_queue
+from imports import start_import_maintenance, shutdown_imports
+from workflows.runner import start_runner_maintenance, shutdown_runner
+from workflows.scheduler import start_scheduler, stop_scheduler
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 Base.metadata.create_all(bind=engine)
 
@@ -14,6 +25,38 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Äußerste Middleware, misst Requests inklusive CORS
+app.add_middleware(MetricsMiddleware)
+
+
+@app.on_event("startup")
+def start_procedure_pool():
+    # Worker-Prozesse vorwärmen, damit der erste Aufruf nicht auf den Start wartet
+    if EXECUTION_BACKEND == "process":
+        get_worker_pool()
+    # Worker für asynchrone Ausführungen (PROCEDURE_QUEUE_WORKERS=0 deaktiviert)
+    start_execution_queue()
+    # Abgebrochene Excel-Imports behandeln, danach periodisch erneut prüfen
+    start_import_maintenance()
+    # Abgebrochene Workflow-Läufe bereinigen, danach Heartbeat und periodische Prüfung
+    start_runner_maintenance()
+    # Zeitgesteuerte Workflow-Instanzen (SCHEDULER_ENABLED=false deaktiviert)
+    start_scheduler()
+
+
+@app.on_event("shutdown")
+def stop_procedure_pool():
+    stop_execution_queue()
+    stop_scheduler()
+    shutdown_imports()
+    shutdown_runner()
+    shutdown_worker_pool()
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
+
 
 app.include_router(projects.router, prefix="/api")
 app.include_router(files.router, prefix="/api")
@@ -21,6 +64,15 @@ app.include_router(tables.router, prefix="/api")
 app.include_router(procedures.router)
 app.include_router(workflows.router)
 app.include_router(global_values.router, prefix="/api")
+app.include_router(system.router, prefix="/api")
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus-Metriken dieses Prozesses (bzw. aller Worker, siehe metrics.py)"""
+    content, content_type = render_metrics()
+    # Content-Type direkt setzen (media_type würde ein zweites charset anhängen)
+    return Response(content=content, headers={"Content-Type": content_type})
+
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,173 @@
+"""
+Prometheus-Metriken für API, Konvertierung und Ausführung (GET /metrics)
+
+- HTTP: Dauer, Request- und Response-Größe pro Route (Pfad-Template, nicht die
+  konkrete URL, damit die Anzahl der Zeitreihen begrenzt bleibt)
+- Prozeduren: Ausführungsdauer pro Name und Version
+- Konverter: Dauer und Zeilen von datatable_to_dataframe/dataframe_to_datatable
+  (Durchsatz = rate(converter_rows_total) / rate(converter_duration_seconds_sum))
+- Workflows: Dauer pro Node-Typ
+- Datenbank: Zustand der Connection-Pools (pool_stats/async_pool_stats)
+
+Die Werte gelten pro Prozess. Bei mehreren uvicorn-Workern
+PROMETHEUS_MULTIPROC_DIR auf ein (beim Start leeres) Verzeichnis setzen, dann
+fasst /metrics die Werte aller Worker zusammen; die Pool-Metriken stammen
+weiterhin vom antwortenden Prozess.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from database import pool_stats, async_pool_stats
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Dauer von HTTP-Requests",
+    ["method", "route", "status"], buckets=_DURATION_BUCKETS
+)
+REQUEST_SIZE = Histogram(
+    "http_request_size_bytes", "Größe des Request-Bodys",
+    ["method", "route"], buckets=_SIZE_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Größe des Response-Bodys (auch bei Streaming)",
+    ["method", "route"], buckets=_SIZE_BUCKETS
+)
+PROCEDURE_DURATION = Histogram(
+    "procedure_execution_duration_seconds", "Dauer einer Prozedur (Kompilieren, Parameter, Aufruf)",
+    ["procedure", "version", "status"], buckets=_DURATION_BUCKETS
+)
+CONVERTER_DURATION = Histogram(
+    "converter_duration_seconds", "Dauer der Konvertierung DataTable ↔ DataFrame",
+    ["direction"], buckets=_DURATION_BUCKETS
+)
+CONVERTER_ROWS = Counter(
+    "converter_rows", "Konvertierte Zeilen", ["direction"]
+)
+WORKFLOW_NODE_DURATION = Histogram(
+    "workflow_node_duration_seconds", "Dauer eines Workflow-Nodes",
+    ["node_type", "status"], buckets=_DURATION_BUCKETS
+)
+
+_NODE_TYPES = {"table", "procedure", "value", "api", "output"}
+
+
+@contextmanager
+def observe_duration(histogram: Histogram, **labels):
+    """Misst die Dauer des Blocks; setzt das Label status ('success' oder 'error')"""
+    started = time.perf_counter()
+    status = "success"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        if METRICS_ENABLED:
+            histogram.labels(status=status, **labels).observe(time.perf_counter() - started)
+
+
+def observe_conversion(direction: str, seconds: float, rows: int) -> None:
+    """direction: 'to_dataframe' oder 'to_datatable'"""
+    if METRICS_ENABLED:
+        CONVERTER_DURATION.labels(direction=direction).observe(seconds)
+        CONVERTER_ROWS.labels(direction=direction).inc(rows)
+
+
+def node_type_label(node_type: Optional[str]) -> str:
+    return node_type if node_type in _NODE_TYPES else "unknown"
+
+
+class _PoolCollector:
+    """Liest den Pool-Zustand erst beim Abruf von /metrics"""
+
+    def collect(self):
+        gauges = {
+            "size": GaugeMetricFamily("db_pool_size", "Konfigurierte Pool-Größe", labels=["pool"]),
+            "checked_out": GaugeMetricFamily("db_pool_checked_out", "Ausgeliehene Verbindungen", labels=["pool"]),
+            "checked_in": GaugeMetricFamily("db_pool_checked_in", "Freie Verbindungen im Pool", labels=["pool"]),
+            "overflow": GaugeMetricFamily("db_pool_overflow", "Verbindungen über pool_size hinaus", labels=["pool"]),
+            "wait_seconds_max": GaugeMetricFamily(
+                "db_pool_wait_seconds_max", "Längste Wartezeit auf eine Verbindung", labels=["pool"]
+            ),
+        }
+        counters = {
+            "checkouts": CounterMetricFamily("db_pool_checkouts", "Checkouts", labels=["pool"]),
+            "timeouts": CounterMetricFamily("db_pool_timeouts", "Checkouts mit Timeout", labels=["pool"]),
+            "wait_seconds_total": CounterMetricFamily(
+                "db_pool_wait_seconds", "Summe der Wartezeiten auf Verbindungen", labels=["pool"]
+            ),
+        }
+        for pool, stats in (("sync", pool_stats()), ("async", async_pool_stats())):
+            for key, family in (*gauges.items(), *counters.items()):
+                if stats.get(key) is not None:
+                    family.add_metric([pool], stats[key])
+        yield from gauges.values()
+        yield from counters.values()
+
+
+_pool_collector = _PoolCollector()
+REGISTRY.register(_pool_collector)
+
+
+def render_metrics():
+    """(Inhalt, Content-Type) im Prometheus-Textformat"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_pool_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """ASGI-Middleware für Dauer und Größen aller HTTP-Requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        state = {"status": 500, "received": 0, "sent": 0}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            # Route erst nach dem Routing bekannt (FastAPI setzt scope["route"])
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            REQUEST_DURATION.labels(method=method, route=route, status=str(state["status"])).observe(
+                time.perf_counter() - started
+            )
+            REQUEST_SIZE.labels(method=method, route=route).observe(state["received"])
+            RESPONSE_SIZE.labels(method=method, route=route).observe(state["sent"])
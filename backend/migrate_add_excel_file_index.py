@@ -0,0 +1,40 @@
+"""
+Migration: Index für das Datei-Listing
+Fügt excel_files den zusammengesetzten Index (project_id, base_name, version) hinzu
+"""
+from sqlalchemy import text
+from database import SessionLocal
+
+
+def main():
+    print("=" * 60)
+    print("Migration: Index für das Datei-Listing")
+    print("=" * 60)
+    print()
+    
+    db = SessionLocal()
+    
+    try:
+        db.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_excel_files_project_base_version "
+            "ON excel_files (project_id, base_name, version)"
+        ))
+        db.commit()
+        print("  ✓ Index 'ix_excel_files_project_base_version' angelegt")
+        
+        print()
+        print("=" * 60)
+        print("✓ Migration abgeschlossen!")
+        print("=" * 60)
+        
+    except Exception as e:
+        print(f"\n✗ Fehler: {e}")
+        import traceback
+        traceback.print_exc()
+        db.rollback()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
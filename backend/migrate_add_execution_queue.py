@@ -0,0 +1,58 @@
+"""
+Migration: Warteschlange für asynchrone Prozedur-Ausführungen
+Fügt procedure_executions die Spalten für Fortschritt, Abbruch und Heartbeat hinzu
+"""
+from sqlalchemy import text
+from database import SessionLocal
+
+COLUMNS = [
+    ("progress", "FLOAT"),
+    ("progress_message", "VARCHAR"),
+    ("cancel_requested", "BOOLEAN DEFAULT FALSE"),
+    ("worker_id", "VARCHAR"),
+    ("started_at", "TIMESTAMP WITH TIME ZONE"),
+    ("finished_at", "TIMESTAMP WITH TIME ZONE"),
+    ("heartbeat_at", "TIMESTAMP WITH TIME ZONE"),
+]
+
+
+def main():
+    print("=" * 60)
+    print("Migration: Warteschlange für Prozedur-Ausführungen")
+    print("=" * 60)
+    print()
+    
+    db = SessionLocal()
+    
+    try:
+        for name, column_type in COLUMNS:
+            try:
+                db.execute(text(f"ALTER TABLE procedure_executions ADD COLUMN {name} {column_type}"))
+                db.commit()
+                print(f"  ✓ Spalte '{name}' hinzugefügt")
+            except Exception:
+                db.rollback()
+                print(f"  - Spalte '{name}' existiert bereits")
+        
+        db.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_procedure_executions_status ON procedure_executions (status)"
+        ))
+        db.commit()
+        print("  ✓ Index auf 'status' bereit")
+        
+        print()
+        print("=" * 60)
+        print("✓ Migration abgeschlossen!")
+        print("=" * 60)
+        
+    except Exception as e:
+        print(f"\n✗ Fehler: {e}")
+        import traceback
+        traceback.print_exc()
+        db.rollback()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Migration: Versionszähler für DataTables
+Fügt data_tables die Spalte version hinzu (Fingerprint für den Workflow-Ergebnis-Cache)
+"""
+from sqlalchemy import text
+from database import SessionLocal
+
+
+def main():
+    print("=" * 60)
+    print("Migration: Versionszähler für DataTables")
+    print("=" * 60)
+    print()
+    
+    db = SessionLocal()
+    
+    try:
+        try:
+            db.execute(text("ALTER TABLE data_tables ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+            db.commit()
+            print("  ✓ Spalte 'version' hinzugefügt")
+        except Exception:
+            db.rollback()
+            print("  - Spalte 'version' existiert bereits")
+        
+        print()
+        print("=" * 60)
+        print("✓ Migration abgeschlossen!")
+        print("=" * 60)
+        
+    except Exception as e:
+        print(f"\n✗ Fehler: {e}")
+        import traceback
+        traceback.print_exc()
+        db.rollback()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Migration: Heartbeat für Workflow-Ausführungen
+Fügt workflow_executions die Spalte heartbeat_at hinzu (Erkennung abgebrochener Läufe)
+"""
+from sqlalchemy import text
+from database import SessionLocal
+
+
+def main():
+    print("=" * 60)
+    print("Migration: Heartbeat für Workflow-Ausführungen")
+    print("=" * 60)
+    print()
+    
+    db = SessionLocal()
+    
+    try:
+        try:
+            db.execute(text("ALTER TABLE workflow_executions ADD COLUMN heartbeat_at TIMESTAMP WITH TIME ZONE"))
+            db.commit()
+            print("  ✓ Spalte 'heartbeat_at' hinzugefügt")
+        except Exception:
+            db.rollback()
+            print("  - Spalte 'heartbeat_at' existiert bereits")
+        
+        print()
+        print("=" * 60)
+        print("✓ Migration abgeschlossen!")
+        print("=" * 60)
+        
+    except Exception as e:
+        print(f"\n✗ Fehler: {e}")
+        import traceback
+        traceback.print_exc()
+        db.rollback()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
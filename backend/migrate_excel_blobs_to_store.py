@@ -0,0 +1,88 @@
+"""
+Migration: Excel-BLOBs in den Blob-Speicher verschieben
+Überträgt excel_files.file_data in den inhaltsadressierten Blob-Speicher
+(BLOB_STORE_BACKEND / BLOB_STORE_DIR), speichert den SHA-256 in content_hash
+und entfernt danach die Spalte file_data.
+"""
+from sqlalchemy import inspect, text
+from database import SessionLocal, engine
+from storage import get_blob_store
+
+
+def main():
+    print("=" * 60)
+    print("Migration: Excel-BLOBs in den Blob-Speicher")
+    print("=" * 60)
+    print()
+
+    db = SessionLocal()
+    store = get_blob_store()
+
+    try:
+        columns = {col["name"] for col in inspect(engine).get_columns("excel_files")}
+
+        if "content_hash" not in columns:
+            db.execute(text("ALTER TABLE excel_files ADD COLUMN content_hash VARCHAR(64)"))
+            db.execute(text("CREATE INDEX IF NOT EXISTS ix_excel_files_content_hash ON excel_files (content_hash)"))
+            db.commit()
+            print("  ✓ Spalte 'content_hash' hinzugefügt")
+        else:
+            print("  - Spalte 'content_hash' existiert bereits")
+
+        if "file_data" not in columns:
+            print("  - Spalte 'file_data' existiert nicht mehr, nichts zu verschieben")
+            return
+
+        # IDs zuerst, dann jede Datei einzeln laden (nie alle BLOBs gleichzeitig im Speicher)
+        file_ids = [row[0] for row in db.execute(text(
+            "SELECT id FROM excel_files WHERE content_hash IS NULL ORDER BY id"
+        ))]
+        print(f"  {len(file_ids)} Datei(en) zu verschieben")
+
+        moved = 0
+        for file_id in file_ids:
+            data = db.execute(
+                text("SELECT file_data FROM excel_files WHERE id = :id"), {"id": file_id}
+            ).scalar()
+            if data is None:
+                print(f"  ⚠ Datei {file_id}: kein Inhalt, übersprungen")
+                continue
+
+            manifest = store.put_bytes(bytes(data))
+            if store.read(manifest.hash) != bytes(data):
+                raise RuntimeError(f"Datei {file_id}: Inhalt im Blob-Speicher weicht ab")
+
+            db.execute(
+                text("UPDATE excel_files SET content_hash = :hash, file_size = :size WHERE id = :id"),
+                {"hash": manifest.hash, "size": manifest.size, "id": file_id}
+            )
+            db.commit()
+            moved += 1
+            print(f"  ✓ Datei {file_id} → {manifest.hash[:12]}… ({manifest.size} Bytes)")
+
+        missing = db.execute(text("SELECT COUNT(*) FROM excel_files WHERE content_hash IS NULL")).scalar()
+        if missing:
+            print()
+            print(f"✗ {missing} Datei(en) ohne content_hash - Spalte 'file_data' bleibt erhalten")
+            return
+
+        db.execute(text("ALTER TABLE excel_files DROP COLUMN file_data"))
+        db.commit()
+        print("  ✓ Spalte 'file_data' entfernt")
+
+        print()
+        print("=" * 60)
+        print(f"✓ Migration abgeschlossen! ({moved} Datei(en) verschoben)")
+        print("=" * 60)
+
+    except Exception as e:
+        print(f"\n✗ Fehler: {e}")
+        import traceback
+        traceback.print_exc()
+        db.rollback()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Migration: Spaltenbasierter Speicher für DataTables
+Fügt die Spalte storage_format hinzu, legt data_table_chunks an und
+überführt bestehende JSON-Tabellen in Arrow-Chunks
+"""
+from sqlalchemy import text
+from database import SessionLocal, engine
+from models import DataTable, DataTableChunk
+from storage import migrate_table, STORAGE_COLUMNAR
+
+
+def main():
+    print("=" * 60)
+    print("Migration: Spaltenbasierter Speicher für DataTables")
+    print("=" * 60)
+    print()
+    
+    db = SessionLocal()
+    
+    try:
+        # Spalte storage_format hinzufügen
+        try:
+            db.execute(text("ALTER TABLE data_tables ADD COLUMN storage_format VARCHAR DEFAULT 'json'"))
+            db.commit()
+            print("  ✓ Spalte 'storage_format' hinzugefügt")
+        except Exception:
+            db.rollback()
+            print("  - Spalte 'storage_format' existiert bereits")
+        
+        # Chunk-Tabelle anlegen
+        DataTableChunk.__table__.create(bind=engine, checkfirst=True)
+        print("  ✓ Tabelle 'data_table_chunks' bereit")
+        print()
+        
+        # Tabellen einzeln migrieren (eine Transaktion pro Tabelle)
+        table_ids = [row[0] for row in db.query(DataTable.id).filter(
+            (DataTable.storage_format != STORAGE_COLUMNAR) | (DataTable.storage_format == None)
+        ).all()]
+        
+        print(f"Migriere {len(table_ids)} Tabelle(n)...")
+        for table_id in table_ids:
+            table = db.query(DataTable).filter(DataTable.id == table_id).first()
+            if migrate_table(table):
+                db.commit()
+                print(f"  ✓ '{table.name}' (ID {table.id}): {table.row_count} Zeilen")
+            db.expunge_all()
+        
+        print()
+        print("=" * 60)
+        print("✓ Migration abgeschlossen!")
+        print("=" * 60)
+        
+    except Exception as e:
+        print(f"\n✗ Fehler: {e}")
+        import traceback
+        traceback.print_exc()
+        db.rollback()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary, JSON, Text, Boolean, Float, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary, JSON, Text, Boolean, Float, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -68,8 +68,8 @@ class ExcelFile(Base):
     # Dateiname (mit Timestamp für Eindeutigkeit)
     filename = Column(String, nullable=False, unique=True)
     
-    # BLOB-Speicherung für Cloud-Kompatibilität
-    file_data = Column(LargeBinary, nullable=False)
+    # Inhalt liegt im Blob-Speicher (storage/blobs.py), hier nur der SHA-256
+    content_hash = Column(String(64), nullable=False, index=True)
     
     # Metadaten
     file_size = Column(Integer)
@@ -82,7 +82,80 @@ class ExcelFile(Base):
     
     # Relationship
     project = relationship("Project", back_populates="excel_files")
+    
+    # Listing der neuesten Version je base_name (optional pro Projekt)
+    __table_args__ = (
+        Index('ix_excel_files_project_base_version', 'project_id', 'base_name', 'version'),
+    )
+
+
+
+# Mehrteiliger, fortsetzbarer Upload; Teile liegen als Chunks im Blob-Speicher
+class FileUpload(Base):
+    __tablename__ = "file_uploads"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)
+    original_name = Column(String, nullable=False)
+    total_size = Column(Integer, nullable=True)  # Vom Client angekündigt (optional)
+    
+    # open, completed
+    status = Column(String, nullable=False, default="open")
+    file_id = Column(Integer, ForeignKey("excel_files.id"), nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    parts = relationship(
+        "FileUploadPart",
+        back_populates="upload",
+        cascade="all, delete-orphan",
+        order_by="FileUploadPart.part_no"
+    )
+
+
+class FileUploadPart(Base):
+    __tablename__ = "file_upload_parts"
 
+    id = Column(Integer, primary_key=True, index=True)
+    upload_id = Column(String(32), ForeignKey("file_uploads.id"), nullable=False, index=True)
+    part_no = Column(Integer, nullable=False)  # 1-basiert
+    chunk_hash = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    
+    upload = relationship("FileUpload", back_populates="parts")
+    
+    __table_args__ = (UniqueConstraint('upload_id', 'part_no', name='uq_file_upload_part'),)
+
+
+# Import eines Tabellenblatts aus einer ExcelFile in eine DataTable
+class ExcelImport(Base):
+    __tablename__ = "excel_imports"
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(Integer, ForeignKey("excel_files.id"), nullable=False)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)
+    table_id = Column(Integer, ForeignKey("data_tables.id"), nullable=True)
+    
+    # Import-Optionen
+    sheet_name = Column(String, nullable=True)  # None = erstes Blatt
+    table_name = Column(String, nullable=True)
+    header_row = Column(Integer, default=1)
+    
+    # queued, running, success, error
+    status = Column(String, nullable=False, index=True)
+    progress = Column(Float, nullable=True)  # 0.0 - 1.0
+    progress_message = Column(String, nullable=True)
+    rows_imported = Column(Integer, default=0)
+    error_message = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)  # Nach jedem Batch
+    
+    file = relationship("ExcelFile")
+    table = relationship("DataTable")
 
 
 class DataTable(Base):
@@ -106,12 +179,40 @@ class DataTable(Base):
     row_count = Column(Integer, default=0)
     column_count = Column(Integer, default=0)
     
+    # Speicherformat: 'json' (Zeilen in data) oder 'columnar' (Chunks in data_table_chunks)
+    storage_format = Column(String, default="json")
+    
+    # Wird bei jeder Änderung von Daten oder Spalten erhöht
+    version = Column(Integer, default=1, nullable=False)
+    
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     # Relationship
     project = relationship("Project", back_populates="data_tables")
+    chunks = relationship("DataTableChunk", back_populates="table", cascade="all, delete-orphan")
+
+
+class DataTableChunk(Base):
+    """
+    Spalten-Chunk einer DataTable im spaltenbasierten Speicher
+    Pro (Tabelle, Spalte, Chunk-Nummer) ein Arrow-IPC-kodierter Blob
+    """
+    __tablename__ = "data_table_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    table_id = Column(Integer, ForeignKey("data_tables.id"), nullable=False, index=True)
+    column_id = Column(Integer, nullable=False)  # 0 = Zeilen-ID
+    chunk_no = Column(Integer, nullable=False)
+    
+    row_count = Column(Integer, nullable=False)
+    encoding = Column(String, default="arrow")  # 'arrow' oder 'json' (gemischte Typen)
+    payload = Column(LargeBinary, nullable=False)
+    
+    table = relationship("DataTable", back_populates="chunks")
+    
+    __table_args__ = (UniqueConstraint('table_id', 'column_id', 'chunk_no', name='uq_data_table_chunk'),)
 
 
 class Procedure(Base):
@@ -155,10 +256,20 @@ class ProcedureExecution(Base):
     input_params = Column(JSON, nullable=False)
     output_table_id = Column(Integer, ForeignKey("data_tables.id"), nullable=True)
     
-    status = Column(String, nullable=False)
+    # queued, running, success, error, cancelled
+    status = Column(String, nullable=False, index=True)
     error_message = Column(Text, nullable=True)
     execution_time = Column(Float, nullable=True)
     
+    # Asynchrone Ausführung (Warteschlange in dieser Tabelle)
+    progress = Column(Float, nullable=True)  # 0.0 - 1.0
+    progress_message = Column(String, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+    worker_id = Column(String, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    
     executed_at = Column(DateTime(timezone=True), server_default=func.now())
     
     procedure = relationship("Procedure")
@@ -205,7 +316,7 @@ class WorkflowExecution(Base):
     input_params = Column(JSON, nullable=False)
     output_data = Column(JSON, nullable=True)
     
-    status = Column(String, nullable=False)  # pending, running, completed, failed
+    status = Column(String, nullable=False)  # pending, running, completed, completed_with_errors, failed
     error_message = Column(Text, nullable=True)
     execution_time = Column(Float, nullable=True)
     
@@ -213,6 +324,7 @@ class WorkflowExecution(Base):
     execution_log = Column(JSON, nullable=True)
     
     executed_at = Column(DateTime(timezone=True), server_default=func.now())
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)  # Solange der Prozess sie ausführt
     
     workflow = relationship("Workflow")
     project = relationship("Project")
@@ -249,6 +361,31 @@ class WorkflowInstance(Base):
     __table_args__ = (UniqueConstraint('workflow_id', 'cycle_id', name='uq_workflow_cycle'),)
 
 
+class WorkflowSchedule(Base):
+    """
+    Zeitplan einer Workflow-Instanz (Cron-Ausdruck, siehe workflows/scheduler.py)
+    """
+    __tablename__ = "workflow_schedules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    instance_id = Column(Integer, ForeignKey("workflow_instances.id"), nullable=False, index=True)
+    
+    cron = Column(String, nullable=False)  # z.B. "0 2 * * *" oder "@daily"
+    timezone = Column(String, nullable=False, default="UTC")
+    jitter_seconds = Column(Integer, nullable=True)  # None = SCHEDULER_JITTER_SECONDS
+    is_active = Column(Boolean, default=True)
+    
+    next_run_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    last_run_at = Column(DateTime(timezone=True), nullable=True)
+    last_execution_id = Column(Integer, ForeignKey("workflow_executions.id"), nullable=True)
+    last_status = Column(String, nullable=True)  # running, completed, completed_with_errors, failed, skipped
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    instance = relationship("WorkflowInstance")
+
+
 class GlobalValue(Base):
     __tablename__ = "global_values"
 
@@ -1,14 +1,21 @@
-from .converter import datatable_to_dataframe, dataframe_to_datatable
+from .converter import datatable_to_dataframe, dataframe_to_datatable, dataframe_to_records
 from .parser import parse_function_signature, extract_function_name, add_type_hints_to_code
-from .executor import execute_procedure
+from .executor import execute_procedure, call_procedure, get_compiled_procedure
+from .batch import run_batch
+from .cache import procedure_cache
 from .sandbox import create_safe_namespace
 
 __all__ = [
     'datatable_to_dataframe',
     'dataframe_to_datatable',
+    'dataframe_to_records',
     'parse_function_signature',
     'extract_function_name',
     'add_type_hints_to_code',
     'execute_procedure',
+    'call_procedure',
+    'get_compiled_procedure',
+    'run_batch',
+    'procedure_cache',
     'create_safe_namespace'
 ]
@@ -0,0 +1,450 @@
+"""
+Batch- und Sweep-Ausführung: eine Prozedur über viele Parameter-Sätze
+
+Statt N einzelner Aufrufe von POST /api/procedures/{name}/execute wird die
+Prozedur einmal kompiliert und für alle Parameter-Sätze parallel in einem
+Thread-Pool ausgeführt (PROCEDURE_BATCH_PARALLELISM). Jeder Thread lädt seine
+Eingaben über eine eigene DB-Session. Mit PROCEDURE_EXECUTION_BACKEND=process
+laufen die Aufrufe selbst zusätzlich im Prozess-Pool.
+
+Ergebnis-Tabellen und ProcedureExecution-Einträge werden im aufrufenden Thread
+gesammelt und am Ende gemeinsam geschrieben (ein Commit für den ganzen Batch).
+Fehler einzelner Sätze brechen den Batch nicht ab, sie landen als
+Ausführung mit status='error' im Ergebnis.
+
+Sweep: ein Raster skalarer Parameter (z.B. schwellwert, min_wert) gegen
+dieselben Eingaben. Die Tabellen werden einmal geladen und konvertiert; alle
+Rasterpunkte teilen sich die DataFrames schreibgeschützt (jeder Punkt erhält
+eine flache Kopie, neue Spalten landen nur in der Kopie). Schreibt eine
+Prozedur Werte direkt in eine Eingabe-Spalte, wird der Punkt mit tiefen
+Kopien wiederholt. Ergebnis je Punkt ist eine kompakte Zusammenfassung;
+DataTables werden nur mit materialize=True gespeichert.
+"""
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session, sessionmaker
+
+from models import Procedure, ProcedureExecution, DataTable
+from .executor import call_procedure, get_compiled_procedure, prepare_parameters
+from .converter import dataframe_to_datatable
+from .tracing import tracing
+
+BATCH_PARALLELISM = int(os.getenv("PROCEDURE_BATCH_PARALLELISM", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("PROCEDURE_BATCH_MAX_ITEMS", "500"))
+SWEEP_MAX_POINTS = int(os.getenv("PROCEDURE_SWEEP_MAX_POINTS", "1000"))
+
+_TABLE_TYPES = ("Table", "List[Table]")
+
+# Gesamtstatus eines Batches
+BATCH_SUCCESS = "success"
+BATCH_PARTIAL = "partial"
+BATCH_ERROR = "error"
+
+
+class ProcedureBatchError(ValueError):
+    """Ungültiger Batch oder Sweep (leer, zu groß, Parameter unbekannt oder nicht eindeutig)"""
+    pass
+
+
+def _overall_status(succeeded: int, failed: int) -> str:
+    if failed == 0:
+        return BATCH_SUCCESS
+    return BATCH_PARTIAL if succeeded else BATCH_ERROR
+
+
+@dataclass
+class _ItemResult:
+    index: int
+    params: Dict[str, Any]
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    execution_time: float = 0.0
+    table: Optional[DataTable] = None
+    error: Optional[str] = None
+    trace: Optional[dict] = None
+
+
+@dataclass
+class BatchResult:
+    procedure: Procedure
+    executions: List[ProcedureExecution] = field(default_factory=list)
+    execution_time: float = 0.0
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for e in self.executions if e.status == "success")
+
+    @property
+    def failed(self) -> int:
+        return len(self.executions) - self.succeeded
+
+    @property
+    def status(self) -> str:
+        return _overall_status(self.succeeded, self.failed)
+
+
+def table_parameter(procedure: Procedure, name: Optional[str] = None) -> str:
+    """
+    Name des Table-Parameters, auf den Tabellen-IDs verteilt werden
+    Ohne Angabe muss die Prozedur genau einen Table-Parameter haben.
+    """
+    param_schema = get_compiled_procedure(procedure).param_schema
+    if name is not None:
+        if name not in param_schema:
+            raise ProcedureBatchError(f"Parameter '{name}' existiert nicht")
+        return name
+    tables = [param for param, info in param_schema.items() if info["type"] == "Table"]
+    if len(tables) != 1:
+        raise ProcedureBatchError(
+            "table_parameter angeben: die Prozedur hat "
+            f"{len(tables) or 'keinen'} Table-Parameter" + (f" ({', '.join(tables)})" if tables else "")
+        )
+    return tables[0]
+
+
+def expand_parameter_sets(
+    procedure: Procedure,
+    parameter_sets: Optional[List[Dict[str, Any]]] = None,
+    table_ids: Optional[List[int]] = None,
+    parameters: Optional[Dict[str, Any]] = None,
+    table_param: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Parameter-Sätze des Batches
+    parameters gilt für alle Sätze; table_ids erzeugt je Tabelle einen Satz,
+    in dem die ID im Table-Parameter steht.
+    """
+    common = parameters or {}
+    param_sets = [{**common, **params} for params in parameter_sets or []]
+    if table_ids:
+        name = table_parameter(procedure, table_param)
+        param_sets.extend({**common, name: table_id} for table_id in table_ids)
+
+    if not param_sets:
+        raise ProcedureBatchError("Keine Parameter-Sätze angegeben (parameter_sets oder table_ids)")
+    if len(param_sets) > BATCH_MAX_ITEMS:
+        raise ProcedureBatchError(f"Zu viele Parameter-Sätze ({len(param_sets)}, maximal {BATCH_MAX_ITEMS})")
+    return param_sets
+
+
+def run_batch(
+    procedure: Procedure,
+    param_sets: List[Dict[str, Any]],
+    db: Session,
+    project_id: Optional[int] = None,
+    max_parallelism: Optional[int] = None,
+    timeout: int = 30,
+    trace: Optional[bool] = None,
+    backend: Optional[str] = None,
+    session_factory: Optional[Callable[[], Session]] = None
+) -> BatchResult:
+    """
+    Führt die Prozedur für alle Parameter-Sätze aus und speichert die Ergebnisse gemeinsam
+
+    Returns:
+        BatchResult mit einer ProcedureExecution je Satz (in Reihenfolge der Sätze)
+    """
+    started = time.time()
+    result = BatchResult(procedure=procedure)
+    session_factory = session_factory or sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+
+    # Einmal kompilieren; Fehler hier gelten für alle Sätze
+    try:
+        get_compiled_procedure(procedure)
+        compile_error = None
+    except Exception as e:
+        compile_error = str(e)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    width = len(str(len(param_sets)))
+
+    def run_item(index: int, params: Dict[str, Any]) -> _ItemResult:
+        item = _ItemResult(index=index, params=params, started_at=datetime.now(timezone.utc))
+        item_started = time.time()
+        item_db = session_factory()
+        try:
+            with tracing(f"{procedure.name}_v{procedure.version}[{index}]", enabled=trace) as active_trace:
+                try:
+                    frame = call_procedure(procedure, params, item_db, timeout=timeout, backend=backend)
+                    name = f"{procedure.name}_v{procedure.version}_{timestamp}_{index + 1:0{width}d}"
+                    item.table = dataframe_to_datatable(frame, name, project_id)
+                except Exception as e:
+                    item.error = str(e)
+            item.trace = active_trace.to_dict() if active_trace else None
+        finally:
+            item_db.close()
+        item.execution_time = time.time() - item_started
+        item.finished_at = datetime.now(timezone.utc)
+        return item
+
+    items: List[Optional[_ItemResult]] = [None] * len(param_sets)
+    if compile_error is not None:
+        now = datetime.now(timezone.utc)
+        for index, params in enumerate(param_sets):
+            items[index] = _ItemResult(index, params, now, now, error=compile_error)
+    else:
+        workers = max(1, min(max_parallelism or BATCH_PARALLELISM, len(param_sets)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="procedure-batch") as pool:
+            futures = [pool.submit(run_item, index, params) for index, params in enumerate(param_sets)]
+            for future in as_completed(futures):
+                item = future.result()
+                items[item.index] = item
+
+    # Ergebnis-Tabellen und Ausführungen gemeinsam schreiben (IDs in Reihenfolge der Sätze)
+    db.add_all([item.table for item in items if item.table is not None])
+    db.flush()
+    for item in items:
+        result.executions.append(ProcedureExecution(
+            procedure_id=procedure.id,
+            project_id=project_id,
+            input_params=item.params,
+            status="success" if item.error is None else "error",
+            output_table_id=item.table.id if item.table is not None else None,
+            error_message=item.error,
+            execution_time=item.execution_time,
+            progress=1.0 if item.error is None else None,
+            started_at=item.started_at,
+            finished_at=item.finished_at
+        ))
+    db.add_all(result.executions)
+    db.commit()
+
+    # Alle Einträge mit einer Abfrage neu laden (statt refresh je Eintrag)
+    db.query(ProcedureExecution).filter(
+        ProcedureExecution.id.in_([execution.id for execution in result.executions])
+    ).all()
+    for execution, item in zip(result.executions, items):
+        # Trace nur an das Objekt hängen (nicht persistiert)
+        execution.trace = item.trace
+
+    result.execution_time = time.time() - started
+    return result
+
+
+# --- Sweep ------------------------------------------------------------------
+
+@dataclass
+class SweepPoint:
+    index: int
+    values: Dict[str, Any]  # Rasterwerte dieses Punkts
+    status: str = "success"
+    error: Optional[str] = None
+    rows: Optional[int] = None
+    columns: Optional[List[str]] = None
+    totals: Optional[Dict[str, Optional[float]]] = None  # Summen der numerischen Spalten
+    preview: Optional[List[dict]] = None
+    execution_time: float = 0.0
+    output_table_id: Optional[int] = None
+    execution_id: Optional[int] = None
+    table: Optional[DataTable] = None
+
+
+@dataclass
+class SweepResult:
+    procedure: Procedure
+    points: List[SweepPoint] = field(default_factory=list)
+    load_time: float = 0.0
+    execution_time: float = 0.0
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for p in self.points if p.status == "success")
+
+    @property
+    def failed(self) -> int:
+        return len(self.points) - self.succeeded
+
+    @property
+    def status(self) -> str:
+        return _overall_status(self.succeeded, self.failed)
+
+
+def expand_grid(procedure: Procedure, grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Alle Kombinationen des Rasters (kartesisches Produkt, Reihenfolge wie angegeben)"""
+    if not grid:
+        raise ProcedureBatchError("Kein Raster angegeben")
+    param_schema = get_compiled_procedure(procedure).param_schema
+    for name, values in grid.items():
+        if name not in param_schema:
+            raise ProcedureBatchError(f"Parameter '{name}' existiert nicht")
+        if param_schema[name]["type"] in _TABLE_TYPES:
+            raise ProcedureBatchError(f"Parameter '{name}' ist eine Tabelle, im Raster sind nur Skalare erlaubt")
+        if not isinstance(values, list) or not values:
+            raise ProcedureBatchError(f"Raster für '{name}' muss eine nicht-leere Liste sein")
+
+    total = 1
+    for values in grid.values():
+        total *= len(values)
+    if total > SWEEP_MAX_POINTS:
+        raise ProcedureBatchError(f"Zu viele Rasterpunkte ({total}, maximal {SWEEP_MAX_POINTS})")
+
+    names = list(grid.keys())
+    return [dict(zip(names, combination)) for combination in itertools.product(*grid.values())]
+
+
+def _freeze(frame: pd.DataFrame) -> bool:
+    """Macht die Spalten-Arrays schreibgeschützt; False, wenn das nicht für alle geht"""
+    frozen = True
+    for block in frame._mgr.blocks:
+        if isinstance(block.values, np.ndarray):
+            block.values.flags.writeable = False
+        else:
+            frozen = False  # Extension-Arrays lassen sich nicht schützen
+    return frozen
+
+
+def _share_inputs(prepared: Dict[str, Any]) -> Dict[str, bool]:
+    """Eingabe-DataFrames für alle Punkte schützen; Ergebnis: Parameter → teilbar"""
+    shareable = {}
+    for name, value in prepared.items():
+        if isinstance(value, pd.DataFrame):
+            shareable[name] = _freeze(value)
+        elif isinstance(value, list) and value and all(isinstance(v, pd.DataFrame) for v in value):
+            shareable[name] = all([_freeze(frame) for frame in value])
+    return shareable
+
+
+def _point_inputs(prepared: Dict[str, Any], shareable: Dict[str, bool], deep: bool) -> Dict[str, Any]:
+    """Eingaben eines Punkts: flache Kopien geteilter DataFrames, sonst tiefe Kopien"""
+    inputs = dict(prepared)
+    for name, shared in shareable.items():
+        copy_deep = deep or not shared
+        value = prepared[name]
+        if isinstance(value, list):
+            inputs[name] = [frame.copy(deep=copy_deep) for frame in value]
+        else:
+            inputs[name] = value.copy(deep=copy_deep)
+    return inputs
+
+
+def _summarize(point: SweepPoint, frame: pd.DataFrame, preview_rows: int) -> None:
+    point.rows = len(frame)
+    point.columns = [str(col) for col in frame.columns]
+    totals = frame.select_dtypes("number").sum()
+    point.totals = {str(col): (None if pd.isna(value) else float(value)) for col, value in totals.items()}
+    if preview_rows > 0:
+        point.preview = json.loads(frame.head(preview_rows).to_json(orient="records", date_format="iso"))
+
+
+def _is_read_only_write(error: Exception) -> bool:
+    return isinstance(error, ValueError) and "read-only" in str(error)
+
+
+def run_sweep(
+    procedure: Procedure,
+    parameters: Dict[str, Any],
+    grid: Dict[str, List[Any]],
+    db: Session,
+    project_id: Optional[int] = None,
+    materialize: bool = False,
+    preview_rows: int = 0,
+    max_parallelism: Optional[int] = None,
+    timeout: int = 30,
+    backend: Optional[str] = None
+) -> SweepResult:
+    """
+    Wertet die Prozedur für alle Rasterpunkte aus
+
+    parameters enthält die festen Parameter (Tabellen-IDs werden einmal geladen),
+    grid die Wertelisten der variierten Skalare. Mit materialize=True wird je
+    erfolgreichem Punkt eine DataTable samt ProcedureExecution gespeichert
+    (ein Commit), sonst wird nichts geschrieben.
+
+    Raises:
+        ProcedureBatchError bei ungültigem Raster, Fehler beim Laden der Eingaben
+    """
+    started = time.time()
+    result = SweepResult(procedure=procedure)
+    combinations = expand_grid(procedure, grid)
+    fixed = {name: value for name, value in parameters.items() if name not in grid}
+
+    # Eingaben einmal laden und konvertieren, danach schreibgeschützt teilen
+    compiled = get_compiled_procedure(procedure)
+    prepared = prepare_parameters(fixed, compiled.param_schema, db)
+    shareable = _share_inputs(prepared)
+    result.load_time = time.time() - started
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    width = len(str(len(combinations)))
+
+    def run_point(index: int, values: Dict[str, Any]) -> SweepPoint:
+        point = SweepPoint(index=index, values=values)
+        point_started = time.time()
+        try:
+            try:
+                frame = call_procedure(
+                    procedure, {**_point_inputs(prepared, shareable, deep=False), **values}, db,
+                    timeout=timeout, backend=backend
+                )
+            except ValueError as e:
+                if not _is_read_only_write(e):
+                    raise
+                # Prozedur schreibt in eine Eingabe-Spalte → mit eigenen Kopien wiederholen
+                frame = call_procedure(
+                    procedure, {**_point_inputs(prepared, shareable, deep=True), **values}, db,
+                    timeout=timeout, backend=backend
+                )
+            _summarize(point, frame, preview_rows)
+            if materialize:
+                name = f"{procedure.name}_v{procedure.version}_{timestamp}_{index + 1:0{width}d}"
+                point.table = dataframe_to_datatable(frame, name, project_id)
+        except Exception as e:
+            point.status = "error"
+            point.error = str(e)
+        point.execution_time = time.time() - point_started
+        return point
+
+    points: List[Optional[SweepPoint]] = [None] * len(combinations)
+    workers = max(1, min(max_parallelism or BATCH_PARALLELISM, len(combinations)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="procedure-sweep") as pool:
+        futures = [pool.submit(run_point, index, values) for index, values in enumerate(combinations)]
+        for future in as_completed(futures):
+            point = future.result()
+            points[point.index] = point
+    result.points = points
+
+    if materialize:
+        _save_points(procedure, parameters, points, db, project_id)
+
+    result.execution_time = time.time() - started
+    return result
+
+
+def _save_points(
+    procedure: Procedure,
+    parameters: Dict[str, Any],
+    points: List[SweepPoint],
+    db: Session,
+    project_id: Optional[int]
+) -> None:
+    """Materialisierte Punkte als DataTable + ProcedureExecution speichern (ein Commit)"""
+    saved = [point for point in points if point.table is not None]
+    db.add_all([point.table for point in saved])
+    db.flush()
+    executions = []
+    for point in saved:
+        point.output_table_id = point.table.id
+        executions.append(ProcedureExecution(
+            procedure_id=procedure.id,
+            project_id=project_id,
+            input_params={**parameters, **point.values},
+            status="success",
+            output_table_id=point.table.id,
+            execution_time=point.execution_time,
+            progress=1.0
+        ))
+    db.add_all(executions)
+    db.flush()
+    for point, execution in zip(saved, executions):
+        point.execution_id = execution.id
+        point.table = None
+    db.commit()
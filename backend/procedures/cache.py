@@ -0,0 +1,85 @@
+"""
+LRU-Cache für kompilierte Prozeduren
+
+Prozeduren sind pro (id, version) unveränderlich. Validierung, Signatur-Parsing
+und exec des Codes passieren daher nur einmal; weitere Ausführungen verwenden
+die fertige Funktion aus dem Cache.
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import CodeType
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+@dataclass
+class CompiledProcedure:
+    procedure_id: int
+    name: str
+    version: int
+    code: CodeType
+    param_schema: Dict[str, Dict[str, Any]]
+    func: Callable
+
+
+class ProcedureCache:
+    """Thread-sicherer LRU-Cache mit fester Maximalgröße"""
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, CompiledProcedure]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Hashable, loader: Callable[[], CompiledProcedure]) -> CompiledProcedure:
+        """Liefert den Eintrag zu key, bei Bedarf über loader erzeugt (Fehler werden nicht gecacht)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = loader()
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, procedure_id: Optional[int] = None, name: Optional[str] = None) -> int:
+        """Entfernt Einträge einer Prozedur-ID oder aller Versionen eines Namens"""
+        with self._lock:
+            keys = [
+                key for key, entry in self._entries.items()
+                if (procedure_id is not None and entry.procedure_id == procedure_id)
+                or (name is not None and entry.name == name)
+            ]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+procedure_cache = ProcedureCache(int(os.getenv("PROCEDURE_CACHE_SIZE", "128")))
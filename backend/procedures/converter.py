@@ -1,7 +1,17 @@
+import logging
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import re
+import time
+from metrics import observe_conversion
 from models import DataTable
-from typing import Optional
+from storage import write_columns, read_dataframe, is_columnar
+from typing import Callable, Dict, List, Optional, Union
+from .tracing import trace_stage, record_frame
+
+logger = logging.getLogger(__name__)
 
 
 def parse_currency(value) -> Optional[float]:
@@ -27,103 +37,159 @@ def parse_currency(value) -> Optional[float]:
         return None
 
 
+# Registry: Spaltentyp → vektorisierte Konvertierung einer ganzen Spalte
+COLUMN_CONVERTERS: Dict[str, Callable[[pd.Series], pd.Series]] = {}
+
+
+def register_column_converter(*col_types: str):
+    """Registriert eine Konvertierung für einen oder mehrere Spaltentypen"""
+    def decorator(func):
+        for col_type in col_types:
+            COLUMN_CONVERTERS[col_type] = func
+        return func
+    return decorator
+
+
+# Gültige Zahl nach Bereinigung (entspricht dem, was float() bei parse_currency akzeptiert)
+_NUMBER_PATTERN = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+
+
+def _parse_numeric_text(series: pd.Series, strip_chars: str) -> pd.Series:
+    """
+    Zahlen bleiben, Texte werden bereinigt (Symbole, Leerzeichen, Dezimalkomma) und geparst
+    Die Textverarbeitung läuft über Arrow-Compute-Kernel statt pro Zelle in Python.
+    """
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series.astype(float)
+    
+    kind = pd.api.types.infer_dtype(series, skipna=True)
+    if kind == 'string':
+        is_text = series.notna()
+    elif kind in ('integer', 'floating', 'mixed-integer-float', 'decimal', 'empty'):
+        return pd.to_numeric(series, errors='coerce').astype(float)
+    else:
+        is_text = series.map(lambda v: isinstance(v, str)).astype(bool)
+    
+    result = pd.to_numeric(series.where(~is_text), errors='coerce').astype(float)
+    if is_text.any():
+        text = pc.utf8_trim_whitespace(pa.array(series[is_text], type=pa.string()))
+        for char in strip_chars:
+            text = pc.replace_substring(text, char, '')
+        text = pc.replace_substring(text, ',', '.')
+        text = pc.if_else(pc.match_substring_regex(text, _NUMBER_PATTERN), text, pa.scalar(None, pa.string()))
+        result[is_text] = pc.cast(text, pa.float64()).to_numpy(zero_copy_only=False)
+    return result
+
+
+@register_column_converter('integer', 'number')
+def _convert_number(series: pd.Series) -> pd.Series:
+    numeric = pd.to_numeric(series, errors='coerce')
+    # Ganzzahlen als Int64, Dezimalzahlen bleiben float
+    if pd.api.types.is_float_dtype(numeric) and not (numeric.dropna() % 1 == 0).all():
+        return numeric
+    return numeric.astype('Int64')
+
+
+@register_column_converter('float')
+def _convert_float(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series, errors='coerce')
+
+
+@register_column_converter('currency')
+def _convert_currency(series: pd.Series) -> pd.Series:
+    # Vektorisierte Variante von parse_currency
+    return _parse_numeric_text(series, '€$£¥₹ ')
+
+
+@register_column_converter('percent')
+def _convert_percent(series: pd.Series) -> pd.Series:
+    # Prozent als float speichern ("12,5 %" → 12.5)
+    return _parse_numeric_text(series, '% ')
+
+
+@register_column_converter('boolean')
+def _convert_boolean(series: pd.Series) -> pd.Series:
+    return series.astype(bool)
+
+
+@register_column_converter('datetime', 'date')
+def _convert_datetime(series: pd.Series) -> pd.Series:
+    return pd.to_datetime(series, errors='coerce')
+
+
+def _rows_to_frame(rows: List[dict]) -> pd.DataFrame:
+    """Baut den DataFrame spaltenweise aus Zeilen-Dicts (JSON-Speicher)"""
+    keys = dict.fromkeys(key for row in rows for key in row)
+    return pd.DataFrame({key: [row.get(key) for row in rows] for key in keys})
+
+
 def datatable_to_dataframe(table: DataTable) -> pd.DataFrame:
     """Konvertiert DataTable zu pandas DataFrame mit korrekten Typen"""
-    if not table.data:
-        return pd.DataFrame()
-    
-    df = pd.DataFrame(table.data)
+    started = time.perf_counter()
+    df = _datatable_to_dataframe(table)
+    observe_conversion("to_dataframe", time.perf_counter() - started, len(df))
+    return df
+
+
+def _datatable_to_dataframe(table: DataTable) -> pd.DataFrame:
+    with trace_stage("load_table", table=table.name, storage=table.storage_format) as entry:
+        if is_columnar(table):
+            # Spaltenbasierter Speicher: DataFrame direkt aus den Chunks
+            df = read_dataframe(table, with_row_ids=False)
+        elif table.data:
+            df = _rows_to_frame(table.data)
+        else:
+            df = pd.DataFrame()
+        record_frame(entry, df)
     
-    # DEBUG: Vor der Konvertierung
-    print("\n" + "="*80)
-    print(f"DEBUG: DataTable '{table.name}' wird zu DataFrame konvertiert")
-    print(f"Anzahl Zeilen: {len(df)}, Anzahl Spalten: {len(df.columns)}")
-    print(f"Spalten im DataFrame: {list(df.columns)}")
+    if df.empty:
+        return pd.DataFrame()
     
     # Entferne 'id' Spalte falls vorhanden (interne DB-ID)
     if 'id' in df.columns:
         df = df.drop('id', axis=1)
     
-    print("\nVOR Type-Konvertierung:")
-    print(df.dtypes)
-    print("\nErste 3 Zeilen:")
-    print(df.head(3))
-    
     # Prüfe ob Daten im alten Format (col_1, col_2) oder neuen Format (echte Namen) sind
     has_col_format = any(col.startswith('col_') for col in df.columns)
     
     # Verwende columns-Info für Umbenennung und Type-Konvertierung
     if table.columns:
-        print("\nColumn-Info aus DB:")
-        for col_info in table.columns:
-            print(f"  ID {col_info['id']}: {col_info['name']} ({col_info.get('type', 'unknown')})")
-        
-        # Erstelle Mapping basierend auf Format
-        rename_map = {}
-        column_map = {}
-        
-        if has_col_format:
-            # Altes Format: col_1 -> echter Name
-            print("\nAltes Format erkannt (col_X), benenne um...")
-            for col_info in table.columns:
-                col_id = col_info['id']
-                col_key = f"col_{col_id}"
-                real_name = col_info['name']
-                
-                if col_key in df.columns:
-                    rename_map[col_key] = real_name
-                    column_map[real_name] = col_info
-        else:
-            # Neues Format: echte Namen bereits vorhanden
-            print("\nNeues Format erkannt (echte Namen)")
-            for col_info in table.columns:
-                real_name = col_info['name']
-                if real_name in df.columns:
-                    column_map[real_name] = col_info
-        
-        # Benenne Spalten um (nur bei altem Format nötig)
-        if rename_map:
-            print(f"Benenne Spalten um: {rename_map}")
-            df = df.rename(columns=rename_map)
-        
-        # Type-Konvertierung
-        for col_name, col_info in column_map.items():
-            col_type = col_info.get('type', 'string')
+        with trace_stage("convert_types", table=table.name) as entry:
+            # Erstelle Mapping basierend auf Format
+            rename_map = {}
+            column_map = {}
             
-            try:
-                # Unterstütze sowohl alte Backend-Namen als auch neue Frontend-Namen
-                if col_type in ['integer', 'number']:
-                    df[col_name] = pd.to_numeric(df[col_name], errors='coerce').astype('Int64')
-                
-                elif col_type in ['float', 'currency']:
-                    # Bei currency: Parse Währungssymbole
-                    if col_type == 'currency':
-                        df[col_name] = df[col_name].apply(parse_currency)
-                    else:
-                        df[col_name] = pd.to_numeric(df[col_name], errors='coerce')
-                
-                elif col_type == 'boolean':
-                    df[col_name] = df[col_name].astype(bool)
-                
-                elif col_type in ['datetime', 'date']:
-                    df[col_name] = pd.to_datetime(df[col_name], errors='coerce')
-                
-                elif col_type == 'percent':
-                    # Prozent als float speichern
-                    df[col_name] = pd.to_numeric(df[col_name], errors='coerce')
-                
-                # string und time bleiben string (default)
+            if has_col_format:
+                # Altes Format: col_1 -> echter Name
+                for col_info in table.columns:
+                    col_key = f"col_{col_info['id']}"
+                    if col_key in df.columns:
+                        rename_map[col_key] = col_info['name']
+                        column_map[col_info['name']] = col_info
+            else:
+                # Neues Format: echte Namen bereits vorhanden
+                for col_info in table.columns:
+                    if col_info['name'] in df.columns:
+                        column_map[col_info['name']] = col_info
+            
+            # Benenne Spalten um (nur bei altem Format nötig)
+            if rename_map:
+                df = df.rename(columns=rename_map)
+            
+            # Type-Konvertierung über die Registry (string und time bleiben string)
+            for col_name, col_info in column_map.items():
+                col_type = col_info.get('type', 'string')
+                converter = COLUMN_CONVERTERS.get(col_type)
+                if converter is None:
+                    continue
                 
-            except Exception as e:
-                # Bei Fehler: Spalte als string belassen
-                print(f"Warnung: Konnte Spalte '{col_name}' nicht zu {col_type} konvertieren: {e}")
-    
-    # DEBUG: Nach der Konvertierung
-    print("\nNACH Type-Konvertierung und Umbenennung:")
-    print(df.dtypes)
-    print("\nErste 3 Zeilen:")
-    print(df.head(3))
-    print("="*80 + "\n")
+                try:
+                    df[col_name] = converter(df[col_name])
+                except Exception as e:
+                    # Bei Fehler: Spalte als string belassen
+                    logger.warning("Konnte Spalte '%s' nicht zu %s konvertieren: %s", col_name, col_type, e)
+            
+            record_frame(entry, df)
     
     return df
 
@@ -157,77 +223,75 @@ def format_currency(value, symbol='€') -> str:
     return f"{value:,.2f} {symbol}".replace(',', 'X').replace('.', ',').replace('X', '.')
 
 
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def serialize_column(series: pd.Series) -> Union[list, pa.Array]:
+    """
+    Konvertiert eine Spalte vektorisiert in JSON-kompatible Werte
+    NaN/NaT → None, Datum → 'YYYY-MM-DD HH:MM:SS', numpy-Typen → Python-Typen
+    Numerische Spalten werden direkt als Arrow-Array zurückgegeben.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pa.Array.from_pandas(series.dt.strftime(DATETIME_FORMAT))
+    
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        try:
+            return pa.Array.from_pandas(series)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass  # z.B. komplexe Zahlen → Objekt-Pfad
+    
+    values = series.astype(object).where(series.notna(), None).tolist()
+    if any(isinstance(v, np.generic) for v in values):
+        values = [v.item() if isinstance(v, np.generic) else v for v in values]
+    return values
+
+
+def _to_list(values: Union[list, pa.Array]) -> list:
+    return values.to_pylist() if isinstance(values, pa.Array) else values
+
+
+def _row_ids(df: pd.DataFrame) -> list:
+    """Zeilen-IDs aus dem Index (1-basiert), sonst fortlaufend"""
+    if pd.api.types.is_integer_dtype(df.index):
+        return (df.index + 1).tolist()
+    return list(range(1, len(df) + 1))
+
+
 def dataframe_to_datatable(
     df: pd.DataFrame, 
     name: str, 
     project_id: Optional[int] = None
 ) -> DataTable:
     """Konvertiert pandas DataFrame zu DataTable"""
+    started = time.perf_counter()
+    with trace_stage("serialize_table", table=name) as entry:
+        # Columns definieren - verwende echte Spaltennamen
+        columns = []
+        for i, col in enumerate(df.columns):
+            col_type = infer_column_type(df[col], col)  # Übergebe Spaltennamen für bessere Inferenz
+            columns.append({
+                "id": i + 1,
+                "name": col,  # Echter Spaltenname
+                "type": col_type
+            })
+        
+        # Daten spaltenweise konvertieren und direkt als Spalten-Chunks speichern
+        values = {
+            col["id"]: serialize_column(df.iloc[:, i])
+            for i, col in enumerate(columns)
+        }
+        
+        table = DataTable(name=name, project_id=project_id)
+        write_columns(table, columns, _row_ids(df), values)
+        record_frame(entry, df)
     
-    print("\n" + "="*80)
-    print(f"DEBUG: DataFrame wird zu DataTable '{name}' konvertiert")
-    print(f"Anzahl Zeilen: {len(df)}, Anzahl Spalten: {len(df.columns)}")
-    print(f"Spalten: {list(df.columns)}")
-    print("\nDataFrame dtypes:")
-    print(df.dtypes)
-    print("\nErste 3 Zeilen:")
-    print(df.head(3))
-    
-    # Columns definieren - verwende echte Spaltennamen
-    columns = []
-    for i, col in enumerate(df.columns):
-        col_type = infer_column_type(df[col], col)  # Übergebe Spaltennamen für bessere Inferenz
-        columns.append({
-            "id": i + 1,
-            "name": col,  # Echter Spaltenname
-            "type": col_type
-        })
-    
-    print("\nColumn-Definitionen:")
-    for col in columns:
-        print(f"  ID {col['id']}: {col['name']} ({col['type']})")
-    
-    # Data konvertieren
-    # Konvertiere NaN/NaT zu None für JSON-Serialisierung
-    df_clean = df.copy()
-    for col in df_clean.columns:
-        if pd.api.types.is_datetime64_any_dtype(df_clean[col]):
-            # Konvertiere datetime zu String, NaT zu None
-            df_clean[col] = df_clean[col].apply(
-                lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if pd.notna(x) else None
-            )
-        else:
-            # Konvertiere NaN zu None
-            df_clean[col] = df_clean[col].apply(
-                lambda x: None if pd.isna(x) else x
-            )
-    
-    # Konvertiere zu dict mit col_X als Keys (für Konsistenz mit bestehendem Format)
-    data = []
-    for idx, row in df_clean.iterrows():
-        row_dict = {'id': int(idx) + 1}
-        for i, col in enumerate(df_clean.columns):
-            col_key = f"col_{i + 1}"
-            value = row[col]
-            # Zusätzliche Sicherheit: Konvertiere pandas-spezifische Types
-            if pd.isna(value):
-                value = None
-            elif hasattr(value, 'item'):  # numpy types
-                value = value.item()
-            row_dict[col_key] = value
-        data.append(row_dict)
-    
-    print(f"\nErste Zeile in data:")
-    if data:
-        print(data[0])
-    
-    print("="*80 + "\n")
-    
-    return DataTable(
-        name=name,
-        project_id=project_id,
-        columns=columns,
-        data=data,
-        row_count=len(df),
-        column_count=len(df.columns)
-    )
+    observe_conversion("to_datatable", time.perf_counter() - started, len(df))
+    return table
+
+
+def dataframe_to_records(df: pd.DataFrame) -> List[dict]:
+    """Konvertiert DataFrame zu Zeilen-Dicts im Format {"id": 1, "col_1": ...}"""
+    keys = ['id'] + [f"col_{i + 1}" for i in range(len(df.columns))]
+    column_values = [_row_ids(df)] + [_to_list(serialize_column(df.iloc[:, i])) for i in range(len(df.columns))]
+    return [dict(zip(keys, values)) for values in zip(*column_values)]
@@ -1,13 +1,22 @@
+import os
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 from sqlalchemy.orm import Session
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Optional
 import pandas as pd
 
 from models import Procedure, ProcedureExecution, DataTable
 from .sandbox import create_safe_namespace, validate_code
+from .cache import CompiledProcedure, procedure_cache
+from .pool import get_worker_pool, ProcedureCancelledError
 from .parser import parse_function_signature
 from .converter import datatable_to_dataframe, dataframe_to_datatable
+from .tracing import tracing, trace_stage, record_frame
+from metrics import PROCEDURE_DURATION, observe_duration
+
+
+# 'inline' = im API-Prozess, 'process' = im Worker-Pool (procedures/pool.py)
+EXECUTION_BACKEND = os.getenv("PROCEDURE_EXECUTION_BACKEND", "inline")
 
 
 class ProcedureExecutionError(Exception):
@@ -28,8 +37,12 @@ def prepare_parameters(params: Dict[str, Any], param_schema: Dict[str, Dict], db
             
         param_type = param_schema[param_name]["type"]
         
+        # DataFrame direkt übernehmen (z.B. aus einem Workflow-Node)
+        if param_type == "Table" and isinstance(param_value, pd.DataFrame):
+            prepared[param_name] = param_value
+        
         # Table → DataFrame
-        if param_type == "Table":
+        elif param_type == "Table":
             table = db.query(DataTable).filter(DataTable.id == param_value).first()
             if not table:
                 raise ProcedureExecutionError(f"Tabelle mit ID {param_value} nicht gefunden")
@@ -42,6 +55,9 @@ def prepare_parameters(params: Dict[str, Any], param_schema: Dict[str, Dict], db
             
             dataframes = []
             for table_id in param_value:
+                if isinstance(table_id, pd.DataFrame):
+                    dataframes.append(table_id)
+                    continue
                 table = db.query(DataTable).filter(DataTable.id == table_id).first()
                 if not table:
                     raise ProcedureExecutionError(f"Tabelle mit ID {table_id} nicht gefunden")
@@ -55,12 +71,129 @@ def prepare_parameters(params: Dict[str, Any], param_schema: Dict[str, Dict], db
     return prepared
 
 
+def compile_procedure(procedure: Procedure) -> CompiledProcedure:
+    """
+    Validiert, parst und kompiliert eine Prozedur
+    Ergebnis ist unabhängig von den Aufruf-Parametern und kann gecacht werden.
+    """
+    # 1. Code validieren
+    is_valid, error_msg = validate_code(procedure.code)
+    if not is_valid:
+        raise ProcedureExecutionError(error_msg)
+    
+    # 2. Parameter-Schema extrahieren
+    param_schema = parse_function_signature(procedure.code, procedure.name)
+    
+    # Überschreibe Types mit gespeicherten parameter_types (falls vorhanden)
+    if procedure.parameter_types:
+        for param_name, param_type in procedure.parameter_types.items():
+            if param_name in param_schema:
+                param_schema[param_name]["type"] = param_type
+    
+    # 3. Code kompilieren und im sicheren Namespace ausführen
+    code = compile(procedure.code, f"<procedure {procedure.name} v{procedure.version}>", "exec")
+    namespace = create_safe_namespace()
+    exec(code, namespace)
+    
+    if procedure.name not in namespace:
+        raise ProcedureExecutionError(f"Funktion '{procedure.name}' nicht im Code gefunden")
+    
+    return CompiledProcedure(
+        procedure_id=procedure.id,
+        name=procedure.name,
+        version=procedure.version,
+        code=code,
+        param_schema=param_schema,
+        func=namespace[procedure.name]
+    )
+
+
+def get_compiled_procedure(procedure: Procedure) -> CompiledProcedure:
+    """Kompilierte Prozedur aus dem Cache (Schlüssel: id, version)"""
+    return procedure_cache.get(
+        (procedure.id, procedure.version),
+        lambda: compile_procedure(procedure)
+    )
+
+
+def call_procedure(
+    procedure: Procedure,
+    params: Dict[str, Any],
+    db: Session,
+    timeout: int = 30,
+    backend: Optional[str] = None,
+    should_cancel: Optional[Callable[[], bool]] = None,
+    step: Optional[Callable[[float, str], None]] = None
+) -> pd.DataFrame:
+    """
+    Führt eine Prozedur aus und gibt das Ergebnis als DataFrame zurück
+    Speichert nichts; Table-Parameter dürfen IDs oder bereits geladene DataFrames sein.
+    """
+    with observe_duration(PROCEDURE_DURATION, procedure=procedure.name, version=str(procedure.version)):
+        return _call_procedure(procedure, params, db, timeout, backend, should_cancel, step)
+
+
+def _call_procedure(
+    procedure: Procedure,
+    params: Dict[str, Any],
+    db: Session,
+    timeout: int,
+    backend: Optional[str],
+    should_cancel: Optional[Callable[[], bool]],
+    step: Optional[Callable[[float, str], None]]
+) -> pd.DataFrame:
+    step = step or (lambda fraction, stage: None)
+    
+    # 1. Validieren, Signatur parsen, kompilieren (gecacht pro id/version)
+    step(0.0, "compile")
+    with trace_stage("compile") as entry:
+        if entry is not None:
+            entry["cached"] = (procedure.id, procedure.version) in procedure_cache
+        compiled = get_compiled_procedure(procedure)
+    
+    # 2. Parameter vorbereiten
+    step(0.1, "prepare_parameters")
+    with trace_stage("prepare_parameters"):
+        prepared_params = prepare_parameters(params, compiled.param_schema, db)
+    
+    # 3. Funktion aufrufen
+    backend = backend or EXECUTION_BACKEND
+    step(0.3, "call")
+    with trace_stage("call", backend=backend) as entry:
+        if backend == "process":
+            result = get_worker_pool().run(
+                (procedure.id, procedure.version),
+                procedure.name,
+                procedure.code,
+                prepared_params,
+                timeout,
+                should_cancel=should_cancel
+            )
+        else:
+            result = compiled.func(**prepared_params)
+        if isinstance(result, pd.DataFrame):
+            record_frame(entry, result)
+    
+    # 4. Ergebnis validieren
+    if not isinstance(result, pd.DataFrame):
+        raise ProcedureExecutionError(
+            f"Funktion muss pandas DataFrame zurückgeben, nicht {type(result).__name__}"
+        )
+    
+    return result
+
+
 def execute_procedure(
     procedure: Procedure,
     params: Dict[str, Any],
     db: Session,
     project_id: int = None,
-    timeout: int = 30
+    timeout: int = 30,
+    trace: Optional[bool] = None,
+    backend: Optional[str] = None,
+    execution: Optional[ProcedureExecution] = None,
+    on_progress: Optional[Callable[[float, str], None]] = None,
+    should_cancel: Optional[Callable[[], bool]] = None
 ) -> ProcedureExecution:
     """
     Führt eine Prozedur aus
@@ -70,92 +203,76 @@ def execute_procedure(
         params: Parameter-Dict {"param_name": value}
         db: Database Session
         project_id: Optional Project ID
-        timeout: Timeout in Sekunden
+        timeout: Timeout in Sekunden (nur im Backend 'process' erzwungen)
+        trace: Tracing erzwingen (True/False), None = PROCEDURE_TRACE
+        backend: 'inline' oder 'process', None = PROCEDURE_EXECUTION_BACKEND
+        execution: Bestehender Eintrag (z.B. aus der Warteschlange), sonst neu
+        on_progress: Callback (Anteil 0-1, Stufe) zwischen den Schritten
+        should_cancel: Liefert True, wenn abgebrochen werden soll
     
     Returns:
-        ProcedureExecution-Objekt mit Ergebnis
+        ProcedureExecution-Objekt mit Ergebnis (bei Tracing mit Attribut `trace`)
     """
     
     start_time = time.time()
-    execution = ProcedureExecution(
-        procedure_id=procedure.id,
-        project_id=project_id,
-        input_params=params,
-        status="running"
-    )
+    if execution is None:
+        execution = ProcedureExecution(
+            procedure_id=procedure.id,
+            project_id=project_id,
+            input_params=params,
+            status="running",
+            started_at=datetime.now(timezone.utc)
+        )
     
-    try:
-        # 1. Code validieren
-        is_valid, error_msg = validate_code(procedure.code)
-        if not is_valid:
-            raise ProcedureExecutionError(error_msg)
-        
-        # 2. Parameter-Schema extrahieren
-        param_schema = parse_function_signature(procedure.code, procedure.name)
-        
-        # Überschreibe Types mit gespeicherten parameter_types (falls vorhanden)
-        if procedure.parameter_types:
-            for param_name, param_type in procedure.parameter_types.items():
-                if param_name in param_schema:
-                    param_schema[param_name]["type"] = param_type
-        
-        # 3. Parameter vorbereiten
-        prepared_params = prepare_parameters(params, param_schema, db)
-        
-        # 4. Namespace erstellen
-        namespace = create_safe_namespace()
-        
-        # 5. Code ausführen
-        exec(procedure.code, namespace)
-        
-        # 6. Funktion holen
-        if procedure.name not in namespace:
-            raise ProcedureExecutionError(f"Funktion '{procedure.name}' nicht im Code gefunden")
-        
-        func = namespace[procedure.name]
-        
-        # 7. Funktion aufrufen
-        result = func(**prepared_params)
-        
-        # DEBUG: Ergebnis der Funktion
-        print("\n" + "="*80)
-        print("DEBUG: Ergebnis nach Prozedur-Ausführung")
-        print(f"Type: {type(result)}")
-        print(f"Shape: {result.shape if isinstance(result, pd.DataFrame) else 'N/A'}")
-        if isinstance(result, pd.DataFrame):
-            print(f"Spalten: {list(result.columns)}")
-            print(f"Dtypes:\n{result.dtypes}")
-            print(f"\nErste 3 Zeilen:\n{result.head(3)}")
-        print("="*80 + "\n")
-        
-        # 8. Ergebnis validieren
-        if not isinstance(result, pd.DataFrame):
-            raise ProcedureExecutionError(
-                f"Funktion muss pandas DataFrame zurückgeben, nicht {type(result).__name__}"
+    def step(fraction: float, stage: str) -> None:
+        if should_cancel is not None and should_cancel():
+            raise ProcedureCancelledError("Ausführung abgebrochen")
+        if on_progress is not None:
+            on_progress(fraction, stage)
+    
+    with tracing(f"{procedure.name}_v{procedure.version}", enabled=trace) as active_trace:
+        try:
+            # 1.-4. Kompilieren, Parameter vorbereiten, aufrufen, Ergebnis prüfen
+            result = call_procedure(
+                procedure, params, db,
+                timeout=timeout, backend=backend, should_cancel=should_cancel, step=step
             )
-        
-        # 9. Ergebnis als neue Tabelle speichern
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        result_name = f"{procedure.name}_v{procedure.version}_{timestamp}"
-        
-        result_table = dataframe_to_datatable(result, result_name, project_id)
-        db.add(result_table)
-        db.flush()  # Um ID zu bekommen
-        
-        # 10. Execution erfolgreich
-        execution.status = "success"
-        execution.output_table_id = result_table.id
-        execution.execution_time = time.time() - start_time
-        
-    except Exception as e:
-        # Fehler behandeln
-        execution.status = "error"
-        execution.error_message = str(e)
-        execution.execution_time = time.time() - start_time
+            
+            # 5. Ergebnis als neue Tabelle speichern
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            result_name = f"{procedure.name}_v{procedure.version}_{timestamp}"
+            
+            step(0.9, "save_result")
+            result_table = dataframe_to_datatable(result, result_name, project_id)
+            with trace_stage("save_result"):
+                db.add(result_table)
+                db.flush()  # Um ID zu bekommen
+            
+            # 6. Execution erfolgreich
+            execution.status = "success"
+            execution.output_table_id = result_table.id
+            execution.progress = 1.0
+            execution.execution_time = time.time() - start_time
+            
+        except ProcedureCancelledError as e:
+            db.rollback()
+            execution.status = "cancelled"
+            execution.error_message = str(e)
+            execution.execution_time = time.time() - start_time
+            
+        except Exception as e:
+            # Fehler behandeln
+            execution.status = "error"
+            execution.error_message = str(e)
+            execution.execution_time = time.time() - start_time
     
     # Execution speichern
+    execution.finished_at = datetime.now(timezone.utc)
     db.add(execution)
     db.commit()
     db.refresh(execution)
     
+    # Trace nur an das Objekt hängen (nicht persistiert)
+    execution.trace = active_trace.to_dict() if active_trace else None
+    
     return execution
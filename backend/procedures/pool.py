@@ -0,0 +1,333 @@
+"""
+Prozess-Pool für die Ausführung von Prozeduren
+
+User-Code läuft in vorgewärmten Worker-Prozessen (pandas/NumPy/pyarrow sind
+beim Start bereits importiert) statt im API-Worker. DataFrames werden als
+Arrow IPC zwischen API und Worker übertragen. Der Pool erzwingt:
+
+- Wall-Clock-Timeout pro Aufruf (Worker wird beendet und ersetzt)
+- RSS-Limit (Überwachung während des Aufrufs, Worker wird beendet)
+- optionales Adressraum-Limit im Worker (MemoryError statt OOM-Kill)
+- maximale Anzahl Aufgaben pro Worker (danach wird er ersetzt)
+
+Konfiguration über Umgebungsvariablen (siehe PoolConfig.from_env).
+"""
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np  # noqa: F401 - im Worker vorgewärmt
+import pandas as pd
+import pyarrow as pa
+
+from .sandbox import create_safe_namespace, validate_code
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Übertragungsformate für DataFrames
+_FORMAT_ARROW = "arrow"
+_FORMAT_PICKLE = "pickle"
+
+
+class ProcedureTimeoutError(Exception):
+    """Prozedur hat das Zeitlimit überschritten"""
+    pass
+
+
+class ProcedureMemoryError(Exception):
+    """Prozedur hat das Speicherlimit überschritten"""
+    pass
+
+
+class ProcedureCancelledError(Exception):
+    """Ausführung wurde abgebrochen"""
+    pass
+
+
+class ProcedureWorkerError(Exception):
+    """Fehler im User-Code oder im Worker-Prozess"""
+    pass
+
+
+@dataclass
+class PoolConfig:
+    size: int = 2
+    max_tasks_per_child: int = 100
+    rss_limit_mb: int = 0  # 0 = kein Limit
+    address_space_limit_mb: int = 0  # 0 = kein Limit
+    start_method: str = "spawn"
+    poll_interval: float = 0.1
+
+    @classmethod
+    def from_env(cls) -> "PoolConfig":
+        return cls(
+            size=int(os.getenv("PROCEDURE_POOL_SIZE", str(max(1, (os.cpu_count() or 2) - 1)))),
+            max_tasks_per_child=int(os.getenv("PROCEDURE_POOL_MAX_TASKS_PER_CHILD", "100")),
+            rss_limit_mb=int(os.getenv("PROCEDURE_POOL_RSS_LIMIT_MB", "0")),
+            address_space_limit_mb=int(os.getenv("PROCEDURE_POOL_ADDRESS_SPACE_LIMIT_MB", "0")),
+            start_method=os.getenv("PROCEDURE_POOL_START_METHOD", "spawn"),
+        )
+
+
+# --- Serialisierung ---------------------------------------------------------
+
+def dataframe_to_ipc(df: pd.DataFrame) -> tuple:
+    """DataFrame → (Format, Bytes); Arrow IPC, bei nicht konvertierbaren Spalten pickle"""
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return _FORMAT_PICKLE, pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return _FORMAT_ARROW, sink.getvalue().to_pybytes()
+
+
+def dataframe_from_ipc(payload: tuple) -> pd.DataFrame:
+    fmt, data = payload
+    if fmt == _FORMAT_PICKLE:
+        return pickle.loads(data)
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all().to_pandas()
+
+
+def _encode_params(params: Dict[str, Any]) -> Dict[str, tuple]:
+    encoded = {}
+    for name, value in params.items():
+        if isinstance(value, pd.DataFrame):
+            encoded[name] = ("frame", dataframe_to_ipc(value))
+        elif isinstance(value, list) and value and all(isinstance(v, pd.DataFrame) for v in value):
+            encoded[name] = ("frames", [dataframe_to_ipc(v) for v in value])
+        else:
+            encoded[name] = ("value", value)
+    return encoded
+
+
+def _decode_params(encoded: Dict[str, tuple]) -> Dict[str, Any]:
+    params = {}
+    for name, (kind, value) in encoded.items():
+        if kind == "frame":
+            params[name] = dataframe_from_ipc(value)
+        elif kind == "frames":
+            params[name] = [dataframe_from_ipc(v) for v in value]
+        else:
+            params[name] = value
+    return params
+
+
+# --- Worker-Prozess ---------------------------------------------------------
+
+def _worker_main(conn, address_space_limit_mb: int) -> None:
+    """Schleife im Worker: Aufgabe empfangen, ausführen, Ergebnis senden"""
+    if address_space_limit_mb:
+        import resource
+        limit = address_space_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    functions: "OrderedDict[tuple, Any]" = OrderedDict()
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+
+        try:
+            key = task["key"]
+            func = functions.get(key)
+            if func is None:
+                is_valid, error_msg = validate_code(task["code"])
+                if not is_valid:
+                    raise ProcedureWorkerError(error_msg)
+                namespace = create_safe_namespace()
+                exec(compile(task["code"], f"<procedure {task['name']} v{key[1]}>", "exec"), namespace)
+                if task["name"] not in namespace:
+                    raise ProcedureWorkerError(f"Funktion '{task['name']}' nicht im Code gefunden")
+                func = functions[key] = namespace[task["name"]]
+                while len(functions) > 32:
+                    functions.popitem(last=False)
+            functions.move_to_end(key)
+
+            result = func(**_decode_params(task["params"]))
+            if not isinstance(result, pd.DataFrame):
+                raise ProcedureWorkerError(
+                    f"Funktion muss pandas DataFrame zurückgeben, nicht {type(result).__name__}"
+                )
+            conn.send(("ok", dataframe_to_ipc(result)))
+        except MemoryError:
+            conn.send(("memory", "Speicherlimit im Worker überschritten"))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class _Worker:
+    def __init__(self, context, config: PoolConfig):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, config.address_space_limit_mb),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def rss_bytes(self) -> int:
+        """Aktueller RSS des Workers (Linux /proc, sonst 0)"""
+        try:
+            with open(f"/proc/{self.process.pid}/statm") as f:
+                return int(f.read().split()[1]) * _PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    def stop(self, kill: bool = False) -> None:
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class ProcedureWorkerPool:
+    """Pool vorgewärmter Worker-Prozesse"""
+
+    def __init__(self, config: Optional[PoolConfig] = None):
+        self.config = config or PoolConfig.from_env()
+        self._context = multiprocessing.get_context(self.config.start_method)
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._closed = False
+        self.stats = {"tasks": 0, "timeouts": 0, "memory_kills": 0, "cancelled": 0, "recycled": 0}
+
+    def start(self) -> "ProcedureWorkerPool":
+        with self._lock:
+            while len(self._workers) < self.config.size:
+                worker = _Worker(self._context, self.config)
+                self._workers.append(worker)
+                self._idle.put(worker)
+        return self
+
+    def _replace(self, worker: _Worker, kill: bool) -> _Worker:
+        worker.stop(kill=kill)
+        with self._lock:
+            self._workers.remove(worker)
+            replacement = _Worker(self._context, self.config)
+            self._workers.append(replacement)
+        return replacement
+
+    def run(
+        self,
+        key: tuple,
+        name: str,
+        code: str,
+        params: Dict[str, Any],
+        timeout: float,
+        should_cancel: Optional[Callable[[], bool]] = None
+    ) -> pd.DataFrame:
+        """
+        Führt die Funktion `name` aus `code` mit params in einem Worker aus
+        should_cancel wird während des Wartens abgefragt; bei True wird der Worker beendet.
+        """
+        if self._closed:
+            raise ProcedureWorkerError("Worker-Pool ist beendet")
+
+        task = {"key": key, "name": name, "code": code, "params": _encode_params(params)}
+        worker = self._idle.get()
+        try:
+            # Im Leerlauf beendete Worker (OOM-Kill, Absturz) ersetzen, bevor die Aufgabe startet
+            if not worker.process.is_alive():
+                worker = self._replace(worker, kill=True)
+            try:
+                worker.conn.send(task)
+            except (BrokenPipeError, OSError):
+                # Zwischen Prüfung und Senden beendet: Aufgabe an den Ersatz senden
+                worker = self._replace(worker, kill=True)
+                worker.conn.send(task)
+            deadline = time.monotonic() + timeout
+            rss_limit = self.config.rss_limit_mb * 1024 * 1024
+
+            while not worker.conn.poll(self.config.poll_interval):
+                if not worker.process.is_alive():
+                    worker = self._replace(worker, kill=True)
+                    raise ProcedureWorkerError("Worker-Prozess wurde unerwartet beendet")
+                if time.monotonic() > deadline:
+                    self.stats["timeouts"] += 1
+                    worker = self._replace(worker, kill=True)
+                    raise ProcedureTimeoutError(f"Zeitlimit von {timeout} Sekunden überschritten")
+                if rss_limit and worker.rss_bytes() > rss_limit:
+                    self.stats["memory_kills"] += 1
+                    worker = self._replace(worker, kill=True)
+                    raise ProcedureMemoryError(
+                        f"Speicherlimit von {self.config.rss_limit_mb} MB überschritten"
+                    )
+                if should_cancel is not None and should_cancel():
+                    self.stats["cancelled"] += 1
+                    worker = self._replace(worker, kill=True)
+                    raise ProcedureCancelledError("Ausführung abgebrochen")
+
+            try:
+                status, payload = worker.conn.recv()
+            except EOFError:
+                worker = self._replace(worker, kill=True)
+                raise ProcedureWorkerError("Worker-Prozess wurde unerwartet beendet")
+
+            worker.tasks += 1
+            self.stats["tasks"] += 1
+            if worker.tasks >= self.config.max_tasks_per_child or (
+                rss_limit and worker.rss_bytes() > rss_limit
+            ):
+                self.stats["recycled"] += 1
+                worker = self._replace(worker, kill=False)
+
+            if status == "memory":
+                raise ProcedureMemoryError(payload)
+            if status != "ok":
+                raise ProcedureWorkerError(payload)
+            return dataframe_from_ipc(payload)
+        finally:
+            self._idle.put(worker)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+
+
+_pool: Optional[ProcedureWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> ProcedureWorkerPool:
+    """Globaler Pool, wird beim ersten Zugriff gestartet"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcedureWorkerPool().start()
+        return _pool
+
+
+def shutdown_worker_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -0,0 +1,446 @@
+"""
+Warteschlange für asynchrone Prozedur-Ausführungen
+
+Die Warteschlange ist die Tabelle procedure_executions selbst: ein Auftrag ist
+eine Zeile mit status='queued'. Lokale Worker-Threads übernehmen Aufträge per
+bedingtem UPDATE (queued → running), dadurch können auch mehrere API-Prozesse
+auf dieselbe Datenbank (Postgres oder SQLite) zugreifen. Unter Postgres wird
+die Übernahme zusätzlich per Advisory-Lock serialisiert, damit das Limit
+gleichzeitiger Ausführungen pro Projekt auch prozessübergreifend gilt.
+
+Ein Wartungs-Thread aktualisiert den Heartbeat laufender Aufträge, übernimmt
+Abbruch-Anforderungen und markiert Aufträge verlorener Worker als Fehler.
+
+Eigener Worker-Prozess ohne API: python -m procedures.queue
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Procedure, ProcedureExecution
+from .executor import execute_procedure
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+FINISHED_STATUSES = ("success", "error", "cancelled")
+
+# Schlüssel für pg_advisory_xact_lock bei der Auftragsübernahme
+_CLAIM_LOCK_KEY = 0x70726F63
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_project_limits(value: str) -> Dict[int, int]:
+    """'1:4,7:1' → {1: 4, 7: 1}"""
+    limits = {}
+    for part in value.split(","):
+        if ":" in part:
+            project_id, limit = part.split(":", 1)
+            limits[int(project_id)] = int(limit)
+    return limits
+
+
+@dataclass
+class QueueConfig:
+    workers: int = 2
+    project_concurrency: int = 2  # 0 = kein Limit
+    project_limits: Dict[int, int] = field(default_factory=dict)
+    poll_interval: float = 1.0
+    heartbeat_interval: float = 5.0
+    stale_after: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> "QueueConfig":
+        return cls(
+            workers=int(os.getenv("PROCEDURE_QUEUE_WORKERS", "2")),
+            project_concurrency=int(os.getenv("PROCEDURE_QUEUE_PROJECT_CONCURRENCY", "2")),
+            project_limits=_parse_project_limits(os.getenv("PROCEDURE_QUEUE_PROJECT_LIMITS", "")),
+            poll_interval=float(os.getenv("PROCEDURE_QUEUE_POLL_INTERVAL", "1.0")),
+            heartbeat_interval=float(os.getenv("PROCEDURE_QUEUE_HEARTBEAT_INTERVAL", "5.0")),
+            stale_after=float(os.getenv("PROCEDURE_QUEUE_STALE_SECONDS", "300")),
+        )
+
+    def limit_for(self, project_id: Optional[int]) -> int:
+        return self.project_limits.get(project_id, self.project_concurrency)
+
+
+# --- Auftrags-Verwaltung (von der API genutzt) -------------------------------
+
+def enqueue_execution(
+    db: Session,
+    procedure: Procedure,
+    params: dict,
+    project_id: Optional[int] = None
+) -> ProcedureExecution:
+    """Legt einen Auftrag mit status='queued' an"""
+    execution = ProcedureExecution(
+        procedure_id=procedure.id,
+        project_id=project_id,
+        input_params=params,
+        status=STATUS_QUEUED,
+        progress=0.0,
+        cancel_requested=False
+    )
+    db.add(execution)
+    db.commit()
+    db.refresh(execution)
+
+    if _queue is not None:
+        _queue.wake()
+    return execution
+
+
+def enqueue_executions(
+    db: Session,
+    procedure: Procedure,
+    param_sets: List[dict],
+    project_id: Optional[int] = None
+) -> List[ProcedureExecution]:
+    """Legt mehrere Aufträge mit einem Commit an (Batch-Ausführung)"""
+    executions = [
+        ProcedureExecution(
+            procedure_id=procedure.id,
+            project_id=project_id,
+            input_params=params,
+            status=STATUS_QUEUED,
+            progress=0.0,
+            cancel_requested=False
+        )
+        for params in param_sets
+    ]
+    db.add_all(executions)
+    db.commit()
+    db.query(ProcedureExecution).filter(
+        ProcedureExecution.id.in_([execution.id for execution in executions])
+    ).all()
+
+    if _queue is not None:
+        _queue.wake()
+    return executions
+
+
+def request_cancel(db: Session, execution: ProcedureExecution) -> ProcedureExecution:
+    """
+    Bricht einen Auftrag ab
+    Wartende Aufträge werden sofort beendet, laufende beim nächsten Prüfpunkt.
+    """
+    cancelled = db.query(ProcedureExecution).filter(
+        ProcedureExecution.id == execution.id,
+        ProcedureExecution.status == STATUS_QUEUED
+    ).update({
+        "status": "cancelled",
+        "error_message": "Ausführung abgebrochen",
+        "finished_at": _now()
+    }, synchronize_session=False)
+
+    if not cancelled and execution.status == STATUS_RUNNING:
+        execution.cancel_requested = True
+
+    db.commit()
+    db.refresh(execution)
+
+    if _queue is not None and execution.status == STATUS_RUNNING:
+        _queue.mark_cancelled(execution.id)
+    return execution
+
+
+def queue_stats(db: Session) -> dict:
+    """Warteschlangen-Tiefe und laufende Aufträge, gesamt und pro Projekt"""
+    counts = db.query(
+        ProcedureExecution.project_id,
+        ProcedureExecution.status,
+        func.count(ProcedureExecution.id)
+    ).filter(
+        ProcedureExecution.status.in_([STATUS_QUEUED, STATUS_RUNNING])
+    ).group_by(ProcedureExecution.project_id, ProcedureExecution.status).all()
+
+    config = _queue.config if _queue is not None else QueueConfig.from_env()
+    projects: Dict[Optional[int], dict] = {}
+    for project_id, status, count in counts:
+        entry = projects.setdefault(project_id, {
+            "project_id": project_id,
+            "queued": 0,
+            "running": 0,
+            "limit": config.limit_for(project_id)
+        })
+        entry[status] = count
+
+    return {
+        "queued": sum(p["queued"] for p in projects.values()),
+        "running": sum(p["running"] for p in projects.values()),
+        "workers": config.workers if _queue is not None else 0,
+        "project_concurrency": config.project_concurrency,
+        "projects": list(projects.values())
+    }
+
+
+# --- Worker -----------------------------------------------------------------
+
+class ExecutionQueue:
+    """Lokaler Pool von Worker-Threads, der Aufträge aus der Datenbank abarbeitet"""
+
+    def __init__(
+        self,
+        config: Optional[QueueConfig] = None,
+        session_factory: Callable[[], Session] = SessionLocal
+    ):
+        self.config = config or QueueConfig.from_env()
+        self.session_factory = session_factory
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._claim_lock = threading.Lock()
+        self._running: Set[int] = set()
+        self._cancelled: Set[int] = set()
+        self._state_lock = threading.Lock()
+
+    def start(self) -> "ExecutionQueue":
+        self._recover_stale()
+        for i in range(self.config.workers):
+            thread = threading.Thread(target=self._work, name=f"procedure-queue-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        maintenance = threading.Thread(target=self._maintain, name="procedure-queue-heartbeat", daemon=True)
+        maintenance.start()
+        self._threads.append(maintenance)
+        logger.info("Prozedur-Warteschlange gestartet (%s Worker, %s)", self.config.workers, self.worker_id)
+        return self
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def mark_cancelled(self, execution_id: int) -> None:
+        with self._state_lock:
+            if execution_id in self._running:
+                self._cancelled.add(execution_id)
+
+    def is_cancelled(self, execution_id: int) -> bool:
+        with self._state_lock:
+            return execution_id in self._cancelled
+
+    # Übernahme ---------------------------------------------------------------
+
+    def _claim(self, db: Session) -> Optional[int]:
+        """Übernimmt den ältesten Auftrag, dessen Projekt noch unter dem Limit liegt"""
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _CLAIM_LOCK_KEY})
+
+        running = dict(db.query(
+            ProcedureExecution.project_id,
+            func.count(ProcedureExecution.id)
+        ).filter(
+            ProcedureExecution.status == STATUS_RUNNING
+        ).group_by(ProcedureExecution.project_id).all())
+
+        candidates = db.query(ProcedureExecution.id, ProcedureExecution.project_id).filter(
+            ProcedureExecution.status == STATUS_QUEUED
+        ).order_by(ProcedureExecution.id).limit(100).all()
+
+        now = _now()
+        for execution_id, project_id in candidates:
+            limit = self.config.limit_for(project_id)
+            if limit and running.get(project_id, 0) >= limit:
+                continue
+            claimed = db.query(ProcedureExecution).filter(
+                ProcedureExecution.id == execution_id,
+                ProcedureExecution.status == STATUS_QUEUED
+            ).update({
+                "status": STATUS_RUNNING,
+                "worker_id": self.worker_id,
+                "started_at": now,
+                "heartbeat_at": now,
+                "progress": 0.0
+            }, synchronize_session=False)
+            if claimed:
+                db.commit()
+                return execution_id
+
+        db.rollback()
+        return None
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            execution_id = None
+            db = self.session_factory()
+            try:
+                with self._claim_lock:
+                    execution_id = self._claim(db)
+            except Exception:
+                logger.exception("Fehler beim Übernehmen eines Auftrags")
+                db.rollback()
+            finally:
+                db.close()
+
+            if execution_id is None:
+                self._wake.wait(self.config.poll_interval)
+                self._wake.clear()
+                continue
+
+            with self._state_lock:
+                self._running.add(execution_id)
+            try:
+                self._execute(execution_id)
+            finally:
+                with self._state_lock:
+                    self._running.discard(execution_id)
+                    self._cancelled.discard(execution_id)
+
+    # Ausführung --------------------------------------------------------------
+
+    def _report_progress(self, execution_id: int, fraction: float, stage: str) -> None:
+        """Fortschritt in eigener Session schreiben, damit Status-Abfragen ihn sofort sehen"""
+        db = self.session_factory()
+        try:
+            db.query(ProcedureExecution).filter(ProcedureExecution.id == execution_id).update({
+                "progress": fraction,
+                "progress_message": stage,
+                "heartbeat_at": _now()
+            }, synchronize_session=False)
+            db.commit()
+        except Exception:
+            logger.warning("Fortschritt für Ausführung %s nicht gespeichert", execution_id, exc_info=True)
+            db.rollback()
+        finally:
+            db.close()
+
+    def _execute(self, execution_id: int) -> None:
+        db = self.session_factory()
+        try:
+            execution = db.get(ProcedureExecution, execution_id)
+            execute_procedure(
+                procedure=execution.procedure,
+                params=execution.input_params,
+                db=db,
+                project_id=execution.project_id,
+                execution=execution,
+                on_progress=lambda fraction, stage: self._report_progress(execution_id, fraction, stage),
+                should_cancel=lambda: self.is_cancelled(execution_id)
+            )
+        except Exception as e:
+            logger.exception("Ausführung %s fehlgeschlagen", execution_id)
+            db.rollback()
+            db.query(ProcedureExecution).filter(ProcedureExecution.id == execution_id).update({
+                "status": "error",
+                "error_message": str(e),
+                "finished_at": _now()
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    # Wartung -----------------------------------------------------------------
+
+    def _heartbeat(self, db: Session) -> None:
+        with self._state_lock:
+            running = list(self._running)
+        if not running:
+            return
+
+        db.query(ProcedureExecution).filter(
+            ProcedureExecution.id.in_(running),
+            ProcedureExecution.status == STATUS_RUNNING
+        ).update({"heartbeat_at": _now()}, synchronize_session=False)
+        db.commit()
+
+        # Abbruch-Anforderungen aus anderen Prozessen übernehmen
+        requested = db.query(ProcedureExecution.id).filter(
+            ProcedureExecution.id.in_(running),
+            ProcedureExecution.cancel_requested == True
+        ).all()
+        for (execution_id,) in requested:
+            self.mark_cancelled(execution_id)
+
+    def _recover_stale(self) -> None:
+        """Aufträge ohne Heartbeat (Worker abgestürzt) als Fehler markieren"""
+        db = self.session_factory()
+        try:
+            cutoff = _now() - timedelta(seconds=self.config.stale_after)
+            stale = db.query(ProcedureExecution).filter(
+                ProcedureExecution.status == STATUS_RUNNING,
+                ProcedureExecution.heartbeat_at != None,
+                ProcedureExecution.heartbeat_at < cutoff
+            ).update({
+                "status": "error",
+                "error_message": "Worker nicht mehr erreichbar",
+                "finished_at": _now()
+            }, synchronize_session=False)
+            db.commit()
+            if stale:
+                logger.warning("%s verwaiste Ausführung(en) als Fehler markiert", stale)
+        except Exception:
+            logger.exception("Fehler beim Bereinigen verwaister Ausführungen")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _maintain(self) -> None:
+        while not self._stop.wait(self.config.heartbeat_interval):
+            db = self.session_factory()
+            try:
+                self._heartbeat(db)
+            except Exception:
+                logger.warning("Heartbeat fehlgeschlagen", exc_info=True)
+                db.rollback()
+            finally:
+                db.close()
+            self._recover_stale()
+
+
+_queue: Optional[ExecutionQueue] = None
+_queue_lock = threading.Lock()
+
+
+def start_execution_queue(config: Optional[QueueConfig] = None) -> Optional[ExecutionQueue]:
+    """Startet die Worker dieses Prozesses (keine bei PROCEDURE_QUEUE_WORKERS=0)"""
+    global _queue
+    config = config or QueueConfig.from_env()
+    with _queue_lock:
+        if _queue is None and config.workers > 0:
+            _queue = ExecutionQueue(config).start()
+        return _queue
+
+
+def stop_execution_queue() -> None:
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.stop()
+            _queue = None
+
+
+def main():
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    queue = start_execution_queue()
+    if queue is None:
+        print("PROCEDURE_QUEUE_WORKERS ist 0, keine Worker gestartet")
+        return
+    try:
+        while True:
+            threading.Event().wait(3600)
+    except KeyboardInterrupt:
+        stop_execution_queue()
+
+
+if __name__ == "__main__":
+    main()
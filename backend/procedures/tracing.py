@@ -0,0 +1,106 @@
+"""
+Strukturiertes Tracing für Konvertierung und Prozedur-Ausführung
+
+Standardmäßig aus. Aktivierung pro Request (trace=true) oder global über
+die Umgebungsvariable PROCEDURE_TRACE=1. Ein Trace sammelt pro Stufe die
+Dauer, Zeilen-/Spaltenanzahl und optional eine Vorschau der ersten Zeilen
+(PROCEDURE_TRACE_PREVIEW_ROWS) und wird als eine JSON-Zeile geloggt.
+"""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger("procedures.trace")
+
+
+def _env_enabled() -> bool:
+    return os.getenv("PROCEDURE_TRACE", "").lower() in ("1", "true", "yes")
+
+
+def _env_preview_rows() -> int:
+    return int(os.getenv("PROCEDURE_TRACE_PREVIEW_ROWS", "0"))
+
+
+class Trace:
+    """Sammelt Stufen einer Ausführung"""
+
+    def __init__(self, name: str, preview_rows: int = 0):
+        self.name = name
+        self.preview_rows = preview_rows
+        self.stages: List[Dict[str, Any]] = []
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        entry = {"stage": name, **info}
+        started = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self.stages.append(entry)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "total_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "stages": self.stages
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("procedure_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def tracing(name: str, enabled: Optional[bool] = None, preview_rows: Optional[int] = None):
+    """
+    Startet einen Trace für den umschlossenen Block (yield: Trace oder None)
+    enabled=None übernimmt die Einstellung aus PROCEDURE_TRACE.
+    """
+    if enabled is None:
+        enabled = _env_enabled()
+    if not enabled:
+        yield None
+        return
+
+    trace = Trace(name, _env_preview_rows() if preview_rows is None else preview_rows)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        logger.info(json.dumps(trace.to_dict(), default=str))
+
+
+@contextmanager
+def trace_stage(name: str, **info):
+    """Misst eine Stufe im aktuellen Trace; ohne aktiven Trace ein No-Op (yield: None)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    with trace.stage(name, **info) as entry:
+        yield entry
+
+
+def record_frame(entry: Optional[dict], df: pd.DataFrame) -> None:
+    """Ergänzt eine Stufe um Zeilen-/Spaltenanzahl und optional eine Vorschau"""
+    if entry is None:
+        return
+    entry["rows"] = len(df)
+    entry["columns"] = len(df.columns)
+    trace = _current_trace.get()
+    if trace is not None and trace.preview_rows > 0:
+        entry["dtypes"] = {str(col): str(dtype) for col, dtype in df.dtypes.items()}
+        # Über to_json, damit NaN/NaT und numpy-Werte JSON-kompatibel im Trace landen
+        entry["preview"] = json.loads(df.head(trace.preview_rows).to_json(orient="records", date_format="iso"))
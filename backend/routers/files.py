@@ -1,27 +1,136 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends
-from fastapi.responses import Response
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
-from database import get_db
-from models import ExcelFile as ExcelFileModel
-from schemas import ExcelFile, ExcelFileCreate
+from database import get_db, get_async_db
+from models import ExcelFile as ExcelFileModel, ExcelImport as ExcelImportModel, FileUpload as FileUploadModel
+from schemas import (
+    ExcelFile, ExcelFileCreate, ExcelSheet, ExcelImportRequest, ExcelImportJob,
+    FileUploadCreate, FileUploadStatus
+)
+from imports import list_sheets, create_import, run_import, submit_import, ExcelImportError
+from storage import (
+    get_blob_store, BlobManifest, BlobNotFoundError,
+    create_upload, put_part, complete_upload, finish_upload, abort_upload,
+    expire_uploads, open_upload_chunks, UploadError
+)
 
 router = APIRouter(prefix="/files", tags=["files"])
 
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Range-Header 'bytes=start-end' → (start, end exklusiv)
+    Mehrere Bereiche werden nicht unterstützt (dann ganze Datei, wie von RFC 7233 erlaubt).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            # Suffix: die letzten N Bytes
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError
+            return max(size - length, 0), size
+        start = int(start_text)
+        end = int(end_text) + 1 if end_text else size
+    except ValueError:
+        return None
+    if start >= size or end <= start:
+        raise HTTPException(
+            status_code=416,
+            detail="Ungültiger Bereich",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size)
+
+
+def _split_name(name: str) -> Tuple[str, str]:
+    """Dateiname → (Basis-Name, Endung); nur Excel-Dateien erlaubt"""
+    if not name.endswith(('.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="Nur Excel-Dateien (.xlsx, .xls) erlaubt")
+    return name.rsplit('.', 1)[0], name.rsplit('.', 1)[1]
+
+def _max_version(base_name: str):
+    # Höchste vorhandene Version (MAX in SQL statt alle Versionen zu laden)
+    return select(func.max(ExcelFileModel.version)).where(ExcelFileModel.base_name == base_name)
+
+def _file_record(
+    base_name: str,
+    extension: str,
+    project_id: Optional[int],
+    manifest: BlobManifest,
+    max_version: Optional[int]
+) -> ExcelFileModel:
+    """Nächste Version einer Datei (Inhalt liegt bereits im Blob-Speicher)"""
+    
+    next_version = (max_version or 0) + 1
+    
+    # Generiere Dateinamen: timestamp_basename.xlsx
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    safe_filename = f"{timestamp}_{base_name}.{extension}"
+    
+    # In der Datenbank nur Metadaten und Hash
+    db_file = ExcelFileModel(
+        project_id=project_id,
+        base_name=base_name,
+        display_name=f"{base_name}.{extension}",
+        filename=safe_filename,
+        content_hash=manifest.hash,
+        file_size=manifest.size,
+        version=next_version,
+        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+    return db_file
+
+def _create_file(
+    db: Session,
+    base_name: str,
+    extension: str,
+    project_id: Optional[int],
+    manifest: BlobManifest
+) -> ExcelFileModel:
+    """Legt die nächste Version einer Datei an (synchrone Session)"""
+    db_file = _file_record(base_name, extension, project_id, manifest, db.scalar(_max_version(base_name)))
+    db.add(db_file)
+    return db_file
+
+async def _create_file_async(
+    db: AsyncSession,
+    base_name: str,
+    extension: str,
+    project_id: Optional[int],
+    manifest: BlobManifest
+) -> ExcelFileModel:
+    """Wie _create_file, für AsyncSession"""
+    max_version = await db.scalar(_max_version(base_name))
+    db_file = _file_record(base_name, extension, project_id, manifest, max_version)
+    db.add(db_file)
+    return db_file
+
+async def _get_file(db: AsyncSession, *criteria) -> ExcelFileModel:
+    db_file = (await db.scalars(select(ExcelFileModel).where(*criteria))).first()
+    if not db_file:
+        raise HTTPException(status_code=404, detail="Datei nicht gefunden")
+    return db_file
+
 @router.post("/upload", response_model=ExcelFile)
 async def upload_excel(
     file: UploadFile = File(...),
     original_name: Optional[str] = Form(None),
     project_id: Optional[int] = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Excel-Datei hochladen und in DB speichern (BLOB-Speicherung für Cloud-Kompatibilität)"""
+    """Excel-Datei hochladen (Inhalt in den Blob-Speicher, Metadaten in die DB)"""
     
     # Validiere Dateiendung
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Nur Excel-Dateien (.xlsx, .xls) erlaubt")
+    _split_name(file.filename)
     
     # Verwende original_name falls vorhanden, sonst file.filename
     base_name = original_name if original_name else file.filename
@@ -30,133 +139,312 @@ async def upload_excel(
     base_name_without_ext = base_name.rsplit('.', 1)[0] if '.' in base_name else base_name
     extension = base_name.rsplit('.', 1)[1] if '.' in base_name else 'xlsx'
     
-    # Prüfe ob bereits Versionen existieren
-    existing_files = db.query(ExcelFileModel).filter(
-        ExcelFileModel.base_name == base_name_without_ext
-    ).order_by(ExcelFileModel.version.desc()).all()
-    
-    next_version = existing_files[0].version + 1 if existing_files else 1
+    try:
+        # Der Upload liegt bereits als temporäre Datei vor (SpooledTemporaryFile);
+        # er wird chunkweise gehasht und gespeichert, nie als Ganzes im Speicher
+        manifest = await run_in_threadpool(get_blob_store().put, file.file)
+        
+        db_file = await _create_file_async(db, base_name_without_ext, extension, project_id, manifest)
+        await db.commit()
+        await db.refresh(db_file)
+        
+        return db_file
+        
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Fehler beim Speichern: {str(e)}")
+
+def _upload_status(upload: FileUploadModel) -> FileUploadStatus:
+    return FileUploadStatus(
+        id=upload.id,
+        original_name=upload.original_name,
+        project_id=upload.project_id,
+        total_size=upload.total_size,
+        status=upload.status,
+        file_id=upload.file_id,
+        chunk_size=get_blob_store().chunk_size,
+        received_bytes=sum(part.size for part in upload.parts),
+        parts=upload.parts
+    )
+
+def _get_upload(db: Session, upload_id: str) -> FileUploadModel:
+    upload = db.query(FileUploadModel).filter(FileUploadModel.id == upload_id).first()
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload nicht gefunden")
+    return upload
+
+@router.post("/uploads", response_model=FileUploadStatus)
+def start_upload(request: FileUploadCreate, db: Session = Depends(get_db)):
+    """
+    Mehrteiligen Upload beginnen (für große Dateien, fortsetzbar)
+    Danach Teile per PUT /uploads/{id}/parts/{n} senden (Rohdaten, je höchstens chunk_size
+    Bytes) und mit POST /uploads/{id}/complete abschließen.
+    """
+    _split_name(request.original_name)
+    upload = create_upload(db, request.original_name, request.project_id, request.total_size)
+    return _upload_status(upload)
+
+@router.get("/uploads/{upload_id}", response_model=FileUploadStatus)
+def get_upload(upload_id: str, db: Session = Depends(get_db)):
+    """Status eines Uploads mit den bereits empfangenen Teilen (zum Fortsetzen)"""
+    return _upload_status(_get_upload(db, upload_id))
+
+@router.put("/uploads/{upload_id}/parts/{part_no}")
+async def upload_part(upload_id: str, part_no: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Teil eines Uploads senden (Request-Body = Rohdaten)
+    Optionaler Header X-Part-SHA256 wird gegen den Inhalt geprüft.
+    """
+    upload = await run_in_threadpool(_get_upload, db, upload_id)
+    limit = get_blob_store().chunk_size
     
-    # Generiere Dateinamen: timestamp_basename.xlsx
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_filename = f"{timestamp}_{base_name_without_ext}.{extension}"
+    # Body lesen, höchstens ein Chunk im Speicher
+    buffer = bytearray()
+    async for data in request.stream():
+        buffer.extend(data)
+        if len(buffer) > limit:
+            raise HTTPException(status_code=413, detail=f"Teil ist größer als {limit} Bytes")
     
     try:
-        # Lese Datei-Inhalt
-        file_content = await file.read()
-        file_size = len(file_content)
-        
-        # Speichere in Datenbank (BLOB)
-        db_file = ExcelFileModel(
-            project_id=project_id,
-            base_name=base_name_without_ext,
-            display_name=f"{base_name_without_ext}.{extension}",
-            filename=safe_filename,
-            file_data=file_content,
-            file_size=file_size,
-            version=next_version,
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        part = await run_in_threadpool(
+            put_part, db, upload, part_no, bytes(buffer), request.headers.get("x-part-sha256")
         )
-        
-        db.add(db_file)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"part_no": part.part_no, "size": part.size, "chunk_hash": part.chunk_hash}
+
+@router.post("/uploads/{upload_id}/complete", response_model=ExcelFile)
+def finish_multipart_upload(upload_id: str, db: Session = Depends(get_db)):
+    """Upload abschließen: Manifest aus den Teilen bilden und Datei-Version anlegen"""
+    upload = _get_upload(db, upload_id)
+    
+    # Erneuter Abschluss (z.B. nach Verbindungsabbruch) liefert dieselbe Datei
+    if upload.status == "completed":
+        db_file = db.query(ExcelFileModel).filter(ExcelFileModel.id == upload.file_id).first()
+        if not db_file:
+            raise HTTPException(status_code=404, detail="Datei nicht gefunden")
+        return db_file
+    
+    try:
+        manifest = complete_upload(db, upload)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BlobNotFoundError as e:
+        raise HTTPException(status_code=409, detail=f"Teil fehlt im Blob-Speicher: {e}")
+    
+    base_name, extension = _split_name(upload.original_name)
+    try:
+        db_file = _create_file(db, base_name, extension, upload.project_id, manifest)
+        db.flush()
+        finish_upload(db, upload, db_file.id)
         db.commit()
         db.refresh(db_file)
-        
         return db_file
-        
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Fehler beim Speichern: {str(e)}")
 
+@router.delete("/uploads/{upload_id}")
+def cancel_upload(upload_id: str, db: Session = Depends(get_db)):
+    """Offenen Upload verwerfen"""
+    upload = _get_upload(db, upload_id)
+    if upload.status == "completed":
+        raise HTTPException(status_code=409, detail="Upload ist bereits abgeschlossen")
+    abort_upload(db, upload)
+    return {"message": "Upload verworfen"}
+
 @router.get("/download/{filename}")
-async def download_excel(filename: str, db: Session = Depends(get_db)):
-    """Excel-Datei aus DB herunterladen"""
+async def download_excel(filename: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Excel-Datei aus dem Blob-Speicher streamen (unterstützt Range-Requests und ETag)"""
     
-    # Hole Datei aus DB
-    db_file = db.query(ExcelFileModel).filter(ExcelFileModel.filename == filename).first()
-    if not db_file:
-        raise HTTPException(status_code=404, detail="Datei nicht gefunden")
+    db_file = await _get_file(db, ExcelFileModel.filename == filename)
+    
+    # Verbindung vor dem Streamen zurückgeben (der Download kann lange dauern)
+    await db.close()
     
-    # Gebe Datei-Inhalt zurück
-    return Response(
-        content=db_file.file_data,
+    # Blob-I/O ist synchron: stat im Thread, die Chunks liest StreamingResponse
+    # aus dem synchronen Generator ebenfalls im Threadpool
+    store = get_blob_store()
+    try:
+        manifest = await run_in_threadpool(store.stat, db_file.content_hash)
+    except BlobNotFoundError:
+        raise HTTPException(status_code=404, detail="Dateiinhalt nicht im Blob-Speicher")
+    
+    # Inhaltsadressiert: der Hash ist ein starker ETag
+    etag = f'"{manifest.hash}"'
+    headers = {
+        "Content-Disposition": f'attachment; filename="{db_file.display_name}"',
+        "Accept-Ranges": "bytes",
+        "ETag": etag
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    byte_range = _parse_range(request.headers.get("range"), manifest.size)
+    if byte_range is None:
+        headers["Content-Length"] = str(manifest.size)
+        return StreamingResponse(
+            store.iter_range(manifest.hash),
+            media_type=db_file.content_type,
+            headers=headers
+        )
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{manifest.size}"
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(
+        store.iter_range(manifest.hash, start, end),
+        status_code=206,
         media_type=db_file.content_type,
-        headers={
-            "Content-Disposition": f'attachment; filename="{db_file.display_name}"'
-        }
+        headers=headers
     )
 
 @router.get("/list", response_model=List[ExcelFile])
 async def list_files(
     project_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Alle Excel-Dateien auflisten (gruppiert nach base_name, nur neueste Version)"""
     
-    query = db.query(ExcelFileModel)
+    # Neueste Version je base_name per Fensterfunktion, eine Abfrage in SQL
+    rank = func.row_number().over(
+        partition_by=ExcelFileModel.base_name,
+        order_by=(ExcelFileModel.version.desc(), ExcelFileModel.id.desc())
+    ).label("rank")
+    ranked = select(ExcelFileModel.id.label("id"), rank)
     
     if project_id:
-        query = query.filter(ExcelFileModel.project_id == project_id)
+        ranked = ranked.where(ExcelFileModel.project_id == project_id)
     
-    # Hole nur die neueste Version jeder Datei
-    all_files = query.all()
+    ranked = ranked.subquery()
+    latest = aliased(ExcelFileModel)
     
-    # Gruppiere nach base_name und nimm jeweils die neueste Version
-    latest_files = {}
-    for file in all_files:
-        if file.base_name not in latest_files or file.version > latest_files[file.base_name].version:
-            latest_files[file.base_name] = file
-    
-    return list(latest_files.values())
+    return (await db.scalars(
+        select(latest).join(ranked, latest.id == ranked.c.id).where(
+            ranked.c.rank == 1
+        ).order_by(latest.base_name)
+    )).all()
 
 @router.get("/versions/{base_name}", response_model=List[ExcelFile])
-async def get_file_versions(base_name: str, db: Session = Depends(get_db)):
+async def get_file_versions(base_name: str, db: AsyncSession = Depends(get_async_db)):
     """Alle Versionen einer Datei abrufen"""
     
-    versions = db.query(ExcelFileModel).filter(
-        ExcelFileModel.base_name == base_name
-    ).order_by(ExcelFileModel.version.desc()).all()
+    versions = (await db.scalars(
+        select(ExcelFileModel).where(
+            ExcelFileModel.base_name == base_name
+        ).order_by(ExcelFileModel.version.desc())
+    )).all()
     
     if not versions:
         raise HTTPException(status_code=404, detail="Keine Versionen gefunden")
     
     return versions
 
-@router.get("/{file_id}", response_model=ExcelFile)
-async def get_file(file_id: int, db: Session = Depends(get_db)):
-    """Einzelne Datei-Info abrufen"""
+@router.get("/imports/{import_id}", response_model=ExcelImportJob)
+async def get_import(import_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Status und Fortschritt eines Excel-Imports"""
+    
+    job = await db.get(ExcelImportModel, import_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import nicht gefunden")
+    
+    return job
+
+@router.get("/{file_id}/sheets", response_model=List[ExcelSheet])
+def get_file_sheets(file_id: int, db: Session = Depends(get_db)):
+    """Tabellenblätter einer Excel-Datei auflisten"""
     
     db_file = db.query(ExcelFileModel).filter(ExcelFileModel.id == file_id).first()
     if not db_file:
         raise HTTPException(status_code=404, detail="Datei nicht gefunden")
     
-    return db_file
+    try:
+        return list_sheets(db_file)
+    except ExcelImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@router.delete("/{file_id}")
-async def delete_file(file_id: int, db: Session = Depends(get_db)):
-    """Excel-Datei löschen (nur DB-Eintrag, da BLOB in DB)"""
+@router.post("/{file_id}/import", response_model=ExcelImportJob)
+def import_file(
+    file_id: int,
+    request: ExcelImportRequest,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    """
+    Tabellenblatt serverseitig als DataTable importieren (Streaming, spaltenbasiert)
+    mode='async' startet den Import im Hintergrund und antwortet mit 202;
+    der Fortschritt ist über GET /files/imports/{id} abrufbar.
+    """
+    
+    if request.mode not in ("sync", "async"):
+        raise HTTPException(status_code=400, detail="mode muss 'sync' oder 'async' sein")
+    if request.header_row < 1:
+        raise HTTPException(status_code=400, detail="header_row muss mindestens 1 sein")
     
     db_file = db.query(ExcelFileModel).filter(ExcelFileModel.id == file_id).first()
     if not db_file:
         raise HTTPException(status_code=404, detail="Datei nicht gefunden")
     
+    job = create_import(
+        db,
+        db_file,
+        sheet_name=request.sheet_name,
+        table_name=request.table_name,
+        header_row=request.header_row,
+        project_id=request.project_id
+    )
+    
+    if request.mode == "async":
+        submit_import(job)
+        response.status_code = 202
+        return job
+    
+    job = run_import(db, job)
+    if job.status == "error":
+        raise HTTPException(status_code=400, detail=job.error_message)
+    return job
+
+@router.get("/{file_id}", response_model=ExcelFile)
+async def get_file(file_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Einzelne Datei-Info abrufen"""
+    return await _get_file(db, ExcelFileModel.id == file_id)
+
+@router.delete("/{file_id}")
+async def delete_file(file_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Excel-Datei löschen (DB-Eintrag und Blob, sofern keine andere Version denselben Inhalt hat)"""
+    
+    db_file = await _get_file(db, ExcelFileModel.id == file_id)
+    
     try:
-        # Lösche DB-Eintrag (inkl. BLOB)
-        db.delete(db_file)
-        db.commit()
+        content_hash = db_file.content_hash
+        await db.delete(db_file)
+        await db.commit()
+        
+        # Chunks räumt /cleanup-orphaned auf (können mit anderen Dateien geteilt sein);
+        # ein gerade erst (auch parallel) geschriebenes Manifest bleibt bis dahin erhalten
+        still_used = await db.scalar(
+            select(ExcelFileModel.id).where(ExcelFileModel.content_hash == content_hash).limit(1)
+        )
+        if still_used is None:
+            await run_in_threadpool(get_blob_store().delete, content_hash)
         
         return {"message": "Datei gelöscht"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Fehler beim Löschen: {str(e)}")
 
 @router.post("/cleanup-orphaned")
-async def cleanup_orphaned_files(db: Session = Depends(get_db)):
+def cleanup_orphaned_files(db: Session = Depends(get_db)):
     """Bereinige verwaiste Dateien (optional, für Wartung)"""
     
-    # Hier könnten wir alte Versionen löschen, die älter als X Tage sind
-    # Oder Dateien ohne Projekt-Zuordnung
+    # Verfallene mehrteilige Uploads
+    uploads_expired = expire_uploads(db)
+    
+    # Blobs und Chunks, die von keiner Datei und keinem offenen Upload mehr referenziert werden
+    referenced = {content_hash for (content_hash,) in db.query(ExcelFileModel.content_hash).distinct()}
+    stats = get_blob_store().collect_garbage(referenced, keep_chunks=open_upload_chunks(db))
     
-    return {"message": "Bereinigung durchgeführt"}
+    return {"message": "Bereinigung durchgeführt", "uploads_expired": uploads_expired, **stats}
 
 
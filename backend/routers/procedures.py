@@ -1,15 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import desc, select
 from typing import List
 from datetime import datetime
+import json
+import time
 
-from database import get_db
+from database import get_db, get_async_db, SessionLocal
 from models import Procedure, ProcedureExecution
 import schemas
-from procedures import parse_function_signature, execute_procedure, extract_function_name, add_type_hints_to_code
+from procedures import parse_function_signature, execute_procedure, extract_function_name, add_type_hints_to_code, procedure_cache
 from procedures.parser import validate_function_structure
 from procedures.sandbox import validate_code
+from procedures.queue import enqueue_execution, enqueue_executions, request_cancel, queue_stats, FINISHED_STATUSES
+from procedures.batch import run_batch, run_sweep, expand_parameter_sets, ProcedureBatchError
+from procedures.executor import ProcedureExecutionError
 from procedure_examples import EXAMPLES
 
 router = APIRouter(prefix="/api/procedures", tags=["procedures"])
@@ -234,6 +241,9 @@ def activate_procedure_version(
     db.commit()
     db.refresh(procedure)
     
+    # Kompilierte Versionen neu laden lassen
+    procedure_cache.invalidate(name=name)
+    
     return procedure
 
 
@@ -273,9 +283,13 @@ def get_procedure_schema(name: str, db: Session = Depends(get_db)):
 def execute_procedure_endpoint(
     name: str,
     request: schemas.ProcedureExecuteRequest,
+    response: Response,
     db: Session = Depends(get_db)
 ):
-    """Führt eine Prozedur aus"""
+    """
+    Führt eine Prozedur aus
+    mode='async': Auftrag wird eingereiht, Antwort 202 mit status='queued'
+    """
     
     # Hole aktive Prozedur
     procedure = db.query(Procedure).filter(
@@ -286,13 +300,21 @@ def execute_procedure_endpoint(
     if not procedure:
         raise HTTPException(status_code=404, detail=f"Aktive Prozedur '{name}' nicht gefunden")
     
+    if request.mode not in ("sync", "async"):
+        raise HTTPException(status_code=400, detail=f"Unbekannter Modus '{request.mode}' (erlaubt: sync, async)")
+    
+    if request.mode == "async":
+        response.status_code = status.HTTP_202_ACCEPTED
+        return enqueue_execution(db, procedure, request.parameters, request.project_id)
+    
     # Führe aus
     try:
         execution = execute_procedure(
             procedure=procedure,
             params=request.parameters,
             db=db,
-            project_id=request.project_id
+            project_id=request.project_id,
+            trace=request.trace
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Fehler bei Ausführung: {str(e)}")
@@ -300,18 +322,223 @@ def execute_procedure_endpoint(
     return execution
 
 
+@router.post("/{name}/execute-batch", response_model=schemas.ProcedureBatchResult)
+def execute_procedure_batch(
+    name: str,
+    request: schemas.ProcedureBatchRequest,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    """
+    Führt eine Prozedur für viele Parameter-Sätze bzw. Tabellen aus
+    
+    Die Prozedur wird einmal kompiliert, die Sätze laufen parallel; Ergebnisse und
+    Ausführungen werden mit einem Commit gespeichert. Fehler einzelner Sätze stehen
+    in deren Ausführung, der Gesamtstatus ist dann 'partial' bzw. 'error'.
+    mode='async': alle Sätze werden eingereiht, Antwort 202 mit status='queued'
+    """
+    
+    procedure = db.query(Procedure).filter(
+        Procedure.name == name,
+        Procedure.is_active == True
+    ).first()
+    
+    if not procedure:
+        raise HTTPException(status_code=404, detail=f"Aktive Prozedur '{name}' nicht gefunden")
+    
+    if request.mode not in ("sync", "async"):
+        raise HTTPException(status_code=400, detail=f"Unbekannter Modus '{request.mode}' (erlaubt: sync, async)")
+    
+    try:
+        param_sets = expand_parameter_sets(
+            procedure,
+            parameter_sets=request.parameter_sets,
+            table_ids=request.table_ids,
+            parameters=request.parameters,
+            table_param=request.table_parameter
+        )
+    except ProcedureBatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Prozedur kann nicht kompiliert werden: {str(e)}")
+    
+    if request.mode == "async":
+        response.status_code = status.HTTP_202_ACCEPTED
+        executions = enqueue_executions(db, procedure, param_sets, request.project_id)
+        return schemas.ProcedureBatchResult(
+            procedure_id=procedure.id,
+            name=procedure.name,
+            version=procedure.version,
+            status="queued",
+            total=len(executions),
+            succeeded=0,
+            failed=0,
+            executions=executions
+        )
+    
+    batch = run_batch(
+        procedure,
+        param_sets,
+        db,
+        project_id=request.project_id,
+        max_parallelism=request.max_parallelism,
+        trace=request.trace
+    )
+    
+    return schemas.ProcedureBatchResult(
+        procedure_id=procedure.id,
+        name=procedure.name,
+        version=procedure.version,
+        status=batch.status,
+        total=len(batch.executions),
+        succeeded=batch.succeeded,
+        failed=batch.failed,
+        execution_time=batch.execution_time,
+        executions=batch.executions
+    )
+
+
+@router.post("/{name}/sweep", response_model=schemas.ProcedureSweepResult)
+def sweep_procedure(
+    name: str,
+    request: schemas.ProcedureSweepRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Wertet eine Prozedur für alle Kombinationen eines Parameter-Rasters aus
+    
+    Eingabe-Tabellen werden einmal geladen und von allen Punkten geteilt. Je Punkt
+    kommt eine Zusammenfassung (Zeilen, Spalten, Summen) zurück; DataTables werden
+    nur mit materialize=true gespeichert.
+    """
+    
+    procedure = db.query(Procedure).filter(
+        Procedure.name == name,
+        Procedure.is_active == True
+    ).first()
+    
+    if not procedure:
+        raise HTTPException(status_code=404, detail=f"Aktive Prozedur '{name}' nicht gefunden")
+    
+    try:
+        sweep = run_sweep(
+            procedure,
+            request.parameters,
+            request.grid,
+            db,
+            project_id=request.project_id,
+            materialize=request.materialize,
+            preview_rows=max(0, request.preview_rows),
+            max_parallelism=request.max_parallelism
+        )
+    except (ProcedureBatchError, ProcedureExecutionError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Fehler beim Sweep: {str(e)}")
+    
+    return schemas.ProcedureSweepResult(
+        procedure_id=procedure.id,
+        name=procedure.name,
+        version=procedure.version,
+        status=sweep.status,
+        total=len(sweep.points),
+        succeeded=sweep.succeeded,
+        failed=sweep.failed,
+        load_time=sweep.load_time,
+        execution_time=sweep.execution_time,
+        points=sweep.points
+    )
+
+
 @router.get("/executions/", response_model=List[schemas.ProcedureExecutionResult])
-def list_executions(
+async def list_executions(
     limit: int = 50,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Listet die letzten Prozedur-Ausführungen"""
     
-    executions = db.query(ProcedureExecution).order_by(
-        desc(ProcedureExecution.executed_at)
-    ).limit(limit).all()
+    executions = await db.scalars(
+        select(ProcedureExecution).order_by(
+            desc(ProcedureExecution.executed_at)
+        ).limit(limit)
+    )
     
-    return executions
+    return executions.all()
+
+
+@router.get("/executions/queue", response_model=schemas.ProcedureQueueStats)
+def get_execution_queue(db: Session = Depends(get_db)):
+    """Warteschlangen-Tiefe und laufende Ausführungen (gesamt und pro Projekt)"""
+    return queue_stats(db)
+
+
+def _get_execution(db: Session, execution_id: int) -> ProcedureExecution:
+    execution = db.query(ProcedureExecution).filter(ProcedureExecution.id == execution_id).first()
+    if not execution:
+        raise HTTPException(status_code=404, detail="Ausführung nicht gefunden")
+    return execution
+
+
+@router.get("/executions/{execution_id}", response_model=schemas.ProcedureExecutionResult)
+async def get_execution(execution_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Status und Fortschritt einer Ausführung (Polling)"""
+    execution = await db.get(ProcedureExecution, execution_id)
+    if not execution:
+        raise HTTPException(status_code=404, detail="Ausführung nicht gefunden")
+    return execution
+
+
+@router.get("/executions/{execution_id}/events")
+def stream_execution_events(execution_id: int, interval: float = 0.5, db: Session = Depends(get_db)):
+    """
+    Server-Sent Events mit Status und Fortschritt
+    Sendet bei jeder Änderung ein Event, endet mit dem Endstatus.
+    """
+    _get_execution(db, execution_id)
+    interval = min(max(interval, 0.1), 10.0)
+    
+    def events():
+        last = None
+        last_sent = time.monotonic()
+        while True:
+            # Eigene Session pro Abfrage, die Request-Session ist hier bereits geschlossen
+            event_db = SessionLocal()
+            try:
+                execution = event_db.query(ProcedureExecution).filter(
+                    ProcedureExecution.id == execution_id
+                ).first()
+                if execution is None:
+                    return
+                payload = schemas.ProcedureExecutionResult.model_validate(execution).model_dump(mode="json")
+            finally:
+                event_db.close()
+            
+            if payload != last:
+                yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+                last = payload
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent > 15:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            
+            if payload["status"] in FINISHED_STATUSES:
+                return
+            time.sleep(interval)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/executions/{execution_id}/cancel", response_model=schemas.ProcedureExecutionResult)
+def cancel_execution(execution_id: int, db: Session = Depends(get_db)):
+    """Bricht eine wartende oder laufende Ausführung ab"""
+    execution = _get_execution(db, execution_id)
+    if execution.status in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Ausführung ist bereits beendet ({execution.status})")
+    return request_cancel(db, execution)
 
 
 @router.delete("/{procedure_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -333,6 +560,8 @@ def delete_procedure(procedure_id: int, db: Session = Depends(get_db)):
     db.query(Procedure).filter(Procedure.name == procedure.name).delete()
     db.commit()
     
+    procedure_cache.invalidate(name=procedure.name)
+    
     return None
 
 
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+
+from database import pool_stats, async_pool_stats
+from schemas import DatabasePoolStats
+
+router = APIRouter(prefix="/system", tags=["system"])
+
+@router.get("/db-pool", response_model=DatabasePoolStats)
+def get_db_pool_stats():
+    """Zustand der Datenbank-Connection-Pools dieses Prozesses (pro uvicorn-Worker, sync und async)"""
+    return {**pool_stats(), "async_pool": async_pool_stats()}
@@ -1,101 +1,358 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from database import get_db
-from models import DataTable
-from schemas import DataTable as DataTableSchema, DataTableCreate, DataTableUpdate
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, defer
+from typing import List, Optional, Union
+from database import get_db, get_async_db, SessionLocal
+from models import DataTable, DataTableChunk
+from schemas import (
+    DataTable as DataTableSchema, DataTableSummary, DataTablePage,
+    DataTableCreate, DataTableUpdate, DataTableRowChanges, DataTableRowChangesResult
+)
+from storage import read_rows, write_rows, drop_columns, is_columnar, bump_version
+from storage.query import query_rows, parse_filter, resolve_column, RowQueryError
+from storage.changes import apply_row_changes, claim_version, RowChangeError, TableVersionConflict
+from imports import importing_table_ids
+from imports.bulk import (
+    BULK_FORMATS, FORMAT_ARROW, BulkFormatError, plan_export, export_table, import_table, format_from_name
+)
 
 router = APIRouter(prefix="/tables", tags=["tables"])
 
 
-@router.get("/", response_model=List[DataTableSchema])
-def get_all_tables(project_id: int = None, db: Session = Depends(get_db)):
-    """Alle Datentabellen abrufen, optional gefiltert nach Projekt"""
-    query = db.query(DataTable)
-    
-    if project_id:
-        query = query.filter(DataTable.project_id == project_id)
+def _to_schema(table: DataTable) -> DataTableSchema:
+    """Baut die API-Antwort, Zeilen kommen aus dem Speicher-Backend"""
+    return DataTableSchema(
+        id=table.id,
+        name=table.name,
+        project_id=table.project_id,
+        columns=table.columns,
+        data=read_rows(table),
+        row_count=table.row_count,
+        column_count=table.column_count,
+        version=table.version,
+        created_at=table.created_at,
+        updated_at=table.updated_at
+    )
+
+
+async def _with_rows(db: AsyncSession, table_ids: List[int], read):
+    """
+    Zeilen dekodieren läuft über db.run_sync auf der Verbindung der Request-Session,
+    damit ein Abruf nur eine Pool-Verbindung belegt (die synchronen Storage-Helfer
+    nutzen object_session/query)
+    """
+    def load(session: Session):
+        tables = session.query(DataTable).filter(DataTable.id.in_(table_ids)).all()
+        by_id = {table.id: table for table in tables}
+        return [read(by_id[table_id]) for table_id in table_ids if table_id in by_id]
     
-    tables = query.order_by(DataTable.updated_at.desc()).all()
-    return tables
+    return await db.run_sync(load)
 
 
-@router.get("/{table_id}", response_model=DataTableSchema)
-def get_table(table_id: int, db: Session = Depends(get_db)):
-    """Eine spezifische Datentabelle abrufen"""
-    table = db.query(DataTable).filter(DataTable.id == table_id).first()
+async def _list_tables(db: AsyncSession, statement, include_data: bool) -> list:
+    """
+    Tabellenliste; ohne Zeilen wird die data-Spalte gar nicht erst geladen
+    Tabellen eines laufenden Excel-Imports erscheinen erst nach dessen Abschluss
+    """
+    statement = statement.where(DataTable.id.not_in(importing_table_ids()))
+    statement = statement.order_by(DataTable.updated_at.desc())
+    if not include_data:
+        tables = (await db.scalars(statement.options(defer(DataTable.data)))).all()
+        return [DataTableSummary.model_validate(table) for table in tables]
+    table_ids = (await db.scalars(statement.with_only_columns(DataTable.id))).all()
+    return await _with_rows(db, list(table_ids), _to_schema)
+
+
+async def _get_table(db: AsyncSession, table_id: int) -> DataTable:
+    table = (await db.scalars(
+        select(DataTable).options(defer(DataTable.data)).where(DataTable.id == table_id)
+    )).first()
     if not table:
         raise HTTPException(status_code=404, detail="Tabelle nicht gefunden")
     return table
 
 
+@router.get("/", response_model=Union[List[DataTableSchema], List[DataTableSummary]])
+async def get_all_tables(project_id: int = None, include_data: bool = True, db: AsyncSession = Depends(get_async_db)):
+    """
+    Alle Datentabellen abrufen, optional gefiltert nach Projekt
+    include_data=false liefert nur Metadaten (ohne Zeilen)
+    """
+    statement = select(DataTable)
+    
+    if project_id:
+        statement = statement.where(DataTable.project_id == project_id)
+    
+    return await _list_tables(db, statement, include_data)
+
+
+@router.get("/{table_id}", response_model=DataTablePage)
+async def get_table(
+    table_id: int,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    after_id: Optional[int] = None,
+    columns: Optional[str] = None,
+    filter: List[str] = Query([]),
+    sort: Optional[str] = None,
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Eine spezifische Datentabelle abrufen
+    
+    - offset/limit: Paginierung, after_id: Keyset-Paginierung nach Zeilen-ID
+      (Start mit der ersten Seite, next_cursor als nächstes after_id übergeben)
+    - total_rows: Zeilen nach Filtern, auch mit after_id (nicht die verbleibenden)
+    - columns: Projektion, z.B. "1,3" oder "col_1,Name"
+    - filter: wiederholbar, Format "spalte:operator:wert" (eq, ne, gt, ge, lt, le, contains)
+    - sort/order: Sortierung nach einer Spalte
+    """
+    await _get_table(db, table_id)
+    
+    def read_page(table: DataTable):
+        column_ids = None
+        if columns:
+            column_ids = [resolve_column(table, ref.strip()) for ref in columns.split(",") if ref.strip()]
+        page = query_rows(
+            table,
+            offset=offset,
+            limit=limit,
+            column_ids=column_ids,
+            filters=[parse_filter(table, expression) for expression in filter],
+            sort_column=resolve_column(table, sort) if sort else None,
+            descending=order == "desc",
+            after_id=after_id
+        )
+        return table, page
+    
+    try:
+        pages = await _with_rows(db, [table_id], read_page)
+    except RowQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not pages:
+        raise HTTPException(status_code=404, detail="Tabelle nicht gefunden")
+    table, page = pages[0]
+    
+    return DataTablePage(
+        id=table.id,
+        name=table.name,
+        project_id=table.project_id,
+        columns=page.columns,
+        data=page.rows,
+        row_count=table.row_count,
+        column_count=table.column_count,
+        version=table.version,
+        created_at=table.created_at,
+        updated_at=table.updated_at,
+        total_rows=page.total_rows,
+        offset=offset,
+        limit=limit,
+        next_cursor=page.next_cursor
+    )
+
+
 @router.post("/", response_model=DataTableSchema)
 def create_table(table_data: DataTableCreate, db: Session = Depends(get_db)):
     """Neue Datentabelle erstellen"""
     
-    # Berechne Zeilen- und Spaltenanzahl
-    row_count = len(table_data.data)
-    column_count = len(table_data.columns)
-    
-    # Erstelle neue Tabelle
+    # Erstelle neue Tabelle (Zeilen werden spaltenweise gespeichert)
     new_table = DataTable(
         name=table_data.name,
         project_id=table_data.project_id,
-        columns=table_data.columns,
-        data=table_data.data,
-        row_count=row_count,
-        column_count=column_count
+        columns=table_data.columns
     )
+    write_rows(new_table, table_data.data, table_data.columns)
     
     db.add(new_table)
     db.commit()
     db.refresh(new_table)
     
-    return new_table
+    return _to_schema(new_table)
 
 
 @router.put("/{table_id}", response_model=DataTableSchema)
 def update_table(table_id: int, table_update: DataTableUpdate, db: Session = Depends(get_db)):
-    """Datentabelle aktualisieren"""
+    """
+    Datentabelle aktualisieren
+    
+    Mit version (optimistische Sperre wie PATCH /rows): stimmt sie nicht mehr mit
+    der aktuellen Version überein, 409 (Tabelle neu laden).
+    """
     
     table = db.query(DataTable).filter(DataTable.id == table_id).first()
     if not table:
         raise HTTPException(status_code=404, detail="Tabelle nicht gefunden")
     
+    changes_content = table_update.data is not None or table_update.columns is not None
+    claimed_version = None
+    if table_update.version is not None:
+        try:
+            if changes_content:
+                # Bedingtes UPDATE, sperrt die Tabelle bis zum Commit
+                claim_version(table, table_update.version)
+                claimed_version = table.version
+            elif table.version != table_update.version:
+                raise TableVersionConflict(table_update.version, table.version)
+        except TableVersionConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    
     # Aktualisiere Felder
     if table_update.name is not None:
         table.name = table_update.name
     
-    if table_update.columns is not None:
+    if table_update.data is not None:
+        # Schreibt alle Zeilen neu (migriert JSON-Tabellen automatisch)
+        columns = table_update.columns if table_update.columns is not None else table.columns
+        write_rows(table, table_update.data, columns)
+    
+    elif table_update.columns is not None:
+        if is_columnar(table):
+            new_ids = {col["id"] for col in table_update.columns}
+            drop_columns(table, [col["id"] for col in table.columns if col["id"] not in new_ids])
         table.columns = table_update.columns
         table.column_count = len(table_update.columns)
+        bump_version(table)
     
-    if table_update.data is not None:
-        table.data = table_update.data
-        table.row_count = len(table_update.data)
+    if claimed_version is not None:
+        # Die Version wurde beim Sperren bereits erhöht
+        table.version = claimed_version
     
     db.commit()
     db.refresh(table)
     
-    return table
+    return _to_schema(table)
 
 
-@router.delete("/{table_id}")
-def delete_table(table_id: int, db: Session = Depends(get_db)):
-    """Datentabelle löschen"""
+@router.patch("/{table_id}/rows", response_model=DataTableRowChangesResult)
+def change_rows(table_id: int, changes: DataTableRowChanges, db: Session = Depends(get_db)):
+    """
+    Zeilen einfügen, Zellen ändern und Zeilen löschen, ohne die Tabelle neu zu senden
     
-    table = db.query(DataTable).filter(DataTable.id == table_id).first()
+    Nur die betroffenen Chunks werden neu geschrieben. changes.version muss der
+    aktuellen Version der Tabelle entsprechen, sonst 409 (Tabelle neu laden).
+    """
+    table = db.query(DataTable).options(defer(DataTable.data)).filter(DataTable.id == table_id).first()
     if not table:
         raise HTTPException(status_code=404, detail="Tabelle nicht gefunden")
     
-    db.delete(table)
+    try:
+        result = apply_row_changes(
+            table,
+            changes.version,
+            inserts=changes.insert,
+            updates=[(row.id, row.values) for row in changes.update],
+            deletes=changes.delete
+        )
+    except TableVersionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RowChangeError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    
     db.commit()
+    db.refresh(table)
+    
+    return DataTableRowChangesResult(
+        id=table.id,
+        version=table.version,
+        row_count=table.row_count,
+        inserted_ids=result.inserted_ids,
+        updated=result.updated,
+        deleted=result.deleted,
+        updated_at=table.updated_at
+    )
+
+
+@router.get("/{table_id}/export")
+def export_table_file(
+    table_id: int,
+    format: str = Query(FORMAT_ARROW, description="arrow | parquet | csv"),
+    include_ids: bool = True,
+    delimiter: str = Query(",", min_length=1, max_length=1),
+    db: Session = Depends(get_db)
+):
+    """
+    Tabelle als Arrow IPC-Stream, Parquet oder CSV herunterladen
+    
+    Gestreamt wird Chunk für Chunk; Spaltentyp und Spalten-ID stehen in den
+    Field-Metadaten (Arrow/Parquet), ein Re-Import ergibt dieselben Spalten.
+    """
+    if format not in BULK_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unbekanntes Format '{format}'")
+    table = db.query(DataTable).options(defer(DataTable.data)).filter(DataTable.id == table_id).first()
+    if not table:
+        raise HTTPException(status_code=404, detail="Tabelle nicht gefunden")
+    
+    plan = plan_export(db, table, include_ids)
+    media_type, extension = BULK_FORMATS[format]
+    filename = table.name.replace('"', "'")
+    
+    def stream():
+        # Eigene Session: die Request-Session ist beim Streamen schon geschlossen
+        session = SessionLocal()
+        try:
+            yield from export_table(session, plan, format, delimiter)
+        finally:
+            session.close()
+    
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'}
+    )
+
+
+@router.post("/import", response_model=DataTableSummary)
+def import_table_file(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    name: Optional[str] = Form(None),
+    project_id: Optional[int] = Form(None),
+    delimiter: str = Form(","),
+    db: Session = Depends(get_db)
+):
+    """
+    Arrow-, Parquet- oder CSV-Datei als neue Datentabelle importieren
+    
+    Ohne format wird das Format aus der Dateiendung bestimmt. Spaltentypen kommen
+    aus den Field-Metadaten eines Exports, sonst aus dem Arrow-Typ bzw. der
+    Typ-Erkennung des Converters (CSV).
+    """
+    fmt = format or format_from_name(file.filename)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail="Format nicht erkannt (arrow, parquet oder csv angeben)")
+    table_name = name or (file.filename or "Import").rsplit(".", 1)[0]
+    
+    try:
+        table = import_table(db, file.file, fmt, table_name, project_id, delimiter)
+    except BulkFormatError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    db.commit()
+    db.refresh(table)
+    
+    return DataTableSummary.model_validate(table)
+
+
+@router.delete("/{table_id}")
+async def delete_table(table_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Datentabelle löschen"""
+    
+    table = await _get_table(db, table_id)
+    
+    # Chunks direkt per DELETE entfernen (die Cascade würde alle Payloads laden)
+    await db.execute(delete(DataTableChunk).where(DataTableChunk.table_id == table_id))
+    await db.delete(table)
+    await db.commit()
     
     return {"message": f"Tabelle '{table.name}' wurde gelöscht"}
 
 
-@router.get("/project/{project_id}", response_model=List[DataTableSchema])
-def get_tables_by_project(project_id: int, db: Session = Depends(get_db)):
+@router.get("/project/{project_id}", response_model=Union[List[DataTableSchema], List[DataTableSummary]])
+async def get_tables_by_project(project_id: int, include_data: bool = True, db: AsyncSession = Depends(get_async_db)):
     """Alle Datentabellen eines Projekts abrufen"""
-    tables = db.query(DataTable).filter(DataTable.project_id == project_id).order_by(DataTable.updated_at.desc()).all()
-    return tables
+    return await _list_tables(db, select(DataTable).where(DataTable.project_id == project_id), include_data)
@@ -1,13 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
-from database import get_db
-from models import Workflow, WorkflowExecution, WorkflowInstance
+from database import get_db, get_async_db
+from models import Workflow, WorkflowExecution, WorkflowInstance, WorkflowSchedule
 import schemas
 from schemas import (
     WorkflowCreate, WorkflowUpdate, Workflow as WorkflowSchema,
-    WorkflowExecuteRequest, WorkflowExecutionResult,
-    WorkflowInstanceCreate, WorkflowInstanceUpdate, WorkflowInstance as WorkflowInstanceSchema
+    WorkflowExecuteRequest, WorkflowExecutionResult, WorkflowRunRequest, WorkflowRunReport,
+    WorkflowInstanceCreate, WorkflowInstanceUpdate, WorkflowInstance as WorkflowInstanceSchema,
+    WorkflowScheduleCreate, WorkflowScheduleUpdate, WorkflowSchedule as WorkflowScheduleSchema
 )
 import time
 import json
@@ -85,6 +88,7 @@ def delete_workflow(workflow_id: int, db: Session = Depends(get_db)):
 def execute_workflow(workflow_id: int, request: WorkflowExecuteRequest, db: Session = Depends(get_db)):
     """Workflow ausführen"""
     from workflows.executor import WorkflowExecutor
+    from workflows.runner import record_execution, owned_execution
     
     workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
     if not workflow:
@@ -106,33 +110,103 @@ def execute_workflow(workflow_id: int, request: WorkflowExecuteRequest, db: Sess
     db.commit()
     db.refresh(execution)
     
+    executor = None
+    result = None
+    error = None
     try:
-        # Workflow ausführen
-        executor = WorkflowExecutor(db)
-        result = executor.execute(workflow.graph, request.input_params)
-        
-        execution.status = "completed"
-        execution.output_data = result["output"]
-        execution.execution_log = result["log"]
-        execution.execution_time = time.time() - start_time
-        
+        # Workflow ausführen (Heartbeat, damit der Lauf nicht als abgebrochen gilt)
+        with owned_execution(execution.id):
+            executor = WorkflowExecutor(
+                db,
+                max_parallelism=request.max_parallelism,
+                on_error=request.on_error,
+                project_id=execution.project_id,
+                use_cache=request.use_cache
+            )
+            result = executor.execute(workflow.graph, request.input_params)
     except Exception as e:
-        execution.status = "failed"
-        execution.error_message = str(e)
-        execution.execution_time = time.time() - start_time
+        error = e
     
+    record_execution(execution, executor, result, error, start_time)
     db.commit()
     db.refresh(execution)
     return execution
 
 
 @router.get("/{workflow_id}/executions", response_model=List[WorkflowExecutionResult])
-def get_workflow_executions(workflow_id: int, db: Session = Depends(get_db)):
+async def get_workflow_executions(workflow_id: int, db: AsyncSession = Depends(get_async_db)):
     """Alle Ausführungen eines Workflows abrufen"""
-    executions = db.query(WorkflowExecution).filter(
-        WorkflowExecution.workflow_id == workflow_id
-    ).order_by(WorkflowExecution.executed_at.desc()).all()
-    return executions
+    executions = await db.scalars(
+        select(WorkflowExecution).where(
+            WorkflowExecution.workflow_id == workflow_id
+        ).order_by(WorkflowExecution.executed_at.desc())
+    )
+    return executions.all()
+
+
+@router.get("/executions/{execution_id}", response_model=WorkflowExecutionResult)
+def get_workflow_execution(execution_id: int, db: Session = Depends(get_db)):
+    """Einzelne Ausführung abrufen (z.B. Fortschritt eines Zyklus-Laufs)"""
+    execution = db.query(WorkflowExecution).filter(WorkflowExecution.id == execution_id).first()
+    if not execution:
+        raise HTTPException(status_code=404, detail="Ausführung nicht gefunden")
+    return execution
+
+
+def _run_instances(db: Session, mode: str, instances: list, request: WorkflowRunRequest, response: Response):
+    from workflows import runner
+    
+    if request.mode not in ("sync", "async"):
+        raise HTTPException(status_code=400, detail=f"Unbekannter Modus: {request.mode}")
+    if request.on_error not in ("fail_fast", "continue"):
+        raise HTTPException(status_code=400, detail=f"Unbekannte Fehlerbehandlung: {request.on_error}")
+    
+    options = dict(
+        max_parallelism=request.max_parallelism,
+        node_parallelism=request.node_parallelism,
+        on_error=request.on_error,
+        use_cache=request.use_cache
+    )
+    try:
+        if request.mode == "async":
+            response.status_code = 202
+            return runner.submit_instances(db, mode, instances, **options)
+        return runner.run_instances(db, mode, instances, **options)
+    except runner.WorkflowRunError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/cycles/{cycle_id}/run", response_model=WorkflowRunReport)
+def run_cycle(cycle_id: int, request: WorkflowRunRequest, response: Response, db: Session = Depends(get_db)):
+    """Alle aktiven Workflow-Instanzen eines Zyklus ausführen"""
+    from workflows.runner import cycle_instances, WorkflowRunError, MODE_CYCLE
+    
+    try:
+        instances = cycle_instances(db, cycle_id)
+    except WorkflowRunError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return _run_instances(db, MODE_CYCLE, instances, request, response)
+
+
+@router.post("/{workflow_id}/backfill", response_model=WorkflowRunReport)
+def backfill_workflow(
+    workflow_id: int,
+    request: WorkflowRunRequest,
+    response: Response,
+    project_id: int = None,
+    db: Session = Depends(get_db)
+):
+    """Workflow über alle Zyklen seiner aktiven Instanzen ausführen (optional je Projekt)"""
+    from workflows.runner import backfill_instances, MODE_BACKFILL
+    
+    workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
+    if not workflow:
+        raise HTTPException(status_code=404, detail="Workflow nicht gefunden")
+    if not workflow.is_active:
+        raise HTTPException(status_code=400, detail="Workflow ist nicht aktiv")
+    
+    instances = backfill_instances(db, workflow_id, project_id)
+    return _run_instances(db, MODE_BACKFILL, instances, request, response)
 
 
 @router.get("/node-schema/{node_type}/{node_id}")
@@ -354,3 +428,84 @@ def get_cycle_workflow_instances(cycle_id: int, db: Session = Depends(get_db)):
         WorkflowInstance.cycle_id == cycle_id
     ).all()
     return instances
+
+
+# Workflow Schedule Endpoints
+@router.get("/schedules/", response_model=List[WorkflowScheduleSchema])
+def list_workflow_schedules(instance_id: int = None, workflow_id: int = None, db: Session = Depends(get_db)):
+    """Zeitpläne abrufen, optional gefiltert nach Instanz oder Workflow"""
+    query = db.query(WorkflowSchedule)
+    if instance_id:
+        query = query.filter(WorkflowSchedule.instance_id == instance_id)
+    if workflow_id:
+        query = query.join(WorkflowInstance, WorkflowInstance.id == WorkflowSchedule.instance_id).filter(
+            WorkflowInstance.workflow_id == workflow_id
+        )
+    return query.order_by(WorkflowSchedule.id).all()
+
+
+@router.post("/instances/{instance_id}/schedules", response_model=WorkflowScheduleSchema)
+def create_workflow_schedule(instance_id: int, schedule: WorkflowScheduleCreate, db: Session = Depends(get_db)):
+    """Zeitplan für eine Workflow-Instanz anlegen"""
+    from workflows.scheduler import CronError, compute_next_run, validate_schedule, wake_scheduler
+    
+    instance = db.query(WorkflowInstance).filter(WorkflowInstance.id == instance_id).first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="Workflow-Instanz nicht gefunden")
+    try:
+        validate_schedule(schedule.cron, schedule.timezone)
+    except CronError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    db_schedule = WorkflowSchedule(instance_id=instance_id, **schedule.dict())
+    db_schedule.next_run_at = compute_next_run(db_schedule) if db_schedule.is_active else None
+    db.add(db_schedule)
+    db.commit()
+    db.refresh(db_schedule)
+    wake_scheduler()
+    return db_schedule
+
+
+@router.put("/schedules/{schedule_id}", response_model=WorkflowScheduleSchema)
+def update_workflow_schedule(schedule_id: int, schedule: WorkflowScheduleUpdate, db: Session = Depends(get_db)):
+    """Zeitplan aktualisieren (der nächste Termin wird neu berechnet)"""
+    from workflows.scheduler import CronError, compute_next_run, validate_schedule, wake_scheduler
+    
+    db_schedule = db.query(WorkflowSchedule).filter(WorkflowSchedule.id == schedule_id).first()
+    if not db_schedule:
+        raise HTTPException(status_code=404, detail="Zeitplan nicht gefunden")
+    
+    update_data = schedule.dict(exclude_unset=True)
+    try:
+        validate_schedule(update_data.get("cron") or db_schedule.cron, update_data.get("timezone") or db_schedule.timezone)
+    except CronError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for key, value in update_data.items():
+        if value is not None or key == "jitter_seconds":
+            setattr(db_schedule, key, value)
+    
+    db_schedule.next_run_at = compute_next_run(db_schedule) if db_schedule.is_active else None
+    db.commit()
+    db.refresh(db_schedule)
+    wake_scheduler()
+    return db_schedule
+
+
+@router.delete("/schedules/{schedule_id}")
+def delete_workflow_schedule(schedule_id: int, db: Session = Depends(get_db)):
+    """Zeitplan löschen (laufende Ausführungen laufen weiter)"""
+    db_schedule = db.query(WorkflowSchedule).filter(WorkflowSchedule.id == schedule_id).first()
+    if not db_schedule:
+        raise HTTPException(status_code=404, detail="Zeitplan nicht gefunden")
+    
+    db.delete(db_schedule)
+    db.commit()
+    return {"message": "Zeitplan gelöscht"}
+
+
+@router.get("/scheduler/status")
+def get_scheduler_status():
+    """Status des Schedulers in diesem Prozess (Leader, laufende Zeitpläne)"""
+    from workflows.scheduler import scheduler_status
+    
+    return scheduler_status()
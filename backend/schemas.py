@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 
 class ProjectBase(BaseModel):
     name: str
@@ -59,6 +59,7 @@ class ExcelFile(ExcelFileBase):
     file_size: int
     version: int
     content_type: str
+    content_hash: Optional[str] = None  # SHA-256 des Inhalts (Blob-Speicher)
     created_at: datetime
     updated_at: Optional[datetime] = None
 
@@ -68,6 +69,62 @@ class ExcelFile(ExcelFileBase):
 class ExcelFileWithVersions(ExcelFile):
     versions: List['ExcelFile'] = []
 
+class FileUploadCreate(BaseModel):
+    original_name: str
+    project_id: Optional[int] = None
+    total_size: Optional[int] = None  # Wird beim Abschluss geprüft
+
+class FileUploadPart(BaseModel):
+    part_no: int
+    size: int
+    chunk_hash: str
+
+    class Config:
+        from_attributes = True
+
+class FileUploadStatus(BaseModel):
+    id: str
+    original_name: str
+    project_id: Optional[int] = None
+    total_size: Optional[int] = None
+    status: str  # open, completed
+    file_id: Optional[int] = None
+    chunk_size: int  # Maximale Größe eines Teils
+    received_bytes: int
+    parts: List[FileUploadPart] = []
+
+class ExcelSheet(BaseModel):
+    name: str
+    max_row: Optional[int] = None  # Laut Dimensionsangabe der Datei
+    max_column: Optional[int] = None
+
+class ExcelImportRequest(BaseModel):
+    sheet_name: Optional[str] = None  # None = erstes Blatt
+    table_name: Optional[str] = None  # Standard: "<Datei> - <Blatt>"
+    header_row: int = 1
+    project_id: Optional[int] = None  # Standard: Projekt der Datei
+    mode: str = "sync"  # 'sync' oder 'async' (Hintergrund-Job)
+
+class ExcelImportJob(BaseModel):
+    id: int
+    file_id: int
+    project_id: Optional[int] = None
+    table_id: Optional[int] = None
+    sheet_name: Optional[str] = None
+    table_name: Optional[str] = None
+    header_row: int
+    status: str
+    progress: Optional[float] = None
+    progress_message: Optional[str] = None
+    rows_imported: Optional[int] = None
+    error_message: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 
 
 # DataTable Schemas
@@ -83,19 +140,52 @@ class DataTableUpdate(BaseModel):
     name: Optional[str] = None
     columns: Optional[List[dict]] = None
     data: Optional[List[dict]] = None
+    # Version, auf der die Änderung beruht (optimistische Sperre, sonst 409)
+    version: Optional[int] = None
 
-class DataTable(DataTableBase):
+class DataTableSummary(DataTableBase):
+    """Tabellen-Metadaten ohne Zeilen (für Listen)"""
     id: int
     columns: List[dict]
-    data: List[dict]
     row_count: int
     column_count: int
+    version: Optional[int] = None  # Wird bei jeder Änderung erhöht
     created_at: datetime
     updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
+class DataTable(DataTableSummary):
+    data: List[dict]
+
+class DataTablePage(DataTable):
+    """Seite einer Tabelle (Paginierung, Projektion, Filter)"""
+    total_rows: int
+    offset: int = 0
+    limit: Optional[int] = None
+    next_cursor: Optional[int] = None
+
+class DataTableRowUpdate(BaseModel):
+    id: int
+    values: dict  # {"col_1": neuer Wert, ...}
+
+class DataTableRowChanges(BaseModel):
+    """Zeilenweise Änderungen (PATCH), version = Version, auf der die Änderungen beruhen"""
+    version: int
+    insert: List[dict] = []  # Zeilen {"col_1": ...}, optional mit "id"
+    update: List[DataTableRowUpdate] = []
+    delete: List[int] = []  # Zeilen-IDs
+
+class DataTableRowChangesResult(BaseModel):
+    id: int
+    version: int
+    row_count: int
+    inserted_ids: List[int]
+    updated: int
+    deleted: int
+    updated_at: Optional[datetime] = None
+
 
 
 # Procedure Schemas
@@ -149,6 +239,8 @@ class ProcedureParametersPreview(BaseModel):
 class ProcedureExecuteRequest(BaseModel):
     parameters: dict  # {"tabelle": 5, "wert1": 10, "wert2": 2}
     project_id: Optional[int] = None
+    trace: Optional[bool] = None  # Tracing für diese Ausführung (None = PROCEDURE_TRACE)
+    mode: str = "sync"  # 'sync' oder 'async' (Warteschlange, Antwort mit status='queued')
 
 class ProcedureExecutionResult(BaseModel):
     id: int
@@ -158,10 +250,87 @@ class ProcedureExecutionResult(BaseModel):
     error_message: Optional[str]
     execution_time: Optional[float]
     executed_at: datetime
+    progress: Optional[float] = None
+    progress_message: Optional[str] = None
+    cancel_requested: Optional[bool] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    trace: Optional[dict] = None  # Nur bei aktivem Tracing
 
     class Config:
         from_attributes = True
 
+class ProcedureBatchRequest(BaseModel):
+    """Eine Prozedur für viele Parameter-Sätze bzw. Tabellen ausführen"""
+    parameter_sets: Optional[List[dict]] = None  # [{"tabelle": 5, "faktor": 2}, ...]
+    table_ids: Optional[List[int]] = None  # je Tabelle ein Satz
+    table_parameter: Optional[str] = None  # Ziel für table_ids (Standard: einziger Table-Parameter)
+    parameters: Optional[dict] = None  # gilt für alle Sätze
+    project_id: Optional[int] = None
+    max_parallelism: Optional[int] = None  # None = PROCEDURE_BATCH_PARALLELISM
+    trace: Optional[bool] = None
+    mode: str = "sync"  # 'sync' oder 'async' (alle Sätze in die Warteschlange)
+
+class ProcedureBatchResult(BaseModel):
+    procedure_id: int
+    name: str
+    version: int
+    status: str  # 'success', 'partial', 'error' bzw. 'queued'
+    total: int
+    succeeded: int
+    failed: int
+    execution_time: Optional[float] = None
+    executions: List[ProcedureExecutionResult]
+
+class ProcedureSweepRequest(BaseModel):
+    """Raster skalarer Parameter gegen dieselben Eingaben"""
+    parameters: dict = {}  # feste Parameter, z.B. {"tabelle": 5, "spalte": "Wert"}
+    grid: Dict[str, List[Any]]  # {"schwellwert": [100, 500, 1000]}
+    project_id: Optional[int] = None
+    materialize: bool = False  # je Punkt eine DataTable speichern
+    preview_rows: int = 0  # erste Zeilen des Ergebnisses je Punkt
+    max_parallelism: Optional[int] = None  # None = PROCEDURE_BATCH_PARALLELISM
+
+class ProcedureSweepPoint(BaseModel):
+    values: dict  # Rasterwerte
+    status: str
+    error: Optional[str] = None
+    rows: Optional[int] = None
+    columns: Optional[List[str]] = None
+    totals: Optional[Dict[str, Optional[float]]] = None  # Summen der numerischen Spalten
+    preview: Optional[List[dict]] = None
+    execution_time: float
+    output_table_id: Optional[int] = None  # nur mit materialize
+    execution_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class ProcedureSweepResult(BaseModel):
+    procedure_id: int
+    name: str
+    version: int
+    status: str  # 'success', 'partial' oder 'error'
+    total: int
+    succeeded: int
+    failed: int
+    load_time: float  # Laden und Konvertieren der Eingaben (einmalig)
+    execution_time: float
+    points: List[ProcedureSweepPoint]
+
+class ProcedureQueueProject(BaseModel):
+    project_id: Optional[int]
+    queued: int
+    running: int
+    limit: int  # 0 = kein Limit
+
+class ProcedureQueueStats(BaseModel):
+    queued: int
+    running: int
+    workers: int  # Worker-Threads in diesem Prozess
+    project_concurrency: int
+    projects: List[ProcedureQueueProject]
+
 
 # Workflow Schemas
 class WorkflowNode(BaseModel):
@@ -216,6 +385,9 @@ class WorkflowCopyRequest(BaseModel):
 class WorkflowExecuteRequest(BaseModel):
     input_params: dict  # Initiale Parameter für den Workflow
     project_id: Optional[int] = None
+    max_parallelism: Optional[int] = None  # None = WORKFLOW_MAX_PARALLELISM
+    on_error: str = "fail_fast"  # 'fail_fast' oder 'continue'
+    use_cache: bool = True  # Ergebnisse unveränderter Prozedur-Nodes wiederverwenden
 
 class WorkflowExecutionResult(BaseModel):
     id: int
@@ -224,12 +396,51 @@ class WorkflowExecutionResult(BaseModel):
     output_data: Optional[dict]
     error_message: Optional[str]
     execution_time: Optional[float]
-    execution_log: Optional[dict]
+    execution_log: Optional[list]
     executed_at: datetime
 
     class Config:
         from_attributes = True
 
+class WorkflowRunRequest(BaseModel):
+    """Zyklus-Lauf bzw. Backfill über mehrere Workflow-Instanzen"""
+    max_parallelism: Optional[int] = None  # Instanzen gleichzeitig, None = WORKFLOW_RUNNER_PARALLELISM
+    node_parallelism: int = 1  # Nodes gleichzeitig je Instanz
+    on_error: str = "fail_fast"  # gilt je Instanz; andere Instanzen laufen immer weiter
+    use_cache: bool = True
+    mode: str = "sync"  # 'sync' oder 'async' (Hintergrund, Fortschritt über die Ausführungen)
+
+class WorkflowInstanceRun(BaseModel):
+    instance_id: int
+    workflow_id: int
+    workflow_name: str
+    cycle_id: int
+    cycle_name: Optional[str]
+    status: str
+    execution_id: Optional[int]
+    error_message: Optional[str]
+    execution_time: Optional[float]
+    output_tables: List[int]
+
+    class Config:
+        from_attributes = True
+
+class WorkflowRunReport(BaseModel):
+    mode: str  # 'cycle' oder 'backfill'
+    status: str  # 'completed', 'completed_with_errors', 'failed' bzw. 'running'
+    total: int
+    succeeded: int
+    failed: int
+    execution_time: Optional[float]
+    shared_tables: int
+    table_loads: int
+    table_reuses: int
+    plans: int
+    runs: List[WorkflowInstanceRun]
+
+    class Config:
+        from_attributes = True
+
 
 # Workflow Instance Schemas
 class WorkflowInstanceBase(BaseModel):
@@ -256,6 +467,37 @@ class WorkflowInstance(WorkflowInstanceBase):
         from_attributes = True
 
 
+# Workflow Schedule Schemas
+class WorkflowScheduleCreate(BaseModel):
+    cron: str  # z.B. "0 2 * * *" (täglich 02:00) oder "@daily"
+    timezone: str = "UTC"
+    jitter_seconds: Optional[int] = None  # None = SCHEDULER_JITTER_SECONDS
+    is_active: bool = True
+
+class WorkflowScheduleUpdate(BaseModel):
+    cron: Optional[str] = None
+    timezone: Optional[str] = None
+    jitter_seconds: Optional[int] = None
+    is_active: Optional[bool] = None
+
+class WorkflowSchedule(BaseModel):
+    id: int
+    instance_id: int
+    cron: str
+    timezone: str
+    jitter_seconds: Optional[int]
+    is_active: bool
+    next_run_at: Optional[datetime]
+    last_run_at: Optional[datetime]
+    last_execution_id: Optional[int]
+    last_status: Optional[str]
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 # Global Value Schemas
 class GlobalValueBase(BaseModel):
     key: str
@@ -280,3 +522,22 @@ class GlobalValue(GlobalValueBase):
 
     class Config:
         from_attributes = True
+
+
+# System Schemas
+class DatabasePoolStats(BaseModel):
+    pool_class: str
+    size: Optional[int] = None
+    max_overflow: Optional[int] = None
+    timeout: Optional[float] = None
+    recycle: Optional[int] = None
+    pre_ping: Optional[bool] = None
+    checked_out: Optional[int] = None
+    checked_in: Optional[int] = None
+    overflow: Optional[int] = None
+    checkouts: int
+    timeouts: int
+    wait_seconds_total: float
+    wait_seconds_avg: float
+    wait_seconds_max: float
+    async_pool: Optional['DatabasePoolStats'] = None  # Pool der AsyncSessions
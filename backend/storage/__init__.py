@@ -0,0 +1,36 @@
+from .columnar import (
+    read_rows, read_dataframe, write_rows, write_columns, drop_columns, migrate_table, is_columnar,
+    bump_version,
+    STORAGE_JSON, STORAGE_COLUMNAR
+)
+from .blobs import BlobStore, BlobManifest, BlobNotFoundError, get_blob_store, register_blob_store
+from .uploads import (
+    create_upload, put_part, complete_upload, finish_upload, abort_upload,
+    expire_uploads, open_upload_chunks, UploadError
+)
+
+__all__ = [
+    'read_rows',
+    'read_dataframe',
+    'write_rows',
+    'write_columns',
+    'drop_columns',
+    'migrate_table',
+    'is_columnar',
+    'bump_version',
+    'STORAGE_JSON',
+    'STORAGE_COLUMNAR',
+    'BlobStore',
+    'BlobManifest',
+    'BlobNotFoundError',
+    'get_blob_store',
+    'register_blob_store',
+    'create_upload',
+    'put_part',
+    'complete_upload',
+    'finish_upload',
+    'abort_upload',
+    'expire_uploads',
+    'open_upload_chunks',
+    'UploadError'
+]
@@ -0,0 +1,418 @@
+"""
+Inhaltsadressierter Blob-Speicher für Dateien (Excel-Uploads)
+
+Dateien werden in Chunks zu BLOB_CHUNK_SIZE Bytes zerlegt. Jeder Chunk liegt
+unter seinem SHA-256, ein Manifest unter dem SHA-256 der ganzen Datei listet
+die Chunks in Reihenfolge. Identische Dateien (z.B. unveränderte Versionen)
+und identische Chunks werden nur einmal gespeichert. In der Datenbank steht
+nur noch der Hash (ExcelFile.content_hash).
+
+Backends werden über register_blob_store registriert und per
+BLOB_STORE_BACKEND gewählt (Standard: 'local', Verzeichnis BLOB_STORE_DIR).
+
+Löschen entfernt nur das Manifest; nicht mehr referenzierte Chunks räumt
+collect_garbage auf. Jedes Speichern markiert Chunks und Manifest als genutzt
+(auch wenn sie schon vorhanden sind). Chunks und Manifeste, die jünger als
+BLOB_GC_GRACE_SECONDS sind, bleiben beim Löschen und in collect_garbage
+erhalten, damit parallele Uploads (deren Datei noch nicht in der Datenbank
+steht) nichts verlieren.
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+BLOB_CHUNK_SIZE = int(os.getenv("BLOB_CHUNK_SIZE", str(4 * 1024 * 1024)))
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+
+
+class BlobNotFoundError(KeyError):
+    """Kein Blob mit diesem Hash vorhanden"""
+    pass
+
+
+@dataclass(frozen=True)
+class BlobManifest:
+    hash: str  # SHA-256 der gesamten Datei
+    size: int
+    chunks: List[Tuple[str, int]]  # (SHA-256, Größe) je Chunk in Reihenfolge
+
+    def to_json(self) -> str:
+        return json.dumps({"hash": self.hash, "size": self.size, "chunks": [list(c) for c in self.chunks]})
+
+    @classmethod
+    def from_json(cls, payload: str) -> "BlobManifest":
+        data = json.loads(payload)
+        return cls(hash=data["hash"], size=data["size"], chunks=[tuple(c) for c in data["chunks"]])
+
+
+class BlobStore(ABC):
+    """
+    Basisklasse: Chunking, Hashing, Range-Reads und Garbage Collection
+    Backends implementieren nur das Lesen/Schreiben einzelner Chunks und Manifeste.
+    """
+
+    def __init__(self, chunk_size: int = BLOB_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    # --- Backend-Schnittstelle -------------------------------------------------
+
+    @abstractmethod
+    def _put_chunk(self, digest: str, data: bytes) -> None:
+        """Speichert einen Chunk, falls nicht vorhanden (sonst nur als genutzt markieren)"""
+
+    @abstractmethod
+    def _get_chunk(self, digest: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def _put_manifest(self, manifest: BlobManifest) -> None:
+        """Schreibt das Manifest, auch wenn es vorhanden ist (markiert es als genutzt)"""
+
+    @abstractmethod
+    def _get_manifest(self, digest: str) -> Optional[BlobManifest]:
+        ...
+
+    @abstractmethod
+    def _delete_manifest(self, digest: str) -> None:
+        ...
+
+    @abstractmethod
+    def _manifests(self) -> Iterable[Tuple[str, float]]:
+        """(Hash, letzte Nutzung als Unix-Zeit) aller Manifeste"""
+
+    @abstractmethod
+    def _manifest_used(self, digest: str) -> Optional[float]:
+        """Letzte Nutzung des Manifests als Unix-Zeit (None: nicht vorhanden)"""
+
+    @abstractmethod
+    def _chunks(self) -> Iterable[Tuple[str, float]]:
+        """(Hash, letzte Nutzung als Unix-Zeit) aller Chunks"""
+
+    @abstractmethod
+    def _delete_chunk(self, digest: str) -> None:
+        ...
+
+    # --- Schreiben ---------------------------------------------------------------
+
+    def put(self, stream: BinaryIO) -> BlobManifest:
+        """Liest den Stream chunkweise (Speicher: ein Chunk) und speichert ihn dedupliziert"""
+        file_hash = hashlib.sha256()
+        chunks = []
+        size = 0
+        while True:
+            data = _read_exact(stream, self.chunk_size)
+            if not data:
+                break
+            chunks.append(self.put_chunk(data))
+            file_hash.update(data)
+            size += len(data)
+
+        manifest = BlobManifest(hash=file_hash.hexdigest(), size=size, chunks=chunks)
+        self._put_manifest(manifest)  # Immer schreiben: schützt vor gleichzeitigem Löschen
+        return manifest
+
+    def put_chunk(self, data: bytes) -> Tuple[str, int]:
+        """Speichert einen einzelnen Chunk (z.B. Teil eines mehrteiligen Uploads)"""
+        digest = hashlib.sha256(data).hexdigest()
+        self._put_chunk(digest, data)
+        return digest, len(data)
+
+    def put_chunks(self, chunks: List[Tuple[str, int]]) -> BlobManifest:
+        """
+        Erstellt das Manifest aus bereits gespeicherten Chunks in Reihenfolge
+        Der Datei-Hash wird chunkweise berechnet (Speicher: ein Chunk).
+        """
+        file_hash = hashlib.sha256()
+        size = 0
+        for digest, chunk_size in chunks:
+            data = self._get_chunk(digest)
+            if len(data) != chunk_size:
+                raise BlobNotFoundError(f"Chunk {digest} hat eine unerwartete Größe")
+            file_hash.update(data)
+            size += chunk_size
+
+        manifest = BlobManifest(hash=file_hash.hexdigest(), size=size, chunks=list(chunks))
+        self._put_manifest(manifest)  # Immer schreiben: schützt vor gleichzeitigem Löschen
+        return manifest
+
+    def put_bytes(self, data: bytes) -> BlobManifest:
+        return self.put(io.BytesIO(data))
+
+    # --- Lesen -------------------------------------------------------------------
+
+    def stat(self, digest: str) -> BlobManifest:
+        manifest = self._get_manifest(digest)
+        if manifest is None:
+            raise BlobNotFoundError(digest)
+        return manifest
+
+    def exists(self, digest: str) -> bool:
+        return self._get_manifest(digest) is not None
+
+    def iter_range(self, digest: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Liefert die Bytes [start, end) chunkweise (end=None: bis Dateiende)"""
+        manifest = self.stat(digest)
+        end = manifest.size if end is None else min(end, manifest.size)
+        offset = 0
+        for chunk_digest, chunk_size in manifest.chunks:
+            chunk_end = offset + chunk_size
+            if chunk_end > start and offset < end:
+                data = self._get_chunk(chunk_digest)
+                yield data[max(start - offset, 0):min(end, chunk_end) - offset]
+            if chunk_end >= end:
+                break
+            offset = chunk_end
+
+    def read(self, digest: str) -> bytes:
+        return b"".join(self.iter_range(digest))
+
+    def open(self, digest: str) -> io.BufferedReader:
+        """Seekbarer Datei-Reader (z.B. für openpyxl), lädt jeweils nur einen Chunk"""
+        return io.BufferedReader(_BlobReader(self, self.stat(digest)), buffer_size=64 * 1024)
+
+    # --- Löschen -----------------------------------------------------------------
+
+    def delete(self, digest: str, grace_seconds: float = BLOB_GC_GRACE_SECONDS) -> bool:
+        """
+        Entfernt das Manifest; Chunks werden von collect_garbage aufgeräumt
+        Wurde das Manifest innerhalb von grace_seconds geschrieben (z.B. von einem
+        parallelen Upload mit gleichem Inhalt), bleibt es erhalten und wird erst von
+        collect_garbage entfernt, falls es dann nicht referenziert ist.
+        Gibt zurück, ob das Manifest entfernt wurde.
+        """
+        last_used = self._manifest_used(digest)
+        if last_used is not None and last_used >= time.time() - grace_seconds:
+            return False
+        self._delete_manifest(digest)
+        return True
+
+    def collect_garbage(
+        self,
+        referenced: Set[str],
+        grace_seconds: float = BLOB_GC_GRACE_SECONDS,
+        keep_chunks: Iterable[str] = ()
+    ) -> dict:
+        """
+        Löscht Manifeste, die nicht in referenced stehen, und Chunks ohne Manifest
+        Zu junge Manifeste und Chunks (grace_seconds) bleiben erhalten (laufende
+        Uploads, deren Datei noch nicht committet ist), ebenso keep_chunks (Teile
+        offener mehrteiliger Uploads).
+        """
+        cutoff = time.time() - grace_seconds
+        removed_manifests = 0
+        live_chunks: Set[str] = set(keep_chunks)
+        for digest, last_used in list(self._manifests()):
+            if digest not in referenced and last_used < cutoff:
+                self._delete_manifest(digest)
+                removed_manifests += 1
+                continue
+            manifest = self._get_manifest(digest)
+            if manifest is not None:
+                live_chunks.update(chunk_digest for chunk_digest, _ in manifest.chunks)
+
+        removed_chunks = 0
+        for digest, last_used in list(self._chunks()):
+            if digest not in live_chunks and last_used < cutoff:
+                self._delete_chunk(digest)
+                removed_chunks += 1
+        return {"manifests_removed": removed_manifests, "chunks_removed": removed_chunks}
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    """Liest bis zu size Bytes (auch bei Streams, die weniger pro read liefern)"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+
+class _BlobReader(io.RawIOBase):
+    """Seekbarer Rohdaten-Reader über die Chunks eines Manifests"""
+
+    def __init__(self, store: BlobStore, manifest: BlobManifest):
+        self._store = store
+        self._manifest = manifest
+        self._offsets = []
+        offset = 0
+        for _, chunk_size in manifest.chunks:
+            self._offsets.append(offset)
+            offset += chunk_size
+        self._position = 0
+        self._cached: Tuple[int, bytes] = (-1, b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self._manifest.size + offset
+        else:
+            raise ValueError(f"Ungültiger whence-Wert: {whence}")
+        if self._position < 0:
+            raise ValueError("Negative Position")
+        return self._position
+
+    def _chunk(self, index: int) -> bytes:
+        if self._cached[0] != index:
+            self._cached = (index, self._store._get_chunk(self._manifest.chunks[index][0]))
+        return self._cached[1]
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self._manifest.size:
+            return 0
+        # Chunk der aktuellen Position (binäre Suche über die Offsets)
+        low, high = 0, len(self._offsets) - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self._offsets[mid] <= self._position:
+                low = mid
+            else:
+                high = mid - 1
+        data = self._chunk(low)
+        start = self._position - self._offsets[low]
+        length = min(len(buffer), len(data) - start)
+        buffer[:length] = data[start:start + length]
+        self._position += length
+        return length
+
+
+# --- Backends -----------------------------------------------------------------
+
+BLOB_STORE_BACKENDS: Dict[str, Callable[[], BlobStore]] = {}
+
+
+def register_blob_store(name: str):
+    """Registriert ein Backend (Fabrik ohne Argumente, Konfiguration über Umgebung)"""
+    def decorator(factory):
+        BLOB_STORE_BACKENDS[name] = factory
+        return factory
+    return decorator
+
+
+class LocalBlobStore(BlobStore):
+    """Backend im lokalen Dateisystem: chunks/ab/<hash>, manifests/ab/<hash>.json"""
+
+    def __init__(self, directory: str, chunk_size: int = BLOB_CHUNK_SIZE):
+        super().__init__(chunk_size)
+        self.directory = directory
+
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "chunks", digest[:2], digest)
+
+    def _manifest_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "manifests", digest[:2], digest + ".json")
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _put_chunk(self, digest: str, data: bytes) -> None:
+        path = self._chunk_path(digest)
+        try:
+            os.utime(path)  # vorhanden: als genutzt markieren (Schutz vor GC)
+        except FileNotFoundError:
+            self._write_atomic(path, data)
+
+    def _get_chunk(self, digest: str) -> bytes:
+        try:
+            with open(self._chunk_path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise BlobNotFoundError(f"Chunk {digest} fehlt")
+
+    def _put_manifest(self, manifest: BlobManifest) -> None:
+        self._write_atomic(self._manifest_path(manifest.hash), manifest.to_json().encode("utf-8"))
+
+    def _get_manifest(self, digest: str) -> Optional[BlobManifest]:
+        try:
+            with open(self._manifest_path(digest), "r", encoding="utf-8") as f:
+                return BlobManifest.from_json(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _delete_manifest(self, digest: str) -> None:
+        try:
+            os.remove(self._manifest_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _walk(self, subdirectory: str):
+        root = os.path.join(self.directory, subdirectory)
+        if not os.path.isdir(root):
+            return
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                if not name.endswith(".tmp"):
+                    yield dirpath, name
+
+    def _manifests(self) -> Iterable[Tuple[str, float]]:
+        for dirpath, name in self._walk("manifests"):
+            try:
+                yield name[:-len(".json")], os.path.getmtime(os.path.join(dirpath, name))
+            except OSError:
+                continue
+
+    def _manifest_used(self, digest: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(self._manifest_path(digest))
+        except FileNotFoundError:
+            return None
+
+    def _chunks(self) -> Iterable[Tuple[str, float]]:
+        for dirpath, name in self._walk("chunks"):
+            try:
+                yield name, os.path.getmtime(os.path.join(dirpath, name))
+            except OSError:
+                continue
+
+    def _delete_chunk(self, digest: str) -> None:
+        try:
+            os.remove(self._chunk_path(digest))
+        except FileNotFoundError:
+            pass
+
+
+@register_blob_store("local")
+def _local_blob_store() -> BlobStore:
+    return LocalBlobStore(os.getenv("BLOB_STORE_DIR", os.path.join("data", "blobs")))
+
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """Globaler Blob-Speicher (Backend laut BLOB_STORE_BACKEND)"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = os.getenv("BLOB_STORE_BACKEND", "local")
+            if backend not in BLOB_STORE_BACKENDS:
+                raise ValueError(f"Unbekanntes Blob-Backend: {backend}")
+            _store = BLOB_STORE_BACKENDS[backend]()
+        return _store
@@ -0,0 +1,301 @@
+"""
+Zeilenweise Änderungen an DataTables (Einfügen, Zellen ändern, Löschen)
+
+Statt die ganze Tabelle neu zu schreiben, werden nur die Chunks neu kodiert,
+in denen geänderte Zeilen liegen: bei Zell-Änderungen nur die betroffenen
+Spalten, bei Löschungen alle Spalten des Chunks, bei Einfügungen der letzte
+Chunk (solange er nicht voll ist) und neue Chunks. Um Zeilen zu finden, wird
+nur die Zeilen-ID-Spalte gelesen.
+
+Optimistische Sperre: der Aufrufer gibt die Version an, auf der seine
+Änderungen beruhen. Die Version wird vor dem Schreiben per bedingtem UPDATE
+erhöht; hat sich die Tabelle inzwischen geändert, schlägt das fehl.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import update
+from sqlalchemy.orm import object_session
+
+from models import DataTable, DataTableChunk
+from .columnar import (
+    CHUNK_ROWS, ROW_ID_COLUMN, column_key, load_chunks, migrate_table,
+    decode_values, decode_array, encode_values
+)
+
+
+class RowChangeError(ValueError):
+    """Ungültige Änderung (unbekannte Zeile oder Spalte, doppelte ID)"""
+    pass
+
+
+class TableVersionConflict(Exception):
+    """Die Tabelle wurde seit der angegebenen Version geändert"""
+
+    def __init__(self, expected: int, current: Optional[int]):
+        self.expected = expected
+        self.current = current
+        super().__init__(f"Tabelle wurde geändert (erwartet Version {expected}, aktuell {current})")
+
+
+@dataclass
+class RowChangeResult:
+    inserted_ids: List[int] = field(default_factory=list)
+    updated: int = 0
+    deleted: int = 0
+
+
+def _value_column(table: DataTable, key: str) -> int:
+    """Schlüssel einer Zelle (col_X oder Spaltenname) → Spalten-ID"""
+    for col in table.columns or []:
+        if key == column_key(col["id"]) or key == col["name"]:
+            return col["id"]
+    raise RowChangeError(f"Spalte '{key}' nicht gefunden")
+
+
+def _row_values(table: DataTable, values: dict) -> Dict[int, object]:
+    return {_value_column(table, key): value for key, value in values.items() if key != "id"}
+
+
+def _locate(id_chunks: List[DataTableChunk], wanted: set) -> Dict[int, Tuple[int, int]]:
+    """Zeilen-ID → (chunk_no, Position im Chunk), nur für die gesuchten IDs"""
+    located = {}
+    if not wanted:
+        return located
+    for chunk in id_chunks:
+        array = decode_array(chunk)
+        if array is not None and pa.types.is_integer(array.type):
+            mask = pc.is_in(array, value_set=pa.array(sorted(wanted), type=array.type))
+            for position in np.flatnonzero(mask.to_numpy(zero_copy_only=False)).tolist():
+                located[array[position].as_py()] = (chunk.chunk_no, position)
+        else:
+            for position, row_id in enumerate(decode_values(chunk)):
+                if row_id in wanted:
+                    located[row_id] = (chunk.chunk_no, position)
+    return located
+
+
+def _max_row_id(id_chunks: List[DataTableChunk]) -> int:
+    highest = 0
+    for chunk in id_chunks:
+        array = decode_array(chunk)
+        if array is not None and pa.types.is_integer(array.type):
+            value = pc.max(array).as_py()
+        else:
+            value = max((v for v in decode_values(chunk) if isinstance(v, int)), default=None)
+        if value is not None:
+            highest = max(highest, value)
+    return highest
+
+
+def claim_version(table: DataTable, expected_version: int) -> None:
+    """
+    Erhöht die Version nur, wenn sie noch expected_version ist
+    Sperrt die Zeile (Postgres) bzw. die Datenbank (SQLite) bis zum Commit,
+    parallele Änderungen an derselben Tabelle werden so serialisiert.
+    """
+    db = object_session(table)
+    result = db.execute(
+        update(DataTable)
+        .where(DataTable.id == table.id, DataTable.version == expected_version)
+        .values(version=DataTable.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        current = db.query(DataTable.version).filter(DataTable.id == table.id).scalar()
+        raise TableVersionConflict(expected_version, current)
+    db.refresh(table)
+
+
+def _chunk_columns(table: DataTable, chunk_no: int, column_ids: Iterable[int]) -> Dict[int, DataTableChunk]:
+    return {c.column_id: c for c in load_chunks(table, column_ids=list(column_ids), chunk_nos=[chunk_no])}
+
+
+def _store(table: DataTable, chunks: Dict[int, DataTableChunk], chunk_no: int,
+           column_id: int, values: list) -> None:
+    """Schreibt die Werte einer Spalte in ihren Chunk (legt ihn bei Bedarf an)"""
+    payload, encoding = encode_values(values)
+    chunk = chunks.get(column_id)
+    if chunk is None:
+        chunk = DataTableChunk(table_id=table.id, column_id=column_id, chunk_no=chunk_no)
+        object_session(table).add(chunk)
+        chunks[column_id] = chunk
+    chunk.row_count = len(values)
+    chunk.encoding = encoding
+    chunk.payload = payload
+
+
+def _rewrite_chunk(
+    table: DataTable,
+    chunk_no: int,
+    row_count: int,
+    cell_updates: Dict[int, Dict[int, object]],
+    deleted_positions: set
+) -> int:
+    """
+    Wendet Zell-Änderungen und Löschungen auf einen Chunk an
+    Ohne Löschungen werden nur die geänderten Spalten neu kodiert.
+    Gibt die neue Zeilenanzahl des Chunks zurück.
+    """
+    if deleted_positions:
+        column_ids = [ROW_ID_COLUMN] + [col["id"] for col in table.columns or []]
+    else:
+        column_ids = sorted({cid for values in cell_updates.values() for cid in values})
+    chunks = _chunk_columns(table, chunk_no, column_ids)
+
+    keep = [pos for pos in range(row_count) if pos not in deleted_positions]
+    if not keep:
+        db = object_session(table)
+        for chunk in chunks.values():
+            db.delete(chunk)
+        return 0
+
+    for column_id in column_ids:
+        chunk = chunks.get(column_id)
+        values = decode_values(chunk) if chunk is not None else [None] * row_count
+        for position, row_values in cell_updates.items():
+            if column_id in row_values:
+                values[position] = row_values[column_id]
+        if deleted_positions:
+            values = [values[pos] for pos in keep]
+        _store(table, chunks, chunk_no, column_id, values)
+    return len(keep)
+
+
+def _renumber_chunks(table: DataTable, chunk_nos: List[int]) -> None:
+    """Schließt Lücken in den Chunk-Nummern nach entfernten (leeren) Chunks"""
+    db = object_session(table)
+    db.flush()
+    for new_no, old_no in enumerate(chunk_nos):
+        if new_no != old_no:
+            # Aufsteigend, damit der Unique-Constraint nie verletzt wird
+            db.query(DataTableChunk).filter(
+                DataTableChunk.table_id == table.id,
+                DataTableChunk.chunk_no == old_no
+            ).update({DataTableChunk.chunk_no: new_no}, synchronize_session=False)
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, DataTableChunk) and obj.table_id == table.id:
+            db.expire(obj)
+
+
+def _append_rows(table: DataTable, layout: List[int], row_ids: List[int], rows: List[Dict[int, object]]) -> None:
+    """Hängt Zeilen an: füllt den letzten Chunk auf und legt danach neue an"""
+    column_ids = [ROW_ID_COLUMN] + [col["id"] for col in table.columns or []]
+    start = 0
+    chunk_no = len(layout) - 1
+    if layout and layout[-1] < CHUNK_ROWS:
+        room = CHUNK_ROWS - layout[-1]
+        chunks = _chunk_columns(table, chunk_no, column_ids)
+        for column_id in column_ids:
+            chunk = chunks.get(column_id)
+            values = decode_values(chunk) if chunk is not None else [None] * layout[-1]
+            if column_id == ROW_ID_COLUMN:
+                values.extend(row_ids[:room])
+            else:
+                values.extend(row.get(column_id) for row in rows[:room])
+            _store(table, chunks, chunk_no, column_id, values)
+        start = room
+
+    while start < len(row_ids):
+        chunk_no += 1
+        end = start + CHUNK_ROWS
+        chunks: Dict[int, DataTableChunk] = {}
+        for column_id in column_ids:
+            if column_id == ROW_ID_COLUMN:
+                values = row_ids[start:end]
+            else:
+                values = [row.get(column_id) for row in rows[start:end]]
+            _store(table, chunks, chunk_no, column_id, values)
+        start = end
+
+
+def apply_row_changes(
+    table: DataTable,
+    expected_version: int,
+    inserts: Optional[List[dict]] = None,
+    updates: Optional[List[Tuple[int, dict]]] = None,
+    deletes: Optional[List[int]] = None
+) -> RowChangeResult:
+    """
+    Wendet Änderungen in der Reihenfolge Ändern, Löschen, Einfügen an
+
+    - inserts: Zeilen im Format {"col_1": ...}, optional mit "id" (sonst fortlaufend)
+    - updates: (Zeilen-ID, {"col_1": neuer Wert, ...})
+    - deletes: Zeilen-IDs
+
+    Die Tabelle muss gespeichert sein; committet wird vom Aufrufer.
+    Löst TableVersionConflict oder RowChangeError aus (Session ist dann zurückgerollt
+    bzw. muss vom Aufrufer zurückgerollt werden).
+    """
+    inserts = inserts or []
+    updates = updates or []
+    deletes = deletes or []
+    result = RowChangeResult()
+
+    claim_version(table, expected_version)
+
+    # JSON-Tabellen einmalig in den spaltenbasierten Speicher überführen
+    # (die Version ist bereits erhöht, migrate_table soll sie nicht erneut erhöhen)
+    claimed_version = table.version
+    if migrate_table(table):
+        table.version = claimed_version
+        object_session(table).flush()
+
+    insert_values = [_row_values(table, row) for row in inserts]
+    update_values = [(row_id, _row_values(table, values)) for row_id, values in updates]
+    explicit_ids = [row["id"] for row in inserts if row.get("id") is not None]
+    if len(set(explicit_ids)) != len(explicit_ids):
+        raise RowChangeError("Doppelte Zeilen-IDs beim Einfügen")
+
+    id_chunks = load_chunks(table, column_ids=[ROW_ID_COLUMN])
+    layout = [chunk.row_count for chunk in id_chunks]
+    next_id = max(_max_row_id(id_chunks) if inserts else 0, max(explicit_ids, default=0)) + 1
+    wanted = {row_id for row_id, _ in update_values} | set(deletes) | set(explicit_ids)
+    located = _locate(id_chunks, wanted)
+
+    missing = sorted(({row_id for row_id, _ in update_values} | set(deletes)) - located.keys())
+    if missing:
+        raise RowChangeError(f"Zeilen nicht gefunden: {', '.join(map(str, missing[:20]))}")
+    existing = sorted(set(explicit_ids) & located.keys())
+    if existing:
+        raise RowChangeError(f"Zeilen-IDs existieren bereits: {', '.join(map(str, existing[:20]))}")
+
+    # Änderungen je Chunk sammeln
+    cell_updates: Dict[int, Dict[int, Dict[int, object]]] = {}
+    for row_id, values in update_values:
+        chunk_no, position = located[row_id]
+        cell_updates.setdefault(chunk_no, {}).setdefault(position, {}).update(values)
+        result.updated += 1
+    deleted_positions: Dict[int, set] = {}
+    for row_id in set(deletes):
+        chunk_no, position = located[row_id]
+        deleted_positions.setdefault(chunk_no, set()).add(position)
+        result.deleted += 1
+
+    for chunk_no in sorted(cell_updates.keys() | deleted_positions.keys()):
+        layout[chunk_no] = _rewrite_chunk(
+            table, chunk_no, layout[chunk_no],
+            cell_updates.get(chunk_no, {}), deleted_positions.get(chunk_no, set())
+        )
+
+    if 0 in layout:
+        _renumber_chunks(table, [no for no, rows in enumerate(layout) if rows])
+        layout = [rows for rows in layout if rows]
+
+    if inserts:
+        row_ids = []
+        for row in inserts:
+            if row.get("id") is not None:
+                row_ids.append(row["id"])
+            else:
+                row_ids.append(next_id)
+                next_id += 1
+        _append_rows(table, layout, row_ids, insert_values)
+        result.inserted_ids = row_ids
+
+    table.row_count = sum(layout) + len(inserts)
+    return result
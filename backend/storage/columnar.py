@@ -0,0 +1,358 @@
+"""
+Spaltenbasierter Speicher für DataTables
+
+Statt alle Zeilen als ein großes JSON-Array in `data_tables.data` abzulegen,
+wird jede Spalte in Chunks zu je CHUNK_ROWS Zeilen als Arrow-IPC-Blob in
+`data_table_chunks` gespeichert (Schlüssel: table_id, column_id, chunk_no).
+Die Zeilen-IDs liegen als eigene Spalte mit column_id 0 vor.
+"""
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import inspect
+from sqlalchemy.orm import object_session
+
+from models import DataTable, DataTableChunk
+
+CHUNK_ROWS = int(os.getenv("COLUMNAR_CHUNK_ROWS", "50000"))
+
+ROW_ID_COLUMN = 0
+
+STORAGE_JSON = "json"
+STORAGE_COLUMNAR = "columnar"
+
+# Kodierung eines Chunks: 'arrow' = typisiertes Arrow-Array,
+# 'json' = String-Array mit JSON-kodierten Werten (für gemischte Typen)
+ENCODING_ARROW = "arrow"
+ENCODING_JSON = "json"
+
+
+def column_key(column_id: int) -> str:
+    """Schlüssel einer Spalte im Zeilen-Dict (Format: col_X)"""
+    return "id" if column_id == ROW_ID_COLUMN else f"col_{column_id}"
+
+
+def is_columnar(table: DataTable) -> bool:
+    return table.storage_format == STORAGE_COLUMNAR
+
+
+def _serialize(array: pa.Array) -> bytes:
+    batch = pa.record_batch([array], names=["v"])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def _deserialize(payload: bytes) -> pa.Array:
+    reader = pa.ipc.open_stream(pa.py_buffer(payload))
+    return reader.read_all().column(0).combine_chunks()
+
+
+def encode_values(values: list) -> Tuple[bytes, str]:
+    """Kodiert eine Liste von Zellwerten als Arrow-Blob"""
+    try:
+        return _serialize(pa.array(values)), ENCODING_ARROW
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # Gemischte Typen (z.B. "1.000 €" und 12.5) → JSON pro Zelle
+        encoded = [None if v is None else json.dumps(v, default=str) for v in values]
+        return _serialize(pa.array(encoded, type=pa.string())), ENCODING_JSON
+
+
+def encode_array(array: pa.Array) -> Tuple[bytes, str]:
+    """Kodiert ein bereits typisiertes Arrow-Array"""
+    return _serialize(array), ENCODING_ARROW
+
+
+def decode_values(chunk: DataTableChunk) -> list:
+    """Dekodiert einen Chunk zu einer Liste von Python-Werten"""
+    values = _deserialize(chunk.payload).to_pylist()
+    if chunk.encoding == ENCODING_JSON:
+        return [None if v is None else json.loads(v) for v in values]
+    return values
+
+
+def decode_array(chunk: DataTableChunk) -> Optional[pa.Array]:
+    """Dekodiert einen Chunk als Arrow-Array (None bei JSON-Kodierung)"""
+    if chunk.encoding == ENCODING_JSON:
+        return None
+    return _deserialize(chunk.payload)
+
+
+def bump_version(table: DataTable) -> None:
+    """
+    Erhöht den Versionszähler nach einer Änderung von Daten oder Spalten
+    Gespeicherte Tabellen erhöhen in SQL (version = version + 1), damit parallele
+    Änderungen nie dieselbe Version schreiben; der Wert wird nach dem Flush neu geladen.
+    """
+    if inspect(table).persistent:
+        table.version = DataTable.version + 1
+    else:
+        table.version = (table.version or 0) + 1
+
+
+def _column_ids(columns: List[dict]) -> List[int]:
+    return [ROW_ID_COLUMN] + [col["id"] for col in columns]
+
+
+def load_chunks(
+    table: DataTable,
+    column_ids: Optional[Iterable[int]] = None,
+    chunk_nos: Optional[Iterable[int]] = None
+) -> List[DataTableChunk]:
+    """
+    Lädt Chunks einer Tabelle, optional nur bestimmte Spalten/Chunks
+    Nicht gespeicherte Tabellen nutzen direkt die Relationship.
+    """
+    db = object_session(table)
+    if db is None or table.id is None:
+        chunks = list(table.chunks)
+        if column_ids is not None:
+            wanted = set(column_ids)
+            chunks = [c for c in chunks if c.column_id in wanted]
+        if chunk_nos is not None:
+            wanted_nos = set(chunk_nos)
+            chunks = [c for c in chunks if c.chunk_no in wanted_nos]
+        return sorted(chunks, key=lambda c: (c.chunk_no, c.column_id))
+
+    query = db.query(DataTableChunk).filter(DataTableChunk.table_id == table.id)
+    if column_ids is not None:
+        query = query.filter(DataTableChunk.column_id.in_(list(column_ids)))
+    if chunk_nos is not None:
+        query = query.filter(DataTableChunk.chunk_no.in_(list(chunk_nos)))
+    return query.order_by(DataTableChunk.chunk_no, DataTableChunk.column_id).all()
+
+
+def chunk_layout(table: DataTable) -> List[int]:
+    """Zeilenanzahl je Chunk (ohne Payloads zu laden)"""
+    db = object_session(table)
+    if db is None or table.id is None:
+        return [c.row_count for c in sorted(table.chunks, key=lambda c: c.chunk_no)
+                if c.column_id == ROW_ID_COLUMN]
+    return [row_count for (row_count,) in db.query(DataTableChunk.row_count).filter(
+        DataTableChunk.table_id == table.id,
+        DataTableChunk.column_id == ROW_ID_COLUMN
+    ).order_by(DataTableChunk.chunk_no).all()]
+
+
+def _group_by_chunk(chunks: List[DataTableChunk]) -> Dict[int, Dict[int, DataTableChunk]]:
+    grouped: Dict[int, Dict[int, DataTableChunk]] = {}
+    for chunk in chunks:
+        grouped.setdefault(chunk.chunk_no, {})[chunk.column_id] = chunk
+    return grouped
+
+
+def _clear_chunks(table: DataTable) -> None:
+    """Entfernt alle bestehenden Chunks ohne deren Payload zu laden"""
+    db = object_session(table)
+    if db is not None and table.id is not None:
+        db.query(DataTableChunk).filter(
+            DataTableChunk.table_id == table.id
+        ).delete(synchronize_session=False)
+        db.expire(table, ["chunks"])
+
+
+def write_columns(
+    table: DataTable,
+    columns: List[dict],
+    row_ids: Union[list, pa.Array],
+    values: Dict[int, Union[list, pa.Array]]
+) -> None:
+    """
+    Schreibt ganze Spalten (Liste oder Arrow-Array je Spalten-ID) als Chunks
+    Bestehende Chunks werden ersetzt, die Tabelle wird auf 'columnar' umgestellt.
+    """
+    _clear_chunks(table)
+
+    row_count = len(row_ids)
+    all_values = {ROW_ID_COLUMN: row_ids, **values}
+    chunks = []
+    for chunk_no, start in enumerate(range(0, row_count, CHUNK_ROWS)):
+        length = min(CHUNK_ROWS, row_count - start)
+        for column_id in _column_ids(columns):
+            column_values = all_values.get(column_id)
+            if column_values is None:
+                payload, encoding = encode_values([None] * length)
+            elif isinstance(column_values, pa.Array):
+                payload, encoding = encode_array(column_values.slice(start, length))
+            else:
+                payload, encoding = encode_values(column_values[start:start + length])
+            chunks.append(DataTableChunk(
+                column_id=column_id,
+                chunk_no=chunk_no,
+                row_count=length,
+                encoding=encoding,
+                payload=payload
+            ))
+
+    table.chunks = chunks
+    table.columns = columns
+    table.data = []
+    table.storage_format = STORAGE_COLUMNAR
+    table.row_count = row_count
+    table.column_count = len(columns)
+    bump_version(table)
+
+
+def write_rows(table: DataTable, rows: List[dict], columns: Optional[List[dict]] = None) -> None:
+    """Schreibt Zeilen (Format: {"id": 1, "col_1": ...}) spaltenweise als Chunks"""
+    if columns is None:
+        columns = table.columns or []
+
+    row_ids = [row.get("id", i + 1) for i, row in enumerate(rows)]
+    values = {}
+    for col in columns:
+        key = column_key(col["id"])
+        values[col["id"]] = [row.get(key) for row in rows]
+    write_columns(table, columns, row_ids, values)
+
+
+class ChunkWriter:
+    """
+    Schreibt eine Tabelle chunkweise, ohne alle Chunks gleichzeitig im Speicher zu halten
+    Jeder volle Chunk wird sofort in die Session geschrieben (flush) und wieder
+    freigegeben. Die Tabelle muss bereits gespeichert sein (id vorhanden).
+    """
+
+    def __init__(self, table: DataTable, column_ids: List[int]):
+        self.table = table
+        self.db = object_session(table)
+        if self.db is None or table.id is None:
+            raise ValueError("ChunkWriter benötigt eine gespeicherte Tabelle")
+        self.column_ids = list(column_ids)
+        self.row_count = 0
+        self._chunk_no = 0
+        self._row_ids: list = []
+        self._values: Dict[int, list] = {cid: [] for cid in self.column_ids}
+        _clear_chunks(table)
+
+    def append(self, row_ids: list, values: Dict[int, list]) -> None:
+        """Hängt Zeilen an (Werte je Spalten-ID, gleiche Länge wie row_ids)"""
+        self._row_ids.extend(row_ids)
+        for column_id in self.column_ids:
+            column_values = values.get(column_id)
+            if column_values is None:
+                column_values = [None] * len(row_ids)
+            self._values[column_id].extend(column_values)
+        while len(self._row_ids) >= CHUNK_ROWS:
+            self._flush(CHUNK_ROWS)
+
+    def _flush(self, length: int) -> None:
+        all_values = {ROW_ID_COLUMN: self._row_ids, **self._values}
+        chunks = []
+        for column_id in [ROW_ID_COLUMN] + self.column_ids:
+            payload, encoding = encode_values(all_values[column_id][:length])
+            chunks.append(DataTableChunk(
+                table_id=self.table.id,
+                column_id=column_id,
+                chunk_no=self._chunk_no,
+                row_count=length,
+                encoding=encoding,
+                payload=payload
+            ))
+        self.db.add_all(chunks)
+        self.db.flush()
+        for chunk in chunks:
+            self.db.expunge(chunk)
+
+        self._row_ids = self._row_ids[length:]
+        self._values = {cid: values[length:] for cid, values in self._values.items()}
+        self._chunk_no += 1
+        self.row_count += length
+
+    def close(self, columns: List[dict]) -> None:
+        """Schreibt den letzten Chunk und aktualisiert die Metadaten der Tabelle"""
+        if self._row_ids:
+            self._flush(len(self._row_ids))
+        self.db.expire(self.table, ["chunks"])
+        self.table.columns = columns
+        self.table.data = []
+        self.table.storage_format = STORAGE_COLUMNAR
+        self.table.row_count = self.row_count
+        self.table.column_count = len(columns)
+        bump_version(self.table)
+
+
+def drop_columns(table: DataTable, column_ids: Iterable[int]) -> None:
+    """Löscht die Chunks entfernter Spalten"""
+    column_ids = [cid for cid in column_ids if cid != ROW_ID_COLUMN]
+    db = object_session(table)
+    if not column_ids or db is None or table.id is None:
+        return
+    db.query(DataTableChunk).filter(
+        DataTableChunk.table_id == table.id,
+        DataTableChunk.column_id.in_(column_ids)
+    ).delete(synchronize_session=False)
+    db.expire(table, ["chunks"])
+
+
+def read_rows(table: DataTable) -> List[dict]:
+    """Liest alle Zeilen einer Tabelle, unabhängig vom Speicherformat"""
+    if not is_columnar(table):
+        return table.data or []
+
+    column_ids = _column_ids(table.columns or [])
+    keys = [column_key(cid) for cid in column_ids]
+    rows = []
+    for chunk_no, by_column in sorted(_group_by_chunk(load_chunks(table)).items()):
+        row_count = next(iter(by_column.values())).row_count
+        column_values = [
+            decode_values(by_column[cid]) if cid in by_column else [None] * row_count
+            for cid in column_ids
+        ]
+        rows.extend(dict(zip(keys, values)) for values in zip(*column_values))
+    return rows
+
+
+def _column_series(chunks: List[DataTableChunk], row_counts: List[int]) -> pd.Series:
+    arrays = [decode_array(chunk) if chunk is not None else None for chunk in chunks]
+    if all(array is not None for array in arrays):
+        try:
+            return pa.chunked_array(arrays).to_pandas()
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass  # Unterschiedliche Typen je Chunk → Python-Objekte
+
+    values = []
+    for chunk, row_count in zip(chunks, row_counts):
+        values.extend(decode_values(chunk) if chunk is not None else [None] * row_count)
+    return pd.Series(values, dtype=object)
+
+
+def read_column(table: DataTable, column_id: int) -> pd.Series:
+    """Liest eine einzelne Spalte über alle Chunks"""
+    row_counts = chunk_layout(table)
+    by_chunk = {c.chunk_no: c for c in load_chunks(table, column_ids=[column_id])}
+    if not row_counts:
+        return pd.Series([], dtype=object)
+    return _column_series([by_chunk.get(no) for no in range(len(row_counts))], row_counts)
+
+
+def read_dataframe(table: DataTable, with_row_ids: bool = True) -> pd.DataFrame:
+    """
+    Liest eine spaltenbasierte Tabelle direkt als DataFrame (Spalten: id, col_X)
+    Ohne Umweg über Zeilen-Dicts.
+    """
+    column_ids = _column_ids(table.columns or [])
+    if not with_row_ids:
+        column_ids = column_ids[1:]
+    grouped = sorted(_group_by_chunk(load_chunks(table, column_ids=column_ids)).items())
+    if not grouped:
+        return pd.DataFrame()
+
+    row_counts = [next(iter(by_column.values())).row_count for _, by_column in grouped]
+    series = {}
+    for cid in column_ids:
+        chunks = [by_column.get(cid) for _, by_column in grouped]
+        series[column_key(cid)] = _column_series(chunks, row_counts)
+    return pd.DataFrame(series)
+
+
+def migrate_table(table: DataTable) -> bool:
+    """Migriert eine JSON-Tabelle in den spaltenbasierten Speicher"""
+    if is_columnar(table):
+        return False
+    write_rows(table, table.data or [], table.columns or [])
+    return True
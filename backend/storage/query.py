@@ -0,0 +1,250 @@
+"""
+Zeilen-Abfragen auf DataTables: Paginierung, Projektion, Filter und Sortierung
+
+Bei spaltenbasierten Tabellen werden nur die Spalten geladen, die für Filter
+und Sortierung gebraucht werden, und für die Ergebniszeilen nur die Chunks,
+in denen diese Zeilen liegen.
+"""
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from models import DataTable
+from .columnar import (
+    ROW_ID_COLUMN, column_key, is_columnar, chunk_layout, load_chunks,
+    decode_values, read_column
+)
+
+FILTER_OPERATORS = ("eq", "ne", "gt", "ge", "lt", "le", "contains")
+
+# Ergebnis von _ids_ascending pro (table_id, version), LRU mit fester Größe
+ASCENDING_CACHE_SIZE = 1024
+_ascending_cache: "OrderedDict[Tuple[int, int], bool]" = OrderedDict()
+_ascending_lock = threading.Lock()
+
+
+class RowQueryError(ValueError):
+    """Ungültige Abfrage (unbekannte Spalte, Operator, Cursor)"""
+    pass
+
+
+@dataclass
+class RowFilter:
+    column_id: int
+    op: str
+    value: str
+
+
+@dataclass
+class RowPage:
+    rows: List[dict]
+    columns: List[dict]
+    total_rows: int
+    next_cursor: Optional[int] = None
+
+
+def resolve_column(table: DataTable, ref: str) -> int:
+    """Löst eine Spaltenreferenz (id, col_X, ID oder Spaltenname) zur Spalten-ID auf"""
+    if ref == "id":
+        return ROW_ID_COLUMN
+    columns = table.columns or []
+    if ref.startswith("col_"):
+        ref = ref[4:]
+    for col in columns:
+        if str(col["id"]) == ref or col["name"] == ref:
+            return col["id"]
+    raise RowQueryError(f"Spalte '{ref}' nicht gefunden")
+
+
+def parse_filter(table: DataTable, expression: str) -> RowFilter:
+    """Parst einen Filter im Format 'spalte:operator:wert'"""
+    parts = expression.split(":", 2)
+    if len(parts) != 3:
+        raise RowQueryError(f"Ungültiger Filter '{expression}' (Format: spalte:operator:wert)")
+    ref, op, value = parts
+    if op not in FILTER_OPERATORS:
+        raise RowQueryError(f"Unbekannter Filter-Operator '{op}'")
+    return RowFilter(column_id=resolve_column(table, ref), op=op, value=value)
+
+
+def _json_column(table: DataTable, column_id: int) -> pd.Series:
+    key = column_key(column_id)
+    return pd.Series([row.get(key) for row in (table.data or [])], dtype=object)
+
+
+def _load_column(table: DataTable, column_id: int) -> pd.Series:
+    if is_columnar(table):
+        return read_column(table, column_id)
+    return _json_column(table, column_id)
+
+
+def _filter_mask(series: pd.Series, row_filter: RowFilter) -> pd.Series:
+    op, value = row_filter.op, row_filter.value
+
+    if op == "contains":
+        text = series.astype("string")
+        return text.str.contains(value, case=False, regex=False).fillna(False)
+
+    numeric = pd.to_numeric(series, errors="coerce")
+    target = pd.to_numeric(pd.Series([value]), errors="coerce").iloc[0]
+    if pd.notna(target) and numeric.notna().any():
+        left, right = numeric, target
+    else:
+        left, right = series.astype("string"), value
+
+    if op == "eq":
+        mask = left == right
+    elif op == "ne":
+        mask = left != right
+    elif op == "gt":
+        mask = left > right
+    elif op == "ge":
+        mask = left >= right
+    elif op == "lt":
+        mask = left < right
+    else:
+        mask = left <= right
+    return pd.Series(mask).fillna(False).astype(bool)
+
+
+def _gather_rows(table: DataTable, positions: List[int], column_ids: List[int]) -> List[dict]:
+    """Holt die Werte der Zeilen an den gegebenen Positionen (nur betroffene Chunks)"""
+    keys = [column_key(cid) for cid in column_ids]
+
+    if not is_columnar(table):
+        data = table.data or []
+        return [{key: data[pos].get(key) for key in keys} for pos in positions]
+
+    starts = [0] + list(accumulate(chunk_layout(table)))
+    located = [(bisect_right(starts, pos) - 1, pos) for pos in positions]
+    chunk_nos = sorted({chunk_no for chunk_no, _ in located})
+
+    values: Dict[Tuple[int, int], list] = {}
+    for chunk in load_chunks(table, column_ids=column_ids, chunk_nos=chunk_nos):
+        values[(chunk.chunk_no, chunk.column_id)] = decode_values(chunk)
+
+    rows = []
+    for chunk_no, pos in located:
+        offset = pos - starts[chunk_no]
+        row = {}
+        for cid, key in zip(column_ids, keys):
+            column_values = values.get((chunk_no, cid))
+            row[key] = column_values[offset] if column_values is not None else None
+        rows.append(row)
+    return rows
+
+
+def _ids_ascending(table: DataTable) -> bool:
+    """
+    True, wenn die Speicherreihenfolge der Zeilen aufsteigend nach ID ist
+    Das Ergebnis wird pro (Tabelle, Version) gecacht, damit nicht jede Seite die
+    komplette ID-Spalte lädt; jede Datenänderung erhöht die Version.
+    """
+    key = (table.id, table.version) if table.id is not None and isinstance(table.version, int) else None
+    if key is not None:
+        with _ascending_lock:
+            if key in _ascending_cache:
+                _ascending_cache.move_to_end(key)
+                return _ascending_cache[key]
+
+    ids = pd.to_numeric(_load_column(table, ROW_ID_COLUMN), errors="coerce")
+    ascending = bool(ids.notna().all() and ids.is_monotonic_increasing)
+
+    if key is not None:
+        with _ascending_lock:
+            _ascending_cache[key] = ascending
+            while len(_ascending_cache) > ASCENDING_CACHE_SIZE:
+                _ascending_cache.popitem(last=False)
+    return ascending
+
+
+def query_rows(
+    table: DataTable,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    column_ids: Optional[List[int]] = None,
+    filters: Optional[List[RowFilter]] = None,
+    sort_column: Optional[int] = None,
+    descending: bool = False,
+    after_id: Optional[int] = None
+) -> RowPage:
+    """
+    Liefert eine Seite von Zeilen
+
+    Ohne Filter/Sortierung/Cursor werden nur die Chunks des angefragten Bereichs
+    geladen. Keyset-Paginierung (after_id) sortiert nach Zeilen-ID.
+
+    total_rows ist immer die Anzahl der Zeilen nach Filtern (ohne Cursor).
+    next_cursor wird gesetzt, wenn nach einer vollen Seite weitere Zeilen folgen
+    und die Reihenfolge die Zeilen-ID ist (sort=id, Cursor oder eine Tabelle,
+    deren Speicherreihenfolge aufsteigend nach ID ist).
+    """
+    filters = filters or []
+    columns = table.columns or []
+    if column_ids is not None:
+        wanted = set(column_ids)
+        columns = [col for col in columns if col["id"] in wanted]
+    projected_ids = [ROW_ID_COLUMN] + [col["id"] for col in columns]
+
+    if after_id is not None:
+        if sort_column not in (None, ROW_ID_COLUMN):
+            raise RowQueryError("Cursor-Paginierung ist nur mit Sortierung nach 'id' möglich")
+        sort_column = ROW_ID_COLUMN
+
+    if not filters and sort_column is None:
+        # Schneller Pfad: nur der angefragte Bereich wird gelesen
+        total = table.row_count or 0
+        if not is_columnar(table):
+            total = len(table.data or [])
+        end = total if limit is None else min(total, offset + limit)
+        positions = list(range(min(offset, total), end))
+        rows = _gather_rows(table, positions, projected_ids)
+        next_cursor = None
+        if rows and end < total and _ids_ascending(table):
+            next_cursor = rows[-1]["id"]
+        return RowPage(rows=rows, columns=columns, total_rows=total, next_cursor=next_cursor)
+
+    needed = {cid for cid in [f.column_id for f in filters] + [sort_column] if cid is not None}
+    if after_id is not None:
+        needed.add(ROW_ID_COLUMN)
+    loaded = {cid: _load_column(table, cid) for cid in needed}
+
+    mask = None
+    for row_filter in filters:
+        column_mask = _filter_mask(loaded[row_filter.column_id], row_filter)
+        mask = column_mask if mask is None else mask & column_mask
+
+    # Gesamtzahl nach Filtern, unabhängig vom Cursor
+    total = int(mask.sum()) if mask is not None else len(next(iter(loaded.values())))
+
+    if after_id is not None:
+        ids = pd.to_numeric(loaded[ROW_ID_COLUMN], errors="coerce")
+        cursor_mask = (ids < after_id) if descending else (ids > after_id)
+        mask = cursor_mask if mask is None else mask & cursor_mask
+
+    if mask is not None:
+        selected = mask[mask].index
+    else:
+        selected = next(iter(loaded.values())).index
+
+    if sort_column is not None:
+        sort_values = loaded[sort_column].loc[selected]
+        numeric = pd.to_numeric(sort_values, errors="coerce")
+        key = numeric if numeric.notna().sum() == sort_values.notna().sum() else sort_values.astype("string")
+        selected = key.sort_values(ascending=not descending, kind="stable", na_position="last").index
+
+    remaining = len(selected)
+    window = selected[offset:] if limit is None else selected[offset:offset + limit]
+    rows = _gather_rows(table, [int(pos) for pos in window], projected_ids)
+
+    next_cursor = None
+    if rows and offset + len(rows) < remaining:
+        if sort_column == ROW_ID_COLUMN or (sort_column is None and _ids_ascending(table)):
+            next_cursor = rows[-1]["id"]
+
+    return RowPage(rows=rows, columns=columns, total_rows=total, next_cursor=next_cursor)
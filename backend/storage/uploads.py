@@ -0,0 +1,148 @@
+"""
+Mehrteilige, fortsetzbare Uploads in den Blob-Speicher
+
+Große Dateien werden in Teilen hochgeladen (je höchstens BLOB_CHUNK_SIZE
+Bytes). Jeder Teil wird sofort als Chunk im Blob-Speicher abgelegt und in
+file_upload_parts vermerkt; ein abgebrochener Upload kann daher mit den
+fehlenden Teilen fortgesetzt werden. Beim Abschluss wird aus den Teilen das
+Manifest gebildet, ohne die Datei zusammenzusetzen.
+
+Offene Uploads ohne Aktivität verfallen nach FILE_UPLOAD_EXPIRY_HOURS.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Set
+
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import Session
+
+from models import FileUpload, FileUploadPart
+from .blobs import BlobManifest, get_blob_store
+
+UPLOAD_EXPIRY_HOURS = float(os.getenv("FILE_UPLOAD_EXPIRY_HOURS", "24"))
+
+STATUS_OPEN = "open"
+STATUS_COMPLETED = "completed"
+
+
+class UploadError(ValueError):
+    """Ungültige Operation auf einem mehrteiligen Upload"""
+    pass
+
+
+def create_upload(
+    db: Session,
+    original_name: str,
+    project_id: Optional[int] = None,
+    total_size: Optional[int] = None
+) -> FileUpload:
+    upload = FileUpload(
+        id=uuid.uuid4().hex,
+        original_name=original_name,
+        project_id=project_id,
+        total_size=total_size,
+        status=STATUS_OPEN
+    )
+    db.add(upload)
+    db.commit()
+    db.refresh(upload)
+    return upload
+
+
+def put_part(
+    db: Session,
+    upload: FileUpload,
+    part_no: int,
+    data: bytes,
+    expected_sha256: Optional[str] = None
+) -> FileUploadPart:
+    """
+    Speichert einen Teil (erneutes Hochladen ersetzt ihn)
+    expected_sha256 wird gegen den berechneten Hash geprüft.
+    """
+    if upload.status != STATUS_OPEN:
+        raise UploadError("Upload ist bereits abgeschlossen")
+    if part_no < 1:
+        raise UploadError("part_no beginnt bei 1")
+    store = get_blob_store()
+    if not data:
+        raise UploadError("Leerer Teil")
+    if len(data) > store.chunk_size:
+        raise UploadError(f"Teil ist größer als {store.chunk_size} Bytes")
+
+    digest, size = store.put_chunk(data)
+    if expected_sha256 and expected_sha256.lower() != digest:
+        raise UploadError("Prüfsumme des Teils stimmt nicht überein")
+
+    db.query(FileUploadPart).filter(
+        FileUploadPart.upload_id == upload.id,
+        FileUploadPart.part_no == part_no
+    ).delete(synchronize_session=False)
+    part = FileUploadPart(upload_id=upload.id, part_no=part_no, chunk_hash=digest, size=size)
+    db.add(part)
+    upload.updated_at = func.now()
+    db.commit()
+    db.refresh(part)
+    return part
+
+
+def complete_upload(db: Session, upload: FileUpload) -> BlobManifest:
+    """Prüft die Teile (lückenlos ab 1, angekündigte Größe) und erstellt das Manifest"""
+    parts = db.query(FileUploadPart).filter(
+        FileUploadPart.upload_id == upload.id
+    ).order_by(FileUploadPart.part_no).all()
+    if not parts:
+        raise UploadError("Keine Teile hochgeladen")
+
+    missing = sorted(set(range(1, parts[-1].part_no + 1)) - {p.part_no for p in parts})
+    if missing:
+        raise UploadError(f"Fehlende Teile: {', '.join(map(str, missing[:20]))}")
+
+    size = sum(p.size for p in parts)
+    if upload.total_size is not None and size != upload.total_size:
+        raise UploadError(f"Größe {size} Bytes entspricht nicht der angekündigten Größe {upload.total_size}")
+
+    return get_blob_store().put_chunks([(p.chunk_hash, p.size) for p in parts])
+
+
+def finish_upload(db: Session, upload: FileUpload, file_id: int) -> None:
+    """Markiert den Upload als abgeschlossen und entfernt die Teile-Liste"""
+    upload.status = STATUS_COMPLETED
+    upload.file_id = file_id
+    db.query(FileUploadPart).filter(
+        FileUploadPart.upload_id == upload.id
+    ).delete(synchronize_session=False)
+
+
+def abort_upload(db: Session, upload: FileUpload) -> None:
+    """Verwirft den Upload; die Chunks räumt die Garbage Collection auf"""
+    db.query(FileUploadPart).filter(
+        FileUploadPart.upload_id == upload.id
+    ).delete(synchronize_session=False)
+    db.delete(upload)
+    db.commit()
+
+
+def expire_uploads(db: Session) -> int:
+    """Löscht offene Uploads ohne Aktivität seit FILE_UPLOAD_EXPIRY_HOURS"""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=UPLOAD_EXPIRY_HOURS)
+    expired = db.query(FileUpload).filter(
+        FileUpload.status == STATUS_OPEN,
+        or_(
+            FileUpload.updated_at < cutoff,
+            and_(FileUpload.updated_at == None, FileUpload.created_at < cutoff)  # noqa: E711
+        )
+    ).all()
+    for upload in expired:
+        abort_upload(db, upload)
+    return len(expired)
+
+
+def open_upload_chunks(db: Session) -> Set[str]:
+    """Chunks offener Uploads (dürfen von der Garbage Collection nicht gelöscht werden)"""
+    return {
+        chunk_hash for (chunk_hash,) in db.query(FileUploadPart.chunk_hash).join(FileUpload).filter(
+            FileUpload.status == STATUS_OPEN
+        ).distinct()
+    }
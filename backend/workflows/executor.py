@@ -1,63 +1,258 @@
 """
 Workflow Executor - Führt Workflows basierend auf Graph-Definition aus
+
+Nodes, deren Vorgänger abgeschlossen sind, werden parallel in einem
+Thread-Pool ausgeführt (max_parallelism, Standard WORKFLOW_MAX_PARALLELISM).
+Jeder Thread nutzt eine eigene DB-Session. Rechenintensive Prozeduren laufen
+mit PROCEDURE_EXECUTION_BACKEND=process zusätzlich in eigenen Prozessen.
+
+Die Planung (Node-Index, Adjazenz, topologische Reihenfolge) passiert einmal
+pro Graph und wird gecacht (workflows/plan.py).
+
+Tabellen fließen als TableHandle (workflows/handles.py) ohne JSON-Umweg
+zwischen den Nodes und werden erst in Output-Nodes als DataTable gespeichert.
+
+Ergebnisse von Prozedur-Nodes werden über einen Fingerprint (Prozedur-ID/Version,
+Parameter, Input-Tabellen) im lokalen Ergebnis-Cache (workflows/result_cache.py)
+abgelegt; unveränderte Nodes werden bei erneuter Ausführung übersprungen.
+
+Das Log wird pro Node gepuffert und in topologischer Reihenfolge
+zusammengesetzt, damit es unabhängig vom Timing der Threads gleich bleibt.
 """
-from sqlalchemy.orm import Session
-from typing import Dict, Any, List
+import hashlib
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Dict, Any, List, Optional, Callable
 from models import DataTable, Procedure
-from procedures.executor import execute_procedure_code
+from .plan import ExecutionPlan, plan_cache
+from .handles import TableHandle, SharedTables
+from .result_cache import result_cache
+from procedures.executor import call_procedure
+from procedures.converter import dataframe_to_datatable
+from storage import write_rows
+from metrics import WORKFLOW_NODE_DURATION, observe_duration, node_type_label
 import json
 
+MAX_PARALLELISM = int(os.getenv("WORKFLOW_MAX_PARALLELISM", "4"))
+
+# Fehlerstrategien: beim ersten Fehler abbrechen oder unabhängige Zweige weiterführen
+ON_ERROR_FAIL_FAST = "fail_fast"
+ON_ERROR_CONTINUE = "continue"
+
+
+class WorkflowExecutionError(Exception):
+    """Mindestens ein Node ist fehlgeschlagen"""
+    pass
+
 
 class WorkflowExecutor:
-    def __init__(self, db: Session):
-        self.db = db
+    def __init__(
+        self,
+        db: Session,
+        max_parallelism: Optional[int] = None,
+        on_error: str = ON_ERROR_FAIL_FAST,
+        project_id: Optional[int] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+        use_cache: bool = True,
+        input_tables: Optional[Dict[str, int]] = None,
+        shared_tables: Optional[SharedTables] = None
+    ):
+        if on_error not in (ON_ERROR_FAIL_FAST, ON_ERROR_CONTINUE):
+            raise ValueError(f"Unknown error policy: {on_error}")
+        self._db = db
+        self.max_parallelism = max(1, max_parallelism or MAX_PARALLELISM)
+        self.on_error = on_error
+        self.project_id = project_id
+        self.use_cache = use_cache and result_cache.enabled
+        self.input_tables = input_tables or {}  # Tabellen-Node-ID → Tabellen-ID (Input-Mapping)
+        self.shared_tables = shared_tables
+        self.session_factory = session_factory or sessionmaker(
+            autocommit=False, autoflush=False, bind=db.get_bind()
+        )
         self.node_outputs = {}  # Speichert Outputs von Nodes
+        self.node_errors = {}  # node_id → Fehlermeldung
+        self.cache_hits = []  # Prozedur-Nodes aus dem Ergebnis-Cache
+        self.recomputed = []  # Prozedur-Nodes, die neu berechnet wurden
         self.execution_log = []
-        self.graph_nodes = []  # Speichert Node-Definitionen
+        self.plan: Optional[ExecutionPlan] = None
+        self._local = threading.local()
+    
+    @property
+    def db(self) -> Session:
+        """Session des aktuellen Threads (im Pool eigene Session pro Node)"""
+        return getattr(self._local, "db", None) or self._db
         
-    def execute(self, graph: dict, input_params: dict) -> dict:
+    def execute(self, graph: dict, input_params: dict, plan: Optional[ExecutionPlan] = None) -> dict:
         """
         Führt einen Workflow aus
         
         Args:
             graph: Graph-Definition mit nodes und edges
             input_params: Initiale Parameter
+            plan: Bereits erstellter Plan des Graphen (sonst aus dem Plan-Cache)
             
         Returns:
-            dict mit output und log
+            dict mit output, log und errors (node_id → Fehlermeldung)
         """
-        nodes = graph.get("nodes", [])
-        edges = graph.get("edges", [])
-        
-        # Speichere Nodes für späteren Zugriff
-        self.graph_nodes = nodes
-        
-        # Topologische Sortierung für Ausführungsreihenfolge
-        execution_order = self._topological_sort(nodes, edges)
+        # Ausführungsplan (gecacht pro Graph-Hash)
+        self.plan = plan or plan_cache.get(graph)
+        execution_order = self.plan.order
         
         # Initiale Parameter setzen
         self.node_outputs["__input__"] = input_params
         
-        # Nodes in Reihenfolge ausführen
+        try:
+            node_logs = self._schedule(self.plan)
+        finally:
+            # Übrige Zwischenergebnisse freigeben (z.B. hinter übersprungenen Nodes)
+            for value in self.node_outputs.values():
+                if isinstance(value, TableHandle):
+                    value.close()
+        
+        # Log deterministisch in topologischer Reihenfolge zusammensetzen
         for node_id in execution_order:
-            node = next((n for n in nodes if n["id"] == node_id), None)
-            if node:
-                self._execute_node(node, edges)
+            self.execution_log.extend(node_logs.get(node_id, []))
+        
+        if self.cache_hits or self.recomputed:
+            self._log(
+                f"Result cache: {len(self.cache_hits)} hit(s), {len(self.recomputed)} recomputed"
+            )
+        
+        # Fehler ebenfalls in topologischer Reihenfolge
+        self.node_errors = {n: self.node_errors[n] for n in execution_order if n in self.node_errors}
+        
+        if self.node_errors and self.on_error == ON_ERROR_FAIL_FAST:
+            first_failed = next(iter(self.node_errors))
+            raise WorkflowExecutionError(f"Node {first_failed} failed: {self.node_errors[first_failed]}")
         
         # Output sammeln
-        output_nodes = [n for n in nodes if n.get("type") == "output"]
         output = {}
-        for out_node in output_nodes:
-            node_id = out_node["id"]
+        for node_id in self.plan.output_nodes:
             if node_id in self.node_outputs:
-                output[node_id] = self.node_outputs[node_id]
+                output[node_id] = self._describe(self.node_outputs[node_id])
         
         return {
             "output": output,
-            "log": self.execution_log
+            "log": self.execution_log,
+            "errors": self.node_errors,
+            "cache": {
+                "hits": sorted(self.cache_hits, key=self.plan.position.get),
+                "recomputed": sorted(self.recomputed, key=self.plan.position.get)
+            }
         }
     
-    def _execute_node(self, node: dict, edges: List[dict]):
+    def _schedule(self, plan: ExecutionPlan) -> Dict[str, list]:
+        """
+        Führt jeden Node aus, sobald alle Vorgänger fertig sind
+        Bereite Nodes werden in topologischer Reihenfolge vergeben.
+        
+        Returns:
+            Log-Einträge pro Node
+        """
+        execution_order = plan.order
+        position = plan.position
+        successors = plan.successors
+        pending = dict(plan.in_degree)
+        
+        ready = [position[node_id] for node_id, count in pending.items() if count == 0]
+        heapq.heapify(ready)
+        node_logs: Dict[str, list] = {}
+        skipped = set()
+        stop = False
+        
+        def finish(node_id: str) -> None:
+            self._release_inputs(node_id)
+            for successor in successors[node_id]:
+                pending[successor] -= 1
+                if pending[successor] == 0 and successor not in skipped:
+                    heapq.heappush(ready, position[successor])
+        
+        def fail(node_id: str, error: Exception) -> None:
+            nonlocal stop
+            self._release_inputs(node_id)
+            self.node_errors[node_id] = str(error)
+            if self.on_error == ON_ERROR_FAIL_FAST:
+                stop = True
+                return
+            # Alle Nachfolger überspringen, unabhängige Zweige laufen weiter
+            stack = list(successors[node_id])
+            while stack:
+                successor = stack.pop()
+                if successor not in skipped:
+                    skipped.add(successor)
+                    node_logs[successor] = [{
+                        "level": "warning",
+                        "message": f"Node {successor} skipped (upstream node {node_id} failed)"
+                    }]
+                    stack.extend(successors[successor])
+        
+        # Sequentiell im aufrufenden Thread mit der übergebenen Session
+        if self.max_parallelism == 1:
+            while ready and not stop:
+                node_id = execution_order[heapq.heappop(ready)]
+                result, logs, error = self._run_node(plan.nodes[node_id], own_session=False)
+                node_logs[node_id] = logs
+                if error is None:
+                    self.node_outputs[node_id] = result
+                    finish(node_id)
+                else:
+                    fail(node_id, error)
+            return node_logs
+        
+        with ThreadPoolExecutor(max_workers=self.max_parallelism, thread_name_prefix="workflow-node") as pool:
+            running = {}
+            while True:
+                while ready and not stop and len(running) < self.max_parallelism:
+                    node_id = execution_order[heapq.heappop(ready)]
+                    running[pool.submit(self._run_node, plan.nodes[node_id], True)] = node_id
+                if not running:
+                    break
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=lambda f: position[running[f]]):
+                    node_id = running.pop(future)
+                    result, logs, error = future.result()
+                    node_logs[node_id] = logs
+                    if error is None:
+                        self.node_outputs[node_id] = result
+                        finish(node_id)
+                    else:
+                        fail(node_id, error)
+        
+        return node_logs
+    
+    def _release_inputs(self, node_id: str) -> None:
+        """Node ist fertig: Zwischenergebnisse, deren letzter Konsument er war, freigeben"""
+        for edge in self.plan.incoming.get(node_id, []):
+            value = self.node_outputs.get(edge["source"])
+            if isinstance(value, TableHandle):
+                value.release()
+    
+    def _run_node(self, node: dict, own_session: bool):
+        """
+        Führt einen Node aus und puffert dessen Log
+        
+        Returns:
+            (Ergebnis, Log-Einträge, Fehler oder None)
+        """
+        self._local.log = []
+        if own_session:
+            self._local.db = self.session_factory()
+        try:
+            result = self._execute_node(node)
+            return result, self._local.log, None
+        except Exception as e:
+            return None, self._local.log, e
+        finally:
+            if own_session:
+                self._local.db.close()
+                self._local.db = None
+            self._local.log = None
+    
+    def _execute_node(self, node: dict) -> Any:
         """Führt einen einzelnen Node aus"""
         node_id = node["id"]
         node_type = node["type"]
@@ -66,29 +261,33 @@ class WorkflowExecutor:
         self._log(f"Executing node {node_id} (type: {node_type})")
         
         try:
-            if node_type == "table":
-                result = self._execute_table_node(node_data)
-            elif node_type == "procedure":
-                result = self._execute_procedure_node(node_data, node_id, edges)
-            elif node_type == "value":
-                result = self._execute_value_node(node_data)
-            elif node_type == "api":
-                result = self._execute_api_node(node_data, node_id, edges)
-            elif node_type == "output":
-                result = self._execute_output_node(node_id, edges)
-            else:
-                raise ValueError(f"Unknown node type: {node_type}")
+            with observe_duration(WORKFLOW_NODE_DURATION, node_type=node_type_label(node_type)):
+                if node_type == "table":
+                    result = self._execute_table_node(node_data, node_id)
+                elif node_type == "procedure":
+                    result = self._execute_procedure_node(node_data, node_id)
+                elif node_type == "value":
+                    result = self._execute_value_node(node_data)
+                elif node_type == "api":
+                    result = self._execute_api_node(node_data, node_id)
+                elif node_type == "output":
+                    result = self._execute_output_node(node_id)
+                else:
+                    raise ValueError(f"Unknown node type: {node_type}")
             
-            self.node_outputs[node_id] = result
             self._log(f"Node {node_id} completed successfully")
+            return result
             
         except Exception as e:
             self._log(f"Node {node_id} failed: {str(e)}", level="error")
             raise
     
-    def _execute_table_node(self, data: dict) -> dict:
-        """Lädt eine Tabelle"""
-        table_id = data.get("tableId")
+    def _consumers(self, node_id: str) -> int:
+        return len(self.plan.successors.get(node_id, []))
+    
+    def _execute_table_node(self, data: dict, node_id: str) -> TableHandle:
+        """Referenz auf eine Tabelle (Daten werden erst beim ersten Zugriff geladen)"""
+        table_id = self.input_tables.get(node_id) or data.get("tableId")
         if not table_id:
             raise ValueError("Table node requires tableId")
         
@@ -96,15 +295,9 @@ class WorkflowExecutor:
         if not table:
             raise ValueError(f"Table {table_id} not found")
         
-        return {
-            "type": "table",
-            "id": table.id,
-            "name": table.name,
-            "columns": table.columns,
-            "data": table.data
-        }
+        return TableHandle.for_table(table, self._consumers(node_id), shared=self.shared_tables)
     
-    def _execute_procedure_node(self, data: dict, node_id: str, edges: List[dict]) -> dict:
+    def _execute_procedure_node(self, data: dict, node_id: str) -> TableHandle:
         """Führt eine Prozedur aus"""
         procedure_id = data.get("procedureId")
         if not procedure_id:
@@ -115,17 +308,73 @@ class WorkflowExecutor:
             raise ValueError(f"Procedure {procedure_id} not found")
         
         # Input-Parameter sammeln
-        params = self._collect_node_inputs(node_id, edges, data.get("parameterMapping", {}))
+        inputs = self._collect_node_inputs(node_id, data.get("parameterMapping", {}))
+        name = f"{procedure.name}_v{procedure.version}"
         
-        # Prozedur ausführen
-        result = execute_procedure_code(procedure.code, params, self.db)
+        # Unveränderte Inputs → Ergebnis aus dem Cache
+        fingerprint = self._fingerprint(procedure, inputs) if self.use_cache else None
+        if fingerprint is not None:
+            cached = result_cache.get(fingerprint)
+            if cached is not None:
+                self.cache_hits.append(node_id)
+                self._log(f"Node {node_id} cache hit (fingerprint {fingerprint[:12]})")
+                return TableHandle(name, self._consumers(node_id), frame=cached, fingerprint=fingerprint)
         
-        return {
-            "type": "procedure_result",
-            "procedure_id": procedure.id,
-            "procedure_name": procedure.name,
-            "result": result
-        }
+        params = {param: self._procedure_param(value) for param, value in inputs.items()}
+        
+        # Prozedur ausführen, Ergebnis bleibt als DataFrame im Speicher
+        try:
+            result = call_procedure(procedure, params, self.db)
+        except Exception as e:
+            raise ValueError(f"Procedure {procedure.name} failed: {e}")
+        
+        self.recomputed.append(node_id)
+        if fingerprint is not None:
+            # Vor der Weitergabe speichern, Konsumenten dürfen den DataFrame verändern
+            result_cache.put(fingerprint, result)
+            self._log(f"Node {node_id} recomputed (fingerprint {fingerprint[:12]})")
+        
+        return TableHandle(name, self._consumers(node_id), frame=result, fingerprint=fingerprint)
+    
+    @staticmethod
+    def _fingerprint(procedure: Procedure, inputs: dict) -> Optional[str]:
+        """
+        Hash aus Prozedur-ID/Version, Parameterwerten und Input-Fingerprints
+        None, wenn ein Input keinen stabilen Fingerprint hat.
+        """
+        params = {}
+        for param, value in inputs.items():
+            if isinstance(value, TableHandle):
+                if value.fingerprint is None:
+                    return None
+                params[param] = {"table": value.fingerprint}
+            elif isinstance(value, dict) and value.get("type") == "value":
+                params[param] = {"value": value.get("value")}
+            else:
+                params[param] = {"value": value}
+        
+        payload = json.dumps(
+            {"procedure": [procedure.id, procedure.version], "params": params},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _procedure_param(self, value: Any) -> Any:
+        """Node-Output → Prozedur-Parameter (Tabellen als DataFrame, Werte direkt)"""
+        if isinstance(value, TableHandle):
+            return value.take(self.db)
+        if isinstance(value, dict) and value.get("type") == "value":
+            return value.get("value")
+        return value
+    
+    def _describe(self, value: Any) -> Any:
+        """Ersetzt Zwischenergebnisse durch JSON-taugliche Beschreibungen"""
+        if isinstance(value, TableHandle):
+            return value.describe()
+        if isinstance(value, dict):
+            return {key: self._describe(item) for key, item in value.items()}
+        return value
     
     def _execute_value_node(self, data: dict) -> Any:
         """Gibt einen statischen Wert zurück"""
@@ -135,7 +384,7 @@ class WorkflowExecutor:
             "valueType": data.get("valueType", "string")
         }
     
-    def _execute_api_node(self, data: dict, node_id: str, edges: List[dict]) -> dict:
+    def _execute_api_node(self, data: dict, node_id: str) -> dict:
         """
         Führt einen API-Call aus (Platzhalter für zukünftige Implementierung)
         """
@@ -151,7 +400,7 @@ class WorkflowExecutor:
         method = data.get("method", "GET")
         
         # Input-Parameter sammeln
-        params = self._collect_node_inputs(node_id, edges, data.get("parameterMapping", {}))
+        params = self._collect_node_inputs(node_id, data.get("parameterMapping", {}))
         
         self._log(f"API call placeholder: {method} {endpoint}", level="warning")
         
@@ -164,12 +413,12 @@ class WorkflowExecutor:
             "message": "API calls will be implemented in future version"
         }
     
-    def _execute_output_node(self, node_id: str, edges: List[dict]) -> dict:
+    def _execute_output_node(self, node_id: str) -> dict:
         """Sammelt Outputs für finale Ausgabe und führt Aktion aus"""
-        inputs = self._collect_node_inputs(node_id, edges, {})
+        inputs = self._collect_node_inputs(node_id, {})
         
-        # Hole Node-Daten aus dem Graph
-        node = next((n for n in self.graph_nodes if n["id"] == node_id), None)
+        # Hole Node-Daten aus dem Plan
+        node = self.plan.nodes.get(node_id)
         if not node:
             return inputs
         
@@ -191,34 +440,19 @@ class WorkflowExecutor:
         from models import DataTable
         
         # Hole das Input-Ergebnis
-        input_data = inputs.get("input", {})
-        
-        # Wenn es ein Prozedur-Ergebnis ist, extrahiere die Tabelle
-        if isinstance(input_data, dict) and input_data.get("type") == "procedure_result":
-            result = input_data.get("result", {})
-            if isinstance(result, dict) and "columns" in result and "data" in result:
-                table_data = result
-            else:
-                # Fallback: Erstelle einfache Tabelle
-                table_data = {"columns": [], "data": []}
-        elif isinstance(input_data, dict) and input_data.get("type") == "table":
-            table_data = {"columns": input_data.get("columns", []), "data": input_data.get("data", [])}
-        else:
-            # Fallback
-            table_data = {"columns": [], "data": []}
+        input_data = inputs.get("input")
         
-        # Erstelle neue Tabelle
         name = node_data.get("name", "workflow_result")
         project_id = node_data.get("project") or None
+        project_id = int(project_id) if project_id else None
         
-        new_table = DataTable(
-            name=name,
-            project_id=int(project_id) if project_id else None,
-            columns=table_data.get("columns", []),
-            data=table_data.get("data", []),
-            row_count=len(table_data.get("data", [])),
-            column_count=len(table_data.get("columns", []))
-        )
+        # Zwischenergebnis erst hier als DataTable materialisieren
+        if isinstance(input_data, TableHandle):
+            new_table = dataframe_to_datatable(input_data.take(self.db), name, project_id)
+        else:
+            # Fallback: leere Tabelle
+            new_table = DataTable(name=name, project_id=project_id)
+            write_rows(new_table, [], [])
         
         self.db.add(new_table)
         self.db.commit()
@@ -230,7 +464,7 @@ class WorkflowExecutor:
             "action": "save_table",
             "table_id": new_table.id,
             "table_name": name,
-            "data": inputs
+            "data": self._describe(inputs)
         }
     
     def _execute_display_action(self, inputs: dict, node_data: dict) -> dict:
@@ -242,7 +476,7 @@ class WorkflowExecutor:
         return {
             "action": "display",
             "name": name,
-            "data": inputs,
+            "data": self._describe(inputs),
             "status": "not_implemented"
         }
     
@@ -255,18 +489,16 @@ class WorkflowExecutor:
         return {
             "action": action,
             "filename": filename,
-            "data": inputs,
+            "data": self._describe(inputs),
             "status": "not_implemented"
         }
     
-    def _collect_node_inputs(self, node_id: str, edges: List[dict], param_mapping: dict) -> dict:
+    def _collect_node_inputs(self, node_id: str, param_mapping: dict) -> dict:
         """Sammelt alle Inputs für einen Node basierend auf Edges"""
         inputs = {}
         
-        # Finde alle eingehenden Edges
-        incoming_edges = [e for e in edges if e["target"] == node_id]
-        
-        for edge in incoming_edges:
+        # Eingehende Edges aus dem Plan
+        for edge in self.plan.incoming.get(node_id, []):
             source_id = edge["source"]
             target_handle = edge.get("targetHandle", "default")
             
@@ -282,43 +514,14 @@ class WorkflowExecutor:
         
         return inputs
     
-    def _topological_sort(self, nodes: List[dict], edges: List[dict]) -> List[str]:
-        """
-        Topologische Sortierung für Ausführungsreihenfolge
-        """
-        # Adjacency List erstellen
-        graph = {node["id"]: [] for node in nodes}
-        in_degree = {node["id"]: 0 for node in nodes}
-        
-        for edge in edges:
-            source = edge["source"]
-            target = edge["target"]
-            if source in graph and target in graph:
-                graph[source].append(target)
-                in_degree[target] += 1
-        
-        # Nodes ohne eingehende Edges finden
-        queue = [node_id for node_id, degree in in_degree.items() if degree == 0]
-        result = []
-        
-        while queue:
-            node_id = queue.pop(0)
-            result.append(node_id)
-            
-            for neighbor in graph[node_id]:
-                in_degree[neighbor] -= 1
-                if in_degree[neighbor] == 0:
-                    queue.append(neighbor)
-        
-        # Zyklus-Check
-        if len(result) != len(nodes):
-            raise ValueError("Workflow contains cycles")
-        
-        return result
-    
     def _log(self, message: str, level: str = "info"):
-        """Fügt einen Log-Eintrag hinzu"""
-        self.execution_log.append({
+        """Fügt einen Log-Eintrag hinzu (während eines Nodes in dessen Puffer)"""
+        entry = {
             "level": level,
             "message": message
-        })
+        }
+        buffer = getattr(self._local, "log", None)
+        if buffer is not None:
+            buffer.append(entry)
+        else:
+            self.execution_log.append(entry)
@@ -0,0 +1,153 @@
+"""
+Zwischenergebnisse zwischen Workflow-Nodes
+
+Tabellen fließen als TableHandle durch den Graph: ein DataFrame, der erst beim
+ersten Zugriff geladen wird (Tabellen-Node) bzw. direkt aus einer Prozedur
+stammt. Erst Output-Nodes schreiben ihn wieder als DataTable. Jeder Handle
+kennt die Anzahl seiner Konsumenten und gibt den DataFrame frei, sobald der
+letzte fertig ist.
+
+Mehrere Ausführungen (z.B. alle Workflow-Instanzen eines Zyklus) können sich
+über SharedTables gemeinsame Eingabe-Tabellen teilen; sie werden dann nur
+einmal geladen und konvertiert.
+"""
+import threading
+from typing import Callable, Dict, Iterable, Optional
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from models import DataTable
+from procedures.converter import datatable_to_dataframe
+
+
+class SharedTables:
+    """Einmal geladene Eingabe-Tabellen für mehrere Workflow-Ausführungen (nur lesen)"""
+
+    def __init__(self, table_ids: Iterable[int]):
+        self._locks: Dict[int, threading.Lock] = {table_id: threading.Lock() for table_id in table_ids}
+        self._frames: Dict[int, pd.DataFrame] = {}
+        self._stats_lock = threading.Lock()
+        self.loads = 0
+        self.reuses = 0
+
+    def __contains__(self, table_id: Optional[int]) -> bool:
+        return table_id in self._locks
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def get(self, table_id: int, db: Session) -> pd.DataFrame:
+        """Geteilter DataFrame; Aufrufer dürfen ihn nicht verändern"""
+        with self._locks[table_id]:
+            frame = self._frames.get(table_id)
+            loaded = frame is None
+            if loaded:
+                table = db.query(DataTable).filter(DataTable.id == table_id).first()
+                if table is None:
+                    raise ValueError(f"Table {table_id} not found")
+                frame = datatable_to_dataframe(table)
+                self._frames[table_id] = frame
+        with self._stats_lock:
+            if loaded:
+                self.loads += 1
+            else:
+                self.reuses += 1
+        return frame
+
+    def clear(self) -> None:
+        self._frames.clear()
+
+
+class TableHandle:
+    """Lazy geladener DataFrame mit Referenzzählung über die Konsumenten"""
+
+    def __init__(
+        self,
+        name: str,
+        consumers: int,
+        frame: Optional[pd.DataFrame] = None,
+        table_id: Optional[int] = None,
+        fingerprint: Optional[str] = None,
+        shared: Optional[SharedTables] = None
+    ):
+        self.name = name
+        self.table_id = table_id
+        self.fingerprint = fingerprint  # Inhalts-Fingerprint für den Ergebnis-Cache
+        self.consumers = consumers
+        self.rows: Optional[int] = None
+        self.columns: Optional[int] = None
+        self._frame = None
+        self._released = False
+        self._lock = threading.Lock()
+        self._shared = shared
+        self._borrowed = False  # DataFrame gehört SharedTables
+        if frame is not None:
+            self._set_frame(frame)
+
+    @classmethod
+    def for_table(cls, table: DataTable, consumers: int, shared: Optional[SharedTables] = None) -> "TableHandle":
+        handle = cls(
+            table.name,
+            consumers,
+            table_id=table.id,
+            fingerprint=f"table:{table.id}:v{table.version}",
+            shared=shared
+        )
+        handle.rows = table.row_count
+        handle.columns = table.column_count
+        return handle
+
+    def _set_frame(self, frame: pd.DataFrame) -> None:
+        self._frame = frame
+        self.rows = len(frame)
+        self.columns = len(frame.columns)
+
+    def take(self, db: Session) -> pd.DataFrame:
+        """
+        DataFrame für einen Konsumenten
+        Solange weitere Konsumenten folgen, wird eine Kopie geliefert, damit
+        Änderungen einer Prozedur nicht bei den anderen ankommen. Geteilte
+        Tabellen (SharedTables) werden immer kopiert.
+        """
+        with self._lock:
+            if self._released:
+                raise RuntimeError(f"Zwischenergebnis '{self.name}' wurde bereits freigegeben")
+            if self._frame is None:
+                if self._shared is not None and self.table_id in self._shared:
+                    self._set_frame(self._shared.get(self.table_id, db))
+                    self._borrowed = True
+                else:
+                    table = db.query(DataTable).filter(DataTable.id == self.table_id).first()
+                    if table is None:
+                        raise ValueError(f"Table {self.table_id} not found")
+                    self._set_frame(datatable_to_dataframe(table))
+            if self.consumers <= 1 and not self._borrowed:
+                return self._frame
+            return self._frame.copy()
+
+    def release(self) -> bool:
+        """Ein Konsument ist fertig; gibt True zurück, wenn der DataFrame freigegeben wurde"""
+        with self._lock:
+            self.consumers -= 1
+            if self.consumers <= 0 and not self._released:
+                self._frame = None
+                self._released = True
+                return True
+            return False
+
+    def close(self) -> None:
+        with self._lock:
+            self._frame = None
+            self._released = True
+
+    @property
+    def loaded(self) -> bool:
+        return self._frame is not None
+
+    def describe(self) -> dict:
+        """JSON-taugliche Beschreibung für Logs und Workflow-Output"""
+        description = {"type": "table", "name": self.name, "rows": self.rows, "columns": self.columns}
+        if self.table_id is not None:
+            description["id"] = self.table_id
+        return description
@@ -0,0 +1,127 @@
+"""
+Kompilierter Ausführungsplan für Workflow-Graphen
+
+Einmalig pro Graph: Node-Index, eingehende Edges und Nachfolger je Node sowie
+die topologische Reihenfolge (Kahn-Algorithmus mit deque). Pläne werden pro
+Hash des Graphen gecacht, wiederholte Ausführungen überspringen die Planung.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Dict, List
+
+
+@dataclass(frozen=True)
+class ExecutionPlan:
+    graph_hash: str
+    order: List[str]  # topologische Reihenfolge
+    position: Dict[str, int]  # node_id → Index in order
+    nodes: Dict[str, dict]  # node_id → Node-Definition
+    incoming: Dict[str, List[dict]]  # node_id → eingehende Edges
+    successors: Dict[str, List[str]]  # node_id → Ziel-Nodes
+    in_degree: Dict[str, int]
+    output_nodes: List[str]
+
+
+def graph_hash(graph: dict) -> str:
+    """Stabiler Hash der Graph-Definition (unabhängig von der Schlüssel-Reihenfolge)"""
+    payload = json.dumps(
+        {"nodes": graph.get("nodes", []), "edges": graph.get("edges", [])},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def compile_plan(graph: dict, digest: str = None) -> ExecutionPlan:
+    """Erstellt den Ausführungsplan; wirft ValueError bei Zyklen"""
+    nodes = graph.get("nodes", [])
+    edges = graph.get("edges", [])
+
+    index = {node["id"]: node for node in nodes}
+    incoming = {node_id: [] for node_id in index}
+    successors = {node_id: [] for node_id in index}
+    in_degree = {node_id: 0 for node_id in index}
+
+    for edge in edges:
+        source, target = edge["source"], edge["target"]
+        if target in incoming:
+            incoming[target].append(edge)
+        if source in successors and target in in_degree:
+            successors[source].append(target)
+            in_degree[target] += 1
+
+    # Kahn-Algorithmus
+    remaining = dict(in_degree)
+    queue = deque(node_id for node_id, degree in remaining.items() if degree == 0)
+    order = []
+    while queue:
+        node_id = queue.popleft()
+        order.append(node_id)
+        for successor in successors[node_id]:
+            remaining[successor] -= 1
+            if remaining[successor] == 0:
+                queue.append(successor)
+
+    if len(order) != len(index):
+        raise ValueError("Workflow contains cycles")
+
+    return ExecutionPlan(
+        graph_hash=digest or graph_hash(graph),
+        order=order,
+        position={node_id: i for i, node_id in enumerate(order)},
+        nodes=index,
+        incoming=incoming,
+        successors=successors,
+        in_degree=in_degree,
+        output_nodes=[node_id for node_id in order if index[node_id].get("type") == "output"]
+    )
+
+
+class PlanCache:
+    """Thread-sicherer LRU-Cache für Ausführungspläne (Schlüssel: Graph-Hash)"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, ExecutionPlan]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, graph: dict) -> ExecutionPlan:
+        digest = graph_hash(graph)
+        with self._lock:
+            plan = self._entries.get(digest)
+            if plan is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        plan = compile_plan(graph, digest)
+
+        with self._lock:
+            self._entries[digest] = plan
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return plan
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+plan_cache = PlanCache(int(os.getenv("WORKFLOW_PLAN_CACHE_SIZE", "256")))
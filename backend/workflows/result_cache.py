@@ -0,0 +1,148 @@
+"""
+Lokaler Cache für Ergebnisse von Prozedur-Nodes
+
+Schlüssel ist der Fingerprint eines Nodes (Prozedur-ID/Version, Parameterwerte,
+Fingerprints der Input-Tabellen). Ergebnisse liegen als Arrow IPC (bzw. pickle
+bei nicht konvertierbaren Spalten) im Verzeichnis WORKFLOW_RESULT_CACHE_DIR.
+Überschreitet der Cache WORKFLOW_RESULT_CACHE_MB, werden die am längsten nicht
+genutzten Einträge gelöscht.
+"""
+import logging
+import os
+import tempfile
+import threading
+from typing import Optional
+
+import pandas as pd
+
+from procedures.pool import dataframe_to_ipc, dataframe_from_ipc
+
+logger = logging.getLogger(__name__)
+
+_EXTENSIONS = {"arrow": ".arrow", "pickle": ".pickle"}
+
+
+class ResultCache:
+    """Inhaltsadressierter Datei-Cache mit LRU-Verdrängung nach Größe"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.directory, key[:2], key + _EXTENSIONS[fmt])
+
+    def _entries(self):
+        """(Pfad, Größe, letzte Nutzung) aller Einträge"""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(tuple(_EXTENSIONS.values())):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        if not self.enabled:
+            return None
+        for fmt in _EXTENSIONS:
+            path = self._path(key, fmt)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            try:
+                frame = dataframe_from_ipc((fmt, data))
+            except Exception:
+                logger.warning("Beschädigter Cache-Eintrag %s wird verworfen", path, exc_info=True)
+                self._remove(path)
+                break
+            os.utime(path)  # letzte Nutzung für die LRU-Verdrängung
+            with self._lock:
+                self.hits += 1
+            return frame
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, frame: pd.DataFrame) -> None:
+        if not self.enabled:
+            return
+        fmt, data = dataframe_to_ipc(frame)
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Atomar schreiben, parallele Leser sehen nie halbe Dateien
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        existed = os.path.exists(path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            elif not existed:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _remove(self, path: str) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+    def _evict(self) -> None:
+        """Älteste Einträge löschen, bis der Cache wieder unter dem Limit liegt (Lock gehalten)"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            total -= self._remove(path)
+        self._total_bytes = total
+
+    def clear(self) -> None:
+        with self._lock:
+            for path, _, _ in self._entries():
+                self._remove(path)
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            return {
+                "directory": self.directory,
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+result_cache = ResultCache(
+    os.getenv("WORKFLOW_RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "workflow-result-cache")),
+    int(float(os.getenv("WORKFLOW_RESULT_CACHE_MB", "1024")) * 1024 * 1024)
+)
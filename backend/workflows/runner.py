@@ -0,0 +1,529 @@
+"""
+Zyklus- und Backfill-Läufe für Workflow-Instanzen
+
+Statt jede Instanz einzeln auszuführen, werden mehrere Instanzen gemeinsam
+gestartet:
+- Zyklus-Lauf: alle aktiven Instanzen eines Zyklus (z.B. Jahresabschluss)
+- Backfill: ein Workflow über alle Zyklen seiner Instanzen (optional je Projekt)
+
+Die Instanzen laufen parallel (max_parallelism, Standard
+WORKFLOW_RUNNER_PARALLELISM), jede mit eigener Session. Ausführungspläne werden
+pro Workflow nur einmal erstellt, Eingabe-Tabellen, die mehrere Instanzen
+lesen, nur einmal geladen (SharedTables). Für jede Instanz entsteht eine
+WorkflowExecution mit cycle_id; der Lauf liefert einen zusammenfassenden Bericht.
+
+Hintergrund-Läufe leben nur im Prozess. Ein Wartungs-Thread schreibt für die
+Ausführungen dieses Prozesses einen Heartbeat und markiert wartende oder
+laufende Ausführungen ohne Heartbeat (Prozess beendet) als fehlgeschlagen;
+Zeitpläne, deren letzter Lauf dadurch endet, erhalten den neuen Status.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import SessionLocal
+from models import Workflow, WorkflowExecution, WorkflowInstance, WorkflowSchedule, ProjectCycle
+from .executor import WorkflowExecutor, ON_ERROR_FAIL_FAST
+from .handles import SharedTables
+from .plan import ExecutionPlan, plan_cache
+
+logger = logging.getLogger(__name__)
+
+RUNNER_PARALLELISM = int(os.getenv("WORKFLOW_RUNNER_PARALLELISM", "2"))
+RUNNER_WORKERS = int(os.getenv("WORKFLOW_RUNNER_WORKERS", "1"))  # Hintergrund-Läufe gleichzeitig
+RUNNER_HEARTBEAT_INTERVAL = float(os.getenv("WORKFLOW_RUNNER_HEARTBEAT_INTERVAL", "15"))
+RUNNER_STALE_SECONDS = float(os.getenv("WORKFLOW_RUNNER_STALE_SECONDS", "120"))
+
+MODE_CYCLE = "cycle"
+MODE_BACKFILL = "backfill"
+
+ACTIVE_STATUSES = ("pending", "running")
+
+
+class WorkflowRunError(ValueError):
+    """Lauf kann nicht gestartet werden (keine Instanzen, unbekannter Zyklus)"""
+    pass
+
+
+@dataclass
+class InstanceRun:
+    instance_id: int
+    workflow_id: int
+    workflow_name: str
+    cycle_id: int
+    cycle_name: Optional[str]
+    status: str = "pending"
+    execution_id: Optional[int] = None
+    error_message: Optional[str] = None
+    execution_time: Optional[float] = None
+    output_tables: List[int] = field(default_factory=list)
+
+
+@dataclass
+class RunReport:
+    mode: str
+    runs: List[InstanceRun]
+    execution_time: Optional[float] = None
+    shared_tables: int = 0  # Tabellen, die mehrere Instanzen lesen
+    table_loads: int = 0
+    table_reuses: int = 0
+    plans: int = 0  # erstellte Ausführungspläne (einer pro Workflow)
+
+    @property
+    def total(self) -> int:
+        return len(self.runs)
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for run in self.runs if run.status == "completed")
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for run in self.runs if run.status == "failed")
+
+    @property
+    def status(self) -> str:
+        statuses = {run.status for run in self.runs}
+        if statuses & {"pending", "running"}:
+            return "running"
+        if statuses == {"completed"}:
+            return "completed"
+        if statuses == {"failed"}:
+            return "failed"
+        return "completed_with_errors"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# --- Eigene Ausführungen ------------------------------------------------------
+
+_owned: Set[int] = set()  # Ausführungen, die dieser Prozess eingeplant hat oder ausführt
+_owned_lock = threading.Lock()
+
+
+def claim_executions(execution_ids: Iterable[int]) -> None:
+    """Ausführungen diesem Prozess zuordnen (Heartbeat bis release_executions)"""
+    with _owned_lock:
+        _owned.update(execution_ids)
+
+
+def release_executions(execution_ids: Iterable[int]) -> None:
+    with _owned_lock:
+        _owned.difference_update(execution_ids)
+
+
+@contextmanager
+def owned_execution(execution_id: int):
+    """Hält den Heartbeat einer Ausführung, während der Block läuft"""
+    claim_executions([execution_id])
+    try:
+        yield
+    finally:
+        release_executions([execution_id])
+
+
+def record_execution(execution: WorkflowExecution, executor: Optional[WorkflowExecutor],
+                     result: Optional[dict], error: Optional[Exception], start_time: float) -> None:
+    """Überträgt das Ergebnis einer Workflow-Ausführung in den Execution Record"""
+    execution.execution_time = time.time() - start_time
+    if error is not None:
+        execution.status = "failed"
+        execution.error_message = str(error)
+        if executor is not None:
+            execution.execution_log = executor.execution_log
+        return
+    execution.output_data = result["output"]
+    execution.execution_log = result["log"]
+    if result["errors"]:
+        # on_error='continue': unabhängige Zweige wurden trotzdem ausgeführt
+        execution.status = "completed_with_errors"
+        execution.error_message = "; ".join(
+            f"{node_id}: {message}" for node_id, message in result["errors"].items()
+        )
+    else:
+        execution.status = "completed"
+
+
+def cycle_instances(db: Session, cycle_id: int) -> List[WorkflowInstance]:
+    """Aktive Instanzen aktiver Workflows eines Zyklus"""
+    if db.query(ProjectCycle.id).filter(ProjectCycle.id == cycle_id).first() is None:
+        raise WorkflowRunError(f"Zyklus {cycle_id} nicht gefunden")
+    return db.query(WorkflowInstance).join(Workflow, Workflow.id == WorkflowInstance.workflow_id).filter(
+        WorkflowInstance.cycle_id == cycle_id,
+        WorkflowInstance.is_active.is_(True),
+        Workflow.is_active.is_(True)
+    ).order_by(WorkflowInstance.workflow_id).all()
+
+
+def backfill_instances(db: Session, workflow_id: int, project_id: Optional[int] = None) -> List[WorkflowInstance]:
+    """Aktive Instanzen eines Workflows über alle Zyklen (ältester Zyklus zuerst)"""
+    query = db.query(WorkflowInstance).join(ProjectCycle, ProjectCycle.id == WorkflowInstance.cycle_id).filter(
+        WorkflowInstance.workflow_id == workflow_id,
+        WorkflowInstance.is_active.is_(True)
+    )
+    if project_id is not None:
+        query = query.filter(ProjectCycle.project_id == project_id)
+    return query.order_by(ProjectCycle.created_at, ProjectCycle.id).all()
+
+
+def _input_tables(instance: WorkflowInstance) -> Dict[str, int]:
+    """Input-Mapping der Instanz (Tabellen-Node-ID → Tabellen-ID)"""
+    tables = {}
+    for node_id, table_id in (instance.input_mapping or {}).items():
+        if table_id in (None, ""):
+            continue
+        tables[node_id] = int(table_id)
+    return tables
+
+
+def _graph_tables(graph: dict, input_tables: Dict[str, int]) -> List[int]:
+    """Tabellen, die die Tabellen-Nodes eines Graphs mit diesem Mapping lesen"""
+    table_ids = []
+    for node in graph.get("nodes", []):
+        if node.get("type") != "table":
+            continue
+        table_id = input_tables.get(node["id"]) or node.get("data", {}).get("tableId")
+        if table_id:
+            table_ids.append(int(table_id))
+    return table_ids
+
+
+def _output_tables(output: Optional[dict]) -> List[int]:
+    """Von Output-Nodes gespeicherte Tabellen (Aktion save_table)"""
+    tables = []
+    for value in (output or {}).values():
+        if isinstance(value, dict) and value.get("action") == "save_table" and value.get("table_id") is not None:
+            tables.append(value["table_id"])
+    return tables
+
+
+class _PreparedRun:
+    """Alles, was eine Instanz zur Ausführung braucht (ohne ORM-Objekte)"""
+
+    def __init__(self, run: InstanceRun, graph: dict, plan: Optional[ExecutionPlan],
+                 plan_error: Optional[str], input_params: dict, input_tables: Dict[str, int],
+                 project_id: Optional[int]):
+        self.run = run
+        self.graph = graph
+        self.plan = plan
+        self.plan_error = plan_error
+        self.input_params = input_params
+        self.input_tables = input_tables
+        self.project_id = project_id
+
+
+def prepare_run(db: Session, mode: str, instances: List[WorkflowInstance]) -> Tuple[RunReport, List[_PreparedRun]]:
+    """
+    Legt für jede Instanz eine WorkflowExecution (Status pending) an
+    Ein Commit für alle; Pläne werden pro Workflow einmal erstellt.
+    """
+    if not instances:
+        raise WorkflowRunError("Keine aktiven Workflow-Instanzen gefunden")
+
+    workflow_ids = {instance.workflow_id for instance in instances}
+    cycle_ids = {instance.cycle_id for instance in instances}
+    workflows = {w.id: w for w in db.query(Workflow).filter(Workflow.id.in_(workflow_ids))}
+    cycles = {c.id: c for c in db.query(ProjectCycle).filter(ProjectCycle.id.in_(cycle_ids))}
+
+    plans: Dict[int, Tuple[Optional[ExecutionPlan], Optional[str]]] = {}
+    for workflow_id, workflow in workflows.items():
+        try:
+            plans[workflow_id] = (plan_cache.get(workflow.graph), None)
+        except Exception as e:
+            plans[workflow_id] = (None, str(e))
+
+    prepared = []
+    executions = []
+    for instance in instances:
+        workflow = workflows[instance.workflow_id]
+        cycle = cycles.get(instance.cycle_id)
+        input_tables = _input_tables(instance)
+        input_params = dict(instance.parameters or {})
+        plan, plan_error = plans[workflow.id]
+        run = InstanceRun(
+            instance_id=instance.id,
+            workflow_id=workflow.id,
+            workflow_name=workflow.name,
+            cycle_id=instance.cycle_id,
+            cycle_name=cycle.name if cycle else None
+        )
+        project_id = cycle.project_id if cycle else workflow.project_id
+        executions.append(WorkflowExecution(
+            workflow_id=workflow.id,
+            project_id=project_id,
+            cycle_id=instance.cycle_id,
+            input_params={**input_params, **input_tables},
+            status="pending"
+        ))
+        prepared.append(_PreparedRun(run, workflow.graph, plan, plan_error, input_params, input_tables, project_id))
+
+    for execution in executions:
+        execution.heartbeat_at = _now()
+    db.add_all(executions)
+    db.commit()
+    for item, execution in zip(prepared, executions):
+        item.run.execution_id = execution.id
+    claim_executions(execution.id for execution in executions)
+
+    report = RunReport(mode=mode, runs=[item.run for item in prepared], plans=len(plans))
+    return report, prepared
+
+
+def _run_instance(item: _PreparedRun, session_factory: Callable[[], Session],
+                  shared: SharedTables, node_parallelism: int, on_error: str, use_cache: bool) -> None:
+    db = session_factory()
+    run = item.run
+    try:
+        execution = db.query(WorkflowExecution).filter(WorkflowExecution.id == run.execution_id).first()
+        execution.status = "running"
+        db.commit()
+
+        start_time = time.time()
+        executor = None
+        result = None
+        error = None
+        try:
+            if item.plan_error is not None:
+                raise ValueError(item.plan_error)
+            executor = WorkflowExecutor(
+                db,
+                max_parallelism=node_parallelism,
+                on_error=on_error,
+                project_id=item.project_id,
+                session_factory=session_factory,
+                use_cache=use_cache,
+                input_tables=item.input_tables,
+                shared_tables=shared
+            )
+            result = executor.execute(item.graph, item.input_params, plan=item.plan)
+        except Exception as e:
+            db.rollback()
+            error = e
+        record_execution(execution, executor, result, error, start_time)
+        db.commit()
+
+        run.status = execution.status
+        run.error_message = execution.error_message
+        run.execution_time = execution.execution_time
+        run.output_tables = _output_tables(execution.output_data)
+    except Exception as e:
+        logger.exception("Workflow-Instanz %s konnte nicht ausgeführt werden", run.instance_id)
+        db.rollback()
+        run.status = "failed"
+        run.error_message = str(e)
+        db.query(WorkflowExecution).filter(WorkflowExecution.id == run.execution_id).update(
+            {WorkflowExecution.status: "failed", WorkflowExecution.error_message: str(e)},
+            synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+        release_executions([run.execution_id])
+
+
+def execute_run(
+    report: RunReport,
+    prepared: List[_PreparedRun],
+    session_factory: Callable[[], Session],
+    max_parallelism: Optional[int] = None,
+    node_parallelism: int = 1,
+    on_error: str = ON_ERROR_FAIL_FAST,
+    use_cache: bool = True
+) -> RunReport:
+    """Führt vorbereitete Instanzen parallel aus und füllt den Bericht"""
+    start_time = time.time()
+    usage = Counter()
+    for item in prepared:
+        # Mehrfach gelesene Tabellen nur einmal laden (auch innerhalb einer Instanz)
+        usage.update(_graph_tables(item.graph, item.input_tables))
+    shared = SharedTables(table_id for table_id, count in usage.items() if count > 1)
+
+    workers = max(1, min(max_parallelism or RUNNER_PARALLELISM, len(prepared)))
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="workflow-run") as pool:
+            list(pool.map(
+                lambda item: _run_instance(item, session_factory, shared, node_parallelism, on_error, use_cache),
+                prepared
+            ))
+    finally:
+        shared.clear()
+
+    report.execution_time = time.time() - start_time
+    report.shared_tables = len(shared)
+    report.table_loads = shared.loads
+    report.table_reuses = shared.reuses
+    logger.info(
+        "Workflow-Lauf (%s): %s Instanzen, %s erfolgreich, %s fehlgeschlagen, %.1fs",
+        report.mode, report.total, report.succeeded, report.failed, report.execution_time
+    )
+    return report
+
+
+def run_instances(
+    db: Session,
+    mode: str,
+    instances: List[WorkflowInstance],
+    max_parallelism: Optional[int] = None,
+    node_parallelism: int = 1,
+    on_error: str = ON_ERROR_FAIL_FAST,
+    use_cache: bool = True,
+    session_factory: Optional[Callable[[], Session]] = None
+) -> RunReport:
+    """Führt die Instanzen synchron aus (Sessions je Instanz aus session_factory)"""
+    session_factory = session_factory or sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+    report, prepared = prepare_run(db, mode, instances)
+    return execute_run(report, prepared, session_factory, max_parallelism, node_parallelism, on_error, use_cache)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _run_in_background(report: RunReport, prepared: List[_PreparedRun], options: dict) -> None:
+    try:
+        execute_run(report, prepared, SessionLocal, **options)
+    except Exception:
+        logger.exception("Workflow-Lauf (%s) konnte nicht ausgeführt werden", report.mode)
+
+
+def submit_instances(
+    db: Session,
+    mode: str,
+    instances: List[WorkflowInstance],
+    max_parallelism: Optional[int] = None,
+    node_parallelism: int = 1,
+    on_error: str = ON_ERROR_FAIL_FAST,
+    use_cache: bool = True
+) -> RunReport:
+    """
+    Legt die Ausführungen an und startet den Lauf im Hintergrund
+    (WORKFLOW_RUNNER_WORKERS Läufe gleichzeitig). Der Fortschritt steht in den
+    WorkflowExecution-Einträgen (execution_id im Bericht).
+    """
+    global _executor
+    report, prepared = prepare_run(db, mode, instances)
+    options = dict(max_parallelism=max_parallelism, node_parallelism=node_parallelism,
+                   on_error=on_error, use_cache=use_cache)
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, RUNNER_WORKERS), thread_name_prefix="workflow-runner")
+        _executor.submit(_run_in_background, report, prepared, options)
+    return report
+
+
+# --- Wartung -------------------------------------------------------------------
+
+_maintenance: Optional[threading.Thread] = None
+_maintenance_stop = threading.Event()
+
+
+def _heartbeat() -> None:
+    with _owned_lock:
+        execution_ids = list(_owned)
+    if not execution_ids:
+        return
+    db = SessionLocal()
+    try:
+        db.query(WorkflowExecution).filter(
+            WorkflowExecution.id.in_(execution_ids),
+            WorkflowExecution.status.in_(ACTIVE_STATUSES)
+        ).update({"heartbeat_at": _now()}, synchronize_session=False)
+        db.commit()
+    except Exception:
+        logger.warning("Heartbeat der Workflow-Ausführungen fehlgeschlagen", exc_info=True)
+        db.rollback()
+    finally:
+        db.close()
+
+
+def recover_interrupted_executions() -> int:
+    """
+    Markiert wartende und laufende Ausführungen ohne Heartbeat seit
+    WORKFLOW_RUNNER_STALE_SECONDS als fehlgeschlagen (Prozess beendet, bevor der
+    Lauf fertig war) und setzt last_status der Zeitpläne, deren letzte
+    Ausführung nicht mehr läuft. Gibt die Anzahl der Ausführungen zurück.
+    """
+    db = SessionLocal()
+    try:
+        cutoff = _now() - timedelta(seconds=RUNNER_STALE_SECONDS)
+        with _owned_lock:
+            owned = set(_owned)
+        stale = [
+            execution_id for (execution_id,) in db.query(WorkflowExecution.id).filter(
+                WorkflowExecution.status.in_(ACTIVE_STATUSES),
+                func.coalesce(WorkflowExecution.heartbeat_at, WorkflowExecution.executed_at) < cutoff
+            )
+            if execution_id not in owned
+        ]
+        if stale:
+            db.query(WorkflowExecution).filter(
+                WorkflowExecution.id.in_(stale),
+                WorkflowExecution.status.in_(ACTIVE_STATUSES)
+            ).update({
+                "status": "failed",
+                "error_message": "Ausführung abgebrochen (Server beendet)"
+            }, synchronize_session=False)
+            db.commit()
+            logger.warning("%s abgebrochene Workflow-Ausführung(en) als fehlgeschlagen markiert", len(stale))
+
+        # Zeitpläne, deren letzter Lauf beendet ist, ohne dass der Scheduler es eintragen konnte
+        finished = db.query(WorkflowSchedule, WorkflowExecution.status).join(
+            WorkflowExecution, WorkflowExecution.id == WorkflowSchedule.last_execution_id
+        ).filter(
+            WorkflowSchedule.last_status == "running",
+            WorkflowExecution.status.notin_(ACTIVE_STATUSES)
+        ).all()
+        for schedule, status in finished:
+            schedule.last_status = status
+        db.commit()
+        return len(stale)
+    except Exception:
+        logger.exception("Fehler beim Bereinigen abgebrochener Workflow-Ausführungen")
+        db.rollback()
+        return 0
+    finally:
+        db.close()
+
+
+def _maintain() -> None:
+    while not _maintenance_stop.wait(RUNNER_HEARTBEAT_INTERVAL):
+        _heartbeat()
+        recover_interrupted_executions()
+
+
+def start_runner_maintenance() -> None:
+    """
+    Beim Serverstart: abgebrochene Ausführungen bereinigen, danach Heartbeat
+    und Prüfung alle WORKFLOW_RUNNER_HEARTBEAT_INTERVAL Sekunden
+    """
+    global _maintenance
+    recover_interrupted_executions()
+    with _executor_lock:
+        if _maintenance is None:
+            _maintenance_stop.clear()
+            _maintenance = threading.Thread(target=_maintain, name="workflow-runner-maintenance", daemon=True)
+            _maintenance.start()
+
+
+def shutdown_runner() -> None:
+    global _executor, _maintenance
+    _maintenance_stop.set()
+    with _executor_lock:
+        maintenance, _maintenance = _maintenance, None
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+    if maintenance is not None:
+        maintenance.join(timeout=5)
@@ -0,0 +1,443 @@
+"""
+Zeitgesteuerte Ausführung von Workflow-Instanzen
+
+Zeitpläne stehen in der Tabelle workflow_schedules (Cron-Ausdruck mit fünf
+Feldern: Minute Stunde Tag Monat Wochentag, oder @hourly/@daily/@weekly/
+@monthly/@yearly). Ein Scheduler-Thread prüft alle SCHEDULER_POLL_INTERVAL
+Sekunden, welche Zeitpläne fällig sind, und startet sie über den
+Workflow-Runner (eine WorkflowExecution je Lauf).
+
+Mehrere API-Prozesse: nur der Leader startet Läufe. Unter Postgres ist Leader,
+wer den Advisory-Lock hält (eigene Verbindung, wird bei Verbindungsabbruch
+frei); unter SQLite ist jeder Prozess Leader.
+
+Damit nicht alle Läufe gleichzeitig (z.B. um Mitternacht) starten, wird auf
+jeden Zeitpunkt eine zufällige Verzögerung von bis zu jitter_seconds addiert;
+höchstens SCHEDULER_MAX_CONCURRENT Läufe laufen gleichzeitig. Läuft ein
+Zeitplan noch, wird der nächste Termin übersprungen (Status skipped).
+Verpasste Termine (Server aus) werden einmal nachgeholt, nicht mehrfach.
+
+Eigener Scheduler-Prozess ohne API: python -m workflows.scheduler
+"""
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Set
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine
+from models import Workflow, WorkflowInstance, WorkflowSchedule
+from .runner import (
+    RunReport, WorkflowRunError, execute_run, prepare_run, start_runner_maintenance, shutdown_runner
+)
+
+logger = logging.getLogger(__name__)
+
+MODE_SCHEDULE = "schedule"
+
+# Schlüssel für pg_try_advisory_lock (Leader-Wahl)
+_LEADER_LOCK_KEY = 0x73636864
+
+_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+_MONTH_NAMES = {name: i for i, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1
+)}
+_DAY_NAMES = {name: i for i, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+
+
+class CronError(ValueError):
+    """Ungültiger Cron-Ausdruck oder unbekannte Zeitzone"""
+    pass
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_value(value: str, names: dict, field_name: str) -> int:
+    value = value.lower()
+    if value in names:
+        return names[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise CronError(f"Ungültiger Wert '{value}' im Feld {field_name}")
+
+
+def _parse_field(spec: str, low: int, high: int, field_name: str, names: Optional[dict] = None) -> Set[int]:
+    """'*/15', '1-5', 'mon-fri', '0,30' → Menge erlaubter Werte"""
+    names = names or {}
+    values = set()
+    for part in spec.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = _parse_value(step_text, {}, field_name)
+            if step < 1:
+                raise CronError(f"Ungültige Schrittweite im Feld {field_name}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start = _parse_value(start_text, names, field_name)
+            end = _parse_value(end_text, names, field_name)
+        else:
+            start = _parse_value(part, names, field_name)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise CronError(f"Wert außerhalb von {low}-{high} im Feld {field_name}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """
+    Cron-Ausdruck mit fünf Feldern (Minute Stunde Tag Monat Wochentag)
+    Wie bei cron reicht ein Treffer in Tag oder Wochentag, wenn beide eingeschränkt
+    sind. Ein Feld, das mit * beginnt (auch */2), gilt dabei als uneingeschränkt:
+    '0 3 */2 * 1' läuft nur an ungeraden Tagen, die ein Montag sind.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = _ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise CronError(f"Cron-Ausdruck braucht 5 Felder: '{expression}'")
+        minute, hour, day, month, weekday = fields
+        self.minutes = _parse_field(minute, 0, 59, "Minute")
+        self.hours = _parse_field(hour, 0, 23, "Stunde")
+        self.days = _parse_field(day, 1, 31, "Tag")
+        self.months = _parse_field(month, 1, 12, "Monat", _MONTH_NAMES)
+        # 0 und 7 = Sonntag
+        self.weekdays = {d % 7 for d in _parse_field(weekday, 0, 7, "Wochentag", _DAY_NAMES)}
+        self._any_day = day.startswith("*")
+        self._any_weekday = weekday.startswith("*")
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_match = moment.day in self.days
+        weekday_match = (moment.weekday() + 1) % 7 in self.weekdays
+        # Wie cron: sind Tag und Wochentag eingeschränkt, reicht einer von beiden
+        if not self._any_day and not self._any_weekday:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_after(self, moment: datetime, tz: str = "UTC") -> datetime:
+        """Nächster Zeitpunkt nach moment (UTC) in der Zeitzone tz"""
+        zone = _zone(tz)
+        local = moment.astimezone(zone).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        limit = local.year + 5
+        while local.year <= limit:
+            if local.month not in self.months:
+                local = (local.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(local):
+                local = local.replace(hour=0, minute=0) + timedelta(days=1)
+            elif local.hour not in self.hours:
+                local = local.replace(minute=0) + timedelta(hours=1)
+            elif local.minute not in self.minutes:
+                local += timedelta(minutes=1)
+            else:
+                return local.replace(tzinfo=zone).astimezone(timezone.utc)
+        raise CronError(f"Cron-Ausdruck '{self.expression}' trifft nie zu")
+
+
+def _zone(tz: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise CronError(f"Unbekannte Zeitzone: {tz}")
+
+
+def validate_schedule(cron: str, tz: str) -> None:
+    """Prüft Cron-Ausdruck und Zeitzone (löst CronError aus)"""
+    CronExpression(cron).next_after(_now(), tz)
+
+
+@dataclass
+class SchedulerConfig:
+    enabled: bool = True
+    poll_interval: float = 30.0
+    max_concurrent: int = 2
+    jitter_seconds: int = 300  # wenn der Zeitplan keinen eigenen Wert hat
+
+    @classmethod
+    def from_env(cls) -> "SchedulerConfig":
+        return cls(
+            enabled=os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes"),
+            poll_interval=float(os.getenv("SCHEDULER_POLL_INTERVAL", "30")),
+            max_concurrent=int(os.getenv("SCHEDULER_MAX_CONCURRENT", "2")),
+            jitter_seconds=int(os.getenv("SCHEDULER_JITTER_SECONDS", "300")),
+        )
+
+
+def compute_next_run(schedule: WorkflowSchedule, after: Optional[datetime] = None,
+                default_jitter: Optional[int] = None) -> datetime:
+    """Nächster Termin eines Zeitplans inklusive zufälliger Verzögerung"""
+    moment = CronExpression(schedule.cron).next_after(after or _now(), schedule.timezone or "UTC")
+    jitter = schedule.jitter_seconds
+    if jitter is None:
+        jitter = default_jitter if default_jitter is not None else SchedulerConfig.from_env().jitter_seconds
+    if jitter > 0:
+        moment += timedelta(seconds=random.uniform(0, jitter))
+    return moment
+
+
+class WorkflowScheduler:
+    """Thread, der fällige Zeitpläne startet (nur als Leader)"""
+
+    def __init__(
+        self,
+        config: Optional[SchedulerConfig] = None,
+        session_factory: Callable[[], Session] = SessionLocal
+    ):
+        self.config = config or SchedulerConfig.from_env()
+        self.session_factory = session_factory
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, self.config.max_concurrent), thread_name_prefix="workflow-schedule"
+        )
+        self._running: Set[int] = set()  # Zeitplan-IDs mit laufender Ausführung
+        self._state_lock = threading.Lock()
+        self._leader_connection = None
+        self.is_leader = False
+
+    def start(self) -> "WorkflowScheduler":
+        self._thread = threading.Thread(target=self._loop, name="workflow-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(
+            "Workflow-Scheduler gestartet (max. %s gleichzeitig, alle %ss)",
+            self.config.max_concurrent, self.config.poll_interval
+        )
+        return self
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._release_leadership()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def status(self) -> dict:
+        with self._state_lock:
+            running = sorted(self._running)
+        return {
+            "enabled": True,
+            "leader": self.is_leader,
+            "running": running,
+            "max_concurrent": self.config.max_concurrent,
+            "poll_interval": self.config.poll_interval,
+        }
+
+    # Leader-Wahl -------------------------------------------------------------
+
+    def _acquire_leadership(self) -> bool:
+        if engine.dialect.name != "postgresql":
+            self.is_leader = True
+            return True
+
+        if self._leader_connection is not None:
+            try:
+                self._leader_connection.execute(text("SELECT 1"))
+                self._leader_connection.commit()
+                return True
+            except Exception:
+                logger.warning("Verbindung mit Scheduler-Lock verloren, Leader-Rolle abgegeben")
+                self._release_leadership()
+
+        connection = engine.connect()
+        try:
+            acquired = connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": _LEADER_LOCK_KEY}
+            ).scalar()
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+        if not acquired:
+            connection.close()
+            self.is_leader = False
+            return False
+        logger.info("Workflow-Scheduler ist Leader")
+        self._leader_connection = connection
+        self.is_leader = True
+        return True
+
+    def _release_leadership(self) -> None:
+        connection, self._leader_connection = self._leader_connection, None
+        self.is_leader = False
+        if connection is None:
+            return
+        try:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _LEADER_LOCK_KEY})
+            connection.commit()
+        except Exception:
+            pass
+        finally:
+            connection.close()
+
+    # Auslösen ----------------------------------------------------------------
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self._acquire_leadership():
+                    self.tick()
+            except Exception:
+                logger.exception("Fehler im Workflow-Scheduler")
+            self._wake.wait(self.config.poll_interval)
+            self._wake.clear()
+
+    def _skip(self, schedule: WorkflowSchedule, now: datetime, reason: str) -> None:
+        logger.warning("Zeitplan %s übersprungen: %s", schedule.id, reason)
+        schedule.last_status = "skipped"
+        schedule.next_run_at = compute_next_run(schedule, now, self.config.jitter_seconds)
+
+    def tick(self) -> List[int]:
+        """Startet fällige Zeitpläne; gibt die IDs der gestarteten zurück"""
+        started = []
+        db = self.session_factory()
+        try:
+            now = _now()
+            due = db.query(WorkflowSchedule).filter(
+                WorkflowSchedule.is_active == True,
+                WorkflowSchedule.next_run_at != None,
+                WorkflowSchedule.next_run_at <= now
+            ).order_by(WorkflowSchedule.next_run_at).all()
+
+            for schedule in due:
+                with self._state_lock:
+                    busy = len(self._running)
+                    overlapping = schedule.id in self._running
+                if overlapping:
+                    self._skip(schedule, now, "vorheriger Lauf läuft noch")
+                    db.commit()
+                    continue
+                if busy >= self.config.max_concurrent:
+                    # Bleibt fällig und startet, sobald ein Platz frei wird
+                    break
+
+                instance = db.query(WorkflowInstance).filter(WorkflowInstance.id == schedule.instance_id).first()
+                workflow = instance and db.query(Workflow).filter(Workflow.id == instance.workflow_id).first()
+                if not instance or not instance.is_active or not workflow or not workflow.is_active:
+                    self._skip(schedule, now, "Instanz oder Workflow nicht aktiv")
+                    db.commit()
+                    continue
+
+                try:
+                    report, prepared = prepare_run(db, MODE_SCHEDULE, [instance])
+                except WorkflowRunError as e:
+                    self._skip(schedule, now, str(e))
+                    db.commit()
+                    continue
+
+                schedule.last_run_at = now
+                schedule.last_execution_id = report.runs[0].execution_id
+                schedule.last_status = "running"
+                schedule.next_run_at = compute_next_run(schedule, now, self.config.jitter_seconds)
+                db.commit()
+
+                with self._state_lock:
+                    self._running.add(schedule.id)
+                self._pool.submit(self._execute, schedule.id, report, prepared)
+                started.append(schedule.id)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return started
+
+    def _execute(self, schedule_id: int, report: RunReport, prepared: list) -> None:
+        try:
+            execute_run(report, prepared, self.session_factory, max_parallelism=1)
+            db = self.session_factory()
+            try:
+                db.query(WorkflowSchedule).filter(
+                    WorkflowSchedule.id == schedule_id,
+                    WorkflowSchedule.last_execution_id == report.runs[0].execution_id
+                ).update({"last_status": report.status}, synchronize_session=False)
+                db.commit()
+            finally:
+                db.close()
+        except Exception:
+            logger.exception("Zeitplan %s konnte nicht ausgeführt werden", schedule_id)
+        finally:
+            with self._state_lock:
+                self._running.discard(schedule_id)
+            # Wartende fällige Zeitpläne sofort nachziehen
+            self._wake.set()
+
+
+_scheduler: Optional[WorkflowScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(config: Optional[SchedulerConfig] = None) -> Optional[WorkflowScheduler]:
+    """Startet den Scheduler dieses Prozesses (nicht bei SCHEDULER_ENABLED=false)"""
+    global _scheduler
+    config = config or SchedulerConfig.from_env()
+    with _scheduler_lock:
+        if _scheduler is None and config.enabled:
+            _scheduler = WorkflowScheduler(config).start()
+        return _scheduler
+
+
+def stop_scheduler() -> None:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.stop()
+            _scheduler = None
+
+
+def scheduler_status() -> dict:
+    if _scheduler is None:
+        return {"enabled": False, "leader": False, "running": []}
+    return _scheduler.status()
+
+
+def wake_scheduler() -> None:
+    """Nach Änderungen an Zeitplänen sofort neu prüfen"""
+    if _scheduler is not None:
+        _scheduler.wake()
+
+
+def main():
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # Eigener Prozess: unabhängig von SCHEDULER_ENABLED (das dann für die API-Prozesse gilt)
+    config = SchedulerConfig.from_env()
+    config.enabled = True
+    # Heartbeat der gestarteten Läufe, sonst gelten sie in den API-Prozessen als abgebrochen
+    start_runner_maintenance()
+    start_scheduler(config)
+    try:
+        while True:
+            threading.Event().wait(3600)
+    except KeyboardInterrupt:
+        stop_scheduler()
+        shutdown_runner()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,8 +13,11 @@ function TableEdit() {
   const [loading, setLoading] = useState(true)
   const [nextColumnId, setNextColumnId] = useState(1)
   const [nextRowId, setNextRowId] = useState(1)
+  const [version, setVersion] = useState(null)
   
   const inputRef = useRef(null)
+  // Zuletzt gespeicherter Stand, für zeilenweise Änderungen (PATCH)
+  const savedRef = useRef({ name: '', columns: '[]', rows: new Map() })
 
   const columnTypes = [
     { id: 'string', label: 'Text', icon: '📝' },
@@ -46,6 +49,8 @@ function TableEdit() {
       setTableName(table.name)
       setColumns(table.columns)
       setData(table.data)
+      setVersion(table.version)
+      rememberSaved(table.name, table.columns, table.data)
       
       // Berechne nächste IDs
       if (table.columns.length > 0) {
@@ -63,6 +68,37 @@ function TableEdit() {
     }
   }
 
+  const rememberSaved = (name, cols, rows) => {
+    savedRef.current = {
+      name,
+      columns: JSON.stringify(cols),
+      rows: new Map(rows.map(row => [row.id, row]))
+    }
+  }
+
+  // Unterschiede zum gespeicherten Stand: neue, geänderte und gelöschte Zeilen
+  const collectRowChanges = () => {
+    const saved = savedRef.current.rows
+    const insert = []
+    const update = []
+    const currentIds = new Set()
+    data.forEach(row => {
+      currentIds.add(row.id)
+      const before = saved.get(row.id)
+      if (!before) {
+        insert.push(row)
+        return
+      }
+      const values = {}
+      Object.keys(row).forEach(key => {
+        if (key !== 'id' && row[key] !== before[key]) values[key] = row[key]
+      })
+      if (Object.keys(values).length > 0) update.push({ id: row.id, values })
+    })
+    const deleted = [...saved.keys()].filter(id => !currentIds.has(id))
+    return { insert, update, delete: deleted }
+  }
+
   const formatValue = (value, type) => {
     if (!value || value === '') return value
 
@@ -263,28 +299,63 @@ function TableEdit() {
     setData(data.filter(row => row.id !== rowId))
   }
 
+  const putTable = async (tableData) => {
+    const response = await fetch(`http://localhost:8000/api/tables/${tableId}`, {
+      method: 'PUT',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      // Geladene Version mitsenden: hat sich die Tabelle inzwischen geändert, antwortet das Backend mit 409
+      body: JSON.stringify({ version: version, ...tableData })
+    })
+
+    if (response.status === 409) {
+      throw new Error('Die Tabelle wurde zwischenzeitlich geändert, bitte neu laden')
+    }
+    if (!response.ok) {
+      throw new Error('Speichern fehlgeschlagen')
+    }
+    return response.json()
+  }
+
   const saveTable = async () => {
     try {
-      const tableData = {
-        name: tableName,
-        columns: columns,
-        data: data
+      let result
+      
+      if (JSON.stringify(columns) !== savedRef.current.columns) {
+        // Spalten geändert: ganze Tabelle neu schreiben
+        result = await putTable({ name: tableName, columns: columns, data: data })
+      } else {
+        if (tableName !== savedRef.current.name) {
+          result = await putTable({ name: tableName })
+        }
+        
+        // Nur geänderte Zeilen senden
+        const changes = collectRowChanges()
+        if (changes.insert.length || changes.update.length || changes.delete.length) {
+          const response = await fetch(`http://localhost:8000/api/tables/${tableId}/rows`, {
+            method: 'PATCH',
+            headers: {
+              'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ version: result ? result.version : version, ...changes })
+          })
+          
+          if (response.status === 409) {
+            throw new Error('Die Tabelle wurde zwischenzeitlich geändert, bitte neu laden')
+          }
+          if (!response.ok) {
+            throw new Error('Speichern fehlgeschlagen')
+          }
+          result = { ...result, ...(await response.json()) }
+        }
       }
-
-      const response = await fetch(`http://localhost:8000/api/tables/${tableId}`, {
-        method: 'PUT',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify(tableData)
-      })
-
-      if (!response.ok) {
-        throw new Error('Speichern fehlgeschlagen')
+      
+      if (result) {
+        setVersion(result.version)
+        rememberSaved(tableName, columns, data)
       }
-
-      const result = await response.json()
-      alert(`✓ Tabelle "${tableName}" wurde aktualisiert!\n${result.row_count} Zeilen × ${result.column_count} Spalten`)
+      alert(`✓ Tabelle "${tableName}" wurde aktualisiert!\n${data.length} Zeilen × ${columns.length} Spalten`)
       
     } catch (error) {
       console.error('Fehler beim Speichern:', error)